@@ -0,0 +1,61 @@
+"""User-level cache folder and cache file helpers shared by clickable
+features."""
+
+import os
+import os.path
+import time
+
+# files modified less than RACY_DELAY seconds ago have a racy mtime: a
+# later modification could keep the same stat
+RACY_DELAY = 2
+
+
+def cache_dir(*parts):
+    """
+    Return clickable cache folder, or a sub-folder if ``parts`` are
+    given. Folder is not created.
+
+    CLICKABLE_CACHE_DIR overrides default location
+    ($XDG_CACHE_HOME/clickable, ~/.cache/clickable as a fallback).
+    """
+    base = os.environ.get('CLICKABLE_CACHE_DIR', None)
+    if not base:
+        xdg_cache_home = os.environ.get('XDG_CACHE_HOME', None) \
+            or os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(xdg_cache_home, 'clickable')
+    return os.path.join(base, *parts)
+
+
+def _stat_key(stat):
+    """Key of a file version: mtime, ctime, size, inode and device."""
+    return [stat.st_mtime_ns, stat.st_ctime_ns, stat.st_size, stat.st_ino,
+            stat.st_dev]
+
+
+def _is_racy(stat):
+    """True if ``stat`` mtime is too recent for `_stat_key` to be
+    trusted."""
+    return time.time() - stat.st_mtime < RACY_DELAY
+
+
+def _atomic_write(path, write, mode='w'):
+    """
+    Replace ``path`` with content written by ``write(f)`` into a
+    temporary sibling file: readers never see a partial file and a
+    hardlinked copy is never modified in place. Parent folder is
+    created; temporary file is removed on error, which is re-raised.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
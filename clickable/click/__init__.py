@@ -1,7 +1,7 @@
 # -*- encoding: utf-8 -*-
 
 """main is the command entry point. It search a clickables.py file in current
-directory, then a no args callable from the file.
+directory or its parents, then a no args callable from the file.
 
 This callable is determined from:
 
@@ -25,7 +25,6 @@ Other rules for callable key, callable name and callable lookup behavior:
 import collections.abc
 import os
 import os.path
-import pprint
 import re
 import sys
 
@@ -67,7 +66,7 @@ def _import(filename, loader=__import__):
     dirname = os.path.abspath(os.path.dirname(filename))
     if not dirname in sys.path:
         sys.path.insert(0, dirname)
-    mod = re.sub(r"\.py$", "", filename)
+    mod = re.sub(r"\.py$", "", os.path.basename(filename))
     return loader(mod)
 
 
@@ -84,6 +83,7 @@ def _find_callable(module):
     callable_name = _find_callable_name(mapping, callable_key)
     if not isinstance(callable_name, str):
         _error("Callable name {} invalid for {}".format(callable_name, callable_key))
+        import pprint
         _error("Candidate maping: {}".format(pprint.pprint(mapping)))
         _error("Abort!", )
         return False
@@ -92,7 +92,8 @@ def _find_callable(module):
         if not func and mapping is None:
             func = getattr(module, "main", None)
         if not callable(func):
-            _error("Attribute {} is not a callable: {}]".format(callable_name, func))
+            _error("Attribute {} is not a callable: {}]"
+                   .format(callable_name, func))
             _error("Abort!")
             return False
         else:
@@ -113,26 +114,152 @@ def main():
     `sys.argv[0]` is modified to replace `[^-.]` by `_`. Behavior
     with other not alphabetic, not numeric chars is undetermined.
 
-    Folder containing `clickables.py` is added to `sys.path`.
+    `clickables.py` is searched in current folder, then in parent
+    folders up to VCS root (see `clickable.click.discovery`). Folder
+    containing `clickables.py` is added to `sys.path`.
+
+    With CLICKABLE_DAEMON=1, command is run by a forkserver daemon
+    (see `clickable.click.daemon`), started on first use.
     """
-    # load module
+    from clickable.click.discovery import _project_root
+    project_root = _project_root(os.getcwd())
+    if project_root is not None:
+        filename = os.path.join(project_root, "clickables.py")
+    else:
+        filename = "clickables.py"
+    if sys.argv[1:] == ["--list"] \
+            and os.path.basename(sys.argv[0]) == "clickable":
+        sys.exit(_list(filename))
+    prog_name = os.path.basename(sys.argv[0]) if sys.argv else ""
+    from clickable.click import completion
+    completion_instruction = completion._completion_instruction(prog_name)
+    if completion_instruction is not None:
+        code = completion._complete_from_cache(filename, prog_name,
+                                               *completion_instruction)
+        if code is not None:
+            sys.exit(code)
+    elif _daemon_enabled():
+        # completion is not delegated, so that its cache is filled
+        from clickable.click.daemon import _daemon_client
+        code = _daemon_client(project_root or os.getcwd())
+        if code is not None:
+            sys.exit(code)
+    callable_name = _static_callable_name(filename)
+    module = _load(filename)
+    func = _resolve(module, callable_name)
+    if completion_instruction is not None:
+        completion._cache_completion(filename, func, prog_name)
+    _call(func)
+
+
+def _static_callable_name(filename):
+    """Resolve callable name without executing `filename`. Abort if
+    resolution fails for sure; return None if name cannot be statically
+    determined.
+
+    Resolved names are cached (see `clickable.click.dispatch`)."""
+    from clickable.click import dispatch
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    argv0 = sys.argv[0]
+    cached = dispatch._read_dispatch(filename, stat, argv0)
+    if cached is not None:
+        if _clickable_debug():
+            _error("Dispatch cache hit for {}: {}"
+                   .format(argv0, cached["callable_name"]))
+        return cached["callable_name"]
+    if _clickable_debug():
+        _error("Dispatch cache miss for {}".format(argv0))
+    from clickable.click import static
+    try:
+        static_module = static._parse(filename)
+    except (SyntaxError, ValueError, OSError):
+        # reported by module loading
+        return None
+    resolution = static._static_resolve(static_module, _get_callable_key())
+    if resolution.status == static.ERROR:
+        _error(resolution.message)
+        if resolution.mapping is not None:
+            import pprint
+            _error("Candidate maping: {}"
+                   .format(pprint.pformat(resolution.mapping)))
+        _error("Abort!")
+        sys.exit(2)
+    elif resolution.status == static.OK:
+        dispatch._write_dispatch(filename, stat, argv0,
+                                 resolution.callable_name, resolution.mapping)
+        return resolution.callable_name
+    return None
+
+
+def _list(filename):
+    """Print entry points of `filename` (`clickable --list`), without
+    executing it. Return exit code."""
+    if not os.path.isfile(filename):
+        _error("Filename {} not found.".format(filename))
+        return 2
+    from clickable.click import static
+    try:
+        entry_points = static._entry_points(static._parse(filename))
+    except SyntaxError as e:
+        _error("{} cannot be parsed: {}".format(filename, e))
+        return 2
+    if entry_points is None:
+        _error("Entry points of {} cannot be determined statically."
+               .format(filename))
+        return 2
+    for key, callable_name in entry_points:
+        print("{}: {}".format(key if key is not None else "*", callable_name))
+    return 0
+
+
+def _daemon_enabled():
+    return os.environ.get("CLICKABLE_DAEMON", "").lower() \
+        in ("true", "1", "yes")
+
+
+def _load(filename):
+    """Load `filename` module; abort with an error message on failure."""
     try:
-        module = _import("clickables.py")
+        return _import(filename)
     except Exception as e:
-        _error("clickables.py cannot be loaded.")
+        _error("{} cannot be loaded.".format(filename))
         if _clickable_debug():
             import traceback
-            traceback.print_exc(e, file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
         else:
             _error(str(e))
             _error("Use CLICKABLE_DEBUG=1 to get details.")
-            sys.exit(2)
+        sys.exit(2)
+
+
+def _run(module, callable_name=None):
+    """Find and run expected callable from `module`. `callable_name`
+    skips lookup if already known."""
+    _call(_resolve(module, callable_name))
 
-    func = _find_callable(module)
+
+def _resolve(module, callable_name=None):
+    """Find expected callable from `module`; abort on failure."""
+    if callable_name is not None:
+        func = getattr(module, callable_name, None)
+        if not callable(func):
+            _error("Attribute {} is not a callable: {}]"
+                   .format(callable_name, func))
+            _error("Abort!")
+            sys.exit(2)
+    else:
+        func = _find_callable(module)
     if not func:
         # Error message previously printed
         sys.exit(2)
+    return func
+
 
+def _call(func):
+    """Run `func`; uncaught errors abort with an error message."""
     try:
         func()
     except Exception as e:
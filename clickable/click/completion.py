@@ -0,0 +1,258 @@
+# -*- encoding: utf-8 -*-
+
+"""Cached shell completion data.
+
+When click shell completion is requested (`_{PROG}_COMPLETE` variable),
+the command tree (commands, options, arguments, static choices and help
+strings) is dumped to `__pycache__/clickables.clickable-completion.json`
+after a first regular completion. Next completion requests rebuild a
+lightweight click command tree from this file and let click answer,
+without loading `clickables.py`, `clickables.yml` or extensions.
+
+Cache is keyed by `clickables.py` and `clickables.yml` stat, and by
+clickable and click versions. Trees using dynamic completion (custom
+`shell_complete` callbacks or parameter types) are not cached."""
+
+import json
+import os
+import os.path
+
+from clickable.cache import _atomic_write
+from clickable.cache import _is_racy
+from clickable.cache import _stat_key
+
+VERSION = 1
+WATCHED = ['clickables.py', 'clickables.yml']
+
+
+class _Dynamic(Exception):
+    """Command tree cannot be cached."""
+
+
+def _completion_instruction(prog_name):
+    """(complete_var, instruction) if a completion is requested for
+    `prog_name`, else None. Only `*_complete` instructions are handled
+    (`*_source` is left to click)."""
+    complete_var = '_{}_COMPLETE'.format(prog_name) \
+        .replace('-', '_').replace('.', '_').upper()
+    instruction = os.environ.get(complete_var, None)
+    if not instruction or not instruction.endswith('_complete'):
+        return None
+    return complete_var, instruction
+
+
+def _completion_cache_path(filename):
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    module = os.path.splitext(basename)[0]
+    return os.path.join(dirname, '__pycache__',
+                        '{}.clickable-completion.json'.format(module))
+
+
+def _cache_key(filename):
+    """Stat of watched files and versions; None if a watched file is too
+    recently modified to be safely cached."""
+    import click
+    import clickable
+    dirname = os.path.dirname(os.path.abspath(filename))
+    stats = []
+    for name in WATCHED:
+        try:
+            stat = os.stat(os.path.join(dirname, name))
+        except OSError:
+            stats.append(None)
+            continue
+        if _is_racy(stat):
+            return None
+        stats.append(_stat_key(stat))
+    return [stats, clickable.__version__, click.__version__]
+
+
+def _complete_from_cache(filename, prog_name, complete_var, instruction):
+    """Answer completion from cache; return exit code, or None on
+    cache miss."""
+    try:
+        with open(_completion_cache_path(filename)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get('version') != VERSION:
+        return None
+    tree = cache.get('trees', {}).get(prog_name, None)
+    if tree is None:
+        return None
+    key = _cache_key(filename)
+    if key is None or cache.get('key') != key:
+        return None
+    from click.shell_completion import shell_complete
+    return shell_complete(_load_command(tree), {}, prog_name, complete_var,
+                          instruction)
+
+
+def _cache_completion(filename, command, prog_name):
+    """Dump `command` tree to cache. Dynamic trees and write errors are
+    ignored."""
+    import click
+    if not isinstance(command, click.BaseCommand):
+        return
+    key = _cache_key(filename)
+    if key is None:
+        return
+    try:
+        tree = _dump_command(command, click.Context(command,
+                                                    info_name=prog_name))
+    except _Dynamic:
+        return
+    path = _completion_cache_path(filename)
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if not isinstance(cache, dict) or cache.get('version') != VERSION \
+                or cache.get('key') != key:
+            cache = None
+    except (OSError, ValueError):
+        cache = None
+    if cache is None:
+        cache = {'version': VERSION, 'key': key, 'trees': {}}
+    cache['trees'][prog_name] = tree
+    try:
+        _atomic_write(path, lambda f: json.dump(cache, f))
+    except (OSError, TypeError, ValueError):
+        pass
+
+
+def _dump_command(command, ctx):
+    import click
+    if type(command).shell_complete not in (
+            click.BaseCommand.shell_complete, click.Command.shell_complete,
+            click.MultiCommand.shell_complete):
+        raise _Dynamic()
+    tree = {
+        'name': command.name,
+        'params': [_dump_param(param) for param in command.params],
+        'add_help_option': getattr(command, 'add_help_option', True),
+        'context_settings': _dump_context_settings(command.context_settings),
+        'hidden': getattr(command, 'hidden', False),
+        'short_help': command.get_short_help_str()
+        if isinstance(command, click.Command) else None,
+    }
+    if isinstance(command, click.MultiCommand):
+        commands = {}
+        for name in command.list_commands(ctx):
+            subcommand = command.get_command(ctx, name)
+            if subcommand is None:
+                continue
+            commands[name] = _dump_command(
+                subcommand, click.Context(subcommand, info_name=name,
+                                          parent=ctx))
+        tree['commands'] = commands
+        tree['chain'] = command.chain
+    return tree
+
+
+def _dump_context_settings(context_settings):
+    result = {}
+    for name in ['allow_extra_args', 'allow_interspersed_args',
+                 'ignore_unknown_options', 'help_option_names',
+                 'token_normalize_func']:
+        if name in context_settings:
+            if name == 'token_normalize_func':
+                raise _Dynamic()
+            result[name] = context_settings[name]
+    return result
+
+
+def _dump_param(param):
+    import click
+    if getattr(param, '_custom_shell_complete', None) is not None:
+        raise _Dynamic()
+    result = {
+        'kind': 'option' if isinstance(param, click.Option) else 'argument',
+        'name': param.name,
+        'opts': list(param.opts),
+        'secondary_opts': list(param.secondary_opts),
+        'nargs': param.nargs,
+        'multiple': param.multiple,
+        'required': param.required,
+        'type': _dump_type(param.type),
+    }
+    if isinstance(param, click.Option):
+        result.update({
+            'is_flag': param.is_flag,
+            'count': param.count,
+            'hidden': param.hidden,
+            'help': param.help,
+        })
+    return result
+
+
+def _dump_type(param_type):
+    import click
+    if type(param_type).shell_complete not in (
+            click.ParamType.shell_complete, click.Choice.shell_complete,
+            click.Path.shell_complete, click.File.shell_complete):
+        raise _Dynamic()
+    if isinstance(param_type, click.Choice):
+        return {'kind': 'choice',
+                'choices': [str(c) for c in param_type.choices],
+                'case_sensitive': param_type.case_sensitive}
+    if isinstance(param_type, click.Path):
+        return {'kind': 'path', 'file_okay': param_type.file_okay,
+                'dir_okay': param_type.dir_okay}
+    if isinstance(param_type, click.File):
+        return {'kind': 'file'}
+    if isinstance(param_type, click.Tuple):
+        return {'kind': 'tuple',
+                'types': [_dump_type(t) for t in param_type.types]}
+    if isinstance(param_type, click.types.BoolParamType):
+        return {'kind': 'bool'}
+    return {'kind': 'string'}
+
+
+def _load_command(tree):
+    import click
+    params = [_load_param(param) for param in tree['params']]
+    kwargs = dict(params=params, add_help_option=tree['add_help_option'],
+                  context_settings=tree['context_settings'],
+                  hidden=tree['hidden'], short_help=tree['short_help'])
+    if 'commands' in tree:
+        commands = dict((name, _load_command(subtree))
+                        for name, subtree in tree['commands'].items())
+        return click.Group(tree['name'], commands=commands,
+                           chain=tree['chain'], **kwargs)
+    return click.Command(tree['name'], **kwargs)
+
+
+def _load_param(tree):
+    import click
+    param_type = _load_type(tree['type'])
+    if tree['kind'] == 'option':
+        param = click.Option(
+            tree['opts'], type=None if tree['is_flag'] else param_type,
+            is_flag=tree['is_flag'] or None, count=tree['count'],
+            multiple=tree['multiple'], hidden=tree['hidden'],
+            help=tree['help'],
+            nargs=1 if tree['is_flag'] or tree['count'] else tree['nargs'])
+    else:
+        param = click.Argument(tree['opts'], type=param_type,
+                               nargs=tree['nargs'], required=tree['required'])
+    param.name = tree['name']
+    param.secondary_opts = tree['secondary_opts']
+    return param
+
+
+def _load_type(tree):
+    import click
+    kind = tree['kind']
+    if kind == 'choice':
+        return click.Choice(tree['choices'],
+                            case_sensitive=tree['case_sensitive'])
+    if kind == 'path':
+        return click.Path(file_okay=tree['file_okay'],
+                          dir_okay=tree['dir_okay'])
+    if kind == 'file':
+        return click.File()
+    if kind == 'tuple':
+        return click.Tuple([_load_type(t) for t in tree['types']])
+    if kind == 'bool':
+        return click.BOOL
+    return click.STRING
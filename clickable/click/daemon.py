@@ -0,0 +1,435 @@
+# -*- encoding: utf-8 -*-
+
+"""Forkserver daemon for the `clickable` entry point.
+
+A daemon is started per project folder. It preloads click, coloredlogs,
+yaml and the project `clickables.py`, then listens on a Unix socket.
+Each request forks a worker that runs the command with the client's
+argv, environment, current directory and stdio (file descriptors are
+passed with SCM_RIGHTS).
+
+Protocol: client sends a JSON request (argv, env, cwd) along with its
+stdin, stdout and stderr file descriptors. Daemon answers with
+newline-delimited JSON messages: ``{"pid": <worker pid>}`` then
+``{"exit": <exit code>}``, or ``{"stale": true}`` if `clickables.py` or
+`clickables.yml` changed since daemon startup; daemon then stops and
+client runs the command itself.
+
+Daemon stops after `CLICKABLE_DAEMON_IDLE` seconds (default 900)
+without request.
+
+Sockets live in a private (0700) per-user folder, and both sides check
+the peer user id (SO_PEERCRED) before exchanging anything."""
+
+import array
+import errno
+import hashlib
+import json
+import os
+import os.path
+import select
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+
+# modules preloaded by daemon
+PRELOAD = ['click', 'coloredlogs', 'yaml', 'blessings']
+# files whose modification invalidates daemon
+WATCHED = ['clickables.py', 'clickables.yml']
+MAX_REQUEST = 1024 * 1024
+DEFAULT_IDLE = 900
+
+
+def _runtime_dir():
+    """Private per-user folder for sockets, in XDG_RUNTIME_DIR or
+    temporary folder. Raises an exception if an existing folder is not
+    owned by current user or is accessible by others."""
+    base_dir = os.environ.get('XDG_RUNTIME_DIR', None) \
+        or tempfile.gettempdir()
+    path = os.path.join(base_dir, 'clickable-{}'.format(os.getuid()))
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() \
+            or info.st_mode & 0o077:
+        raise Exception('clickable: unsafe runtime folder {}'.format(path))
+    return path
+
+
+def _socket_path(project_dir):
+    """Per-user, per-project socket path."""
+    key = hashlib.sha256(os.path.abspath(project_dir).encode('utf-8')) \
+        .hexdigest()[0:16]
+    return os.path.join(_runtime_dir(), 'daemon-{}.sock'.format(key))
+
+
+def _peer_uid(sock):
+    """User id of a connected Unix socket peer; None if the platform
+    does not tell it (private runtime folder is then the only
+    protection)."""
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = struct.Struct('3i')
+    pid, uid, gid = credentials.unpack(sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return uid
+
+
+def _trusted(sock):
+    uid = _peer_uid(sock)
+    return uid is None or uid == os.getuid()
+
+
+def _stamp(project_dir):
+    """(mtime, size) of watched files; None for missing files."""
+    stamp = []
+    for name in WATCHED:
+        try:
+            stat = os.stat(os.path.join(project_dir, name))
+            stamp.append([stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def _send_fds(sock, data, fds):
+    """Send data along with file descriptors."""
+    sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                  array.array('i', fds))])
+    sock.sendall(data[sent:])
+
+
+def _recv_fds(sock, size, maxfds):
+    fds = array.array('i')
+    data, ancdata, flags, addr = sock.recvmsg(
+        size, socket.CMSG_LEN(maxfds * fds.itemsize))
+    for level, type_, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data)
+                                    - (len(cmsg_data) % fds.itemsize)])
+    return data, list(fds)
+
+
+def _messages(sock):
+    """Iterate over newline-delimited JSON messages."""
+    buffer = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return
+        buffer += chunk
+        while b'\n' in buffer:
+            line, buffer = buffer.split(b'\n', 1)
+            yield json.loads(line.decode('utf-8'))
+
+
+def _send_message(sock, message):
+    sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+
+def _daemon_client(project_dir):
+    """
+    Run current command through project daemon. Returns exit code, or
+    None if daemon is not available (a daemon is then started in
+    background for next calls) or stale.
+    """
+    request = {'argv': sys.argv, 'env': dict(os.environ), 'cwd': os.getcwd()}
+    try:
+        path = _socket_path(project_dir)
+    except Exception:
+        return None
+    status, code = _call(path, request)
+    if status != DONE:
+        _spawn(project_dir)
+    return code
+
+
+# _call status
+DONE = 'done'
+UNAVAILABLE = 'unavailable'
+STALE = 'stale'
+
+
+def _call(path, request):
+    """
+    Send `request` (argv, env, cwd) and stdio to server listening on
+    `path`. Returns (status, exit code); exit code is None if status is
+    not DONE.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return UNAVAILABLE, None
+    with sock:
+        if not _trusted(sock):
+            return UNAVAILABLE, None
+        data = json.dumps(request).encode('utf-8')
+        if len(data) > MAX_REQUEST:
+            return UNAVAILABLE, None
+        for stream in (sys.stdout, sys.stderr):
+            stream.flush()
+        try:
+            _send_fds(sock, data, [0, 1, 2])
+            sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            # server is stopping
+            return STALE, None
+        pid = None
+        # signal handlers can only be set from main thread
+        main_thread = threading.current_thread() is threading.main_thread()
+        if main_thread:
+            previous_handler = signal.getsignal(signal.SIGINT)
+
+            def forward(signum, frame):
+                if pid:
+                    os.kill(pid, signum)
+            signal.signal(signal.SIGINT, forward)
+        try:
+            for message in _messages(sock):
+                if message.get('stale'):
+                    return STALE, None
+                if 'pid' in message:
+                    pid = message['pid']
+                if 'exit' in message:
+                    return DONE, message['exit']
+        finally:
+            if main_thread:
+                signal.signal(signal.SIGINT, previous_handler)
+    # worker died without reporting exit code
+    return DONE, 1
+
+
+def _spawn(project_dir):
+    """Start a detached daemon for project_dir."""
+    if not os.path.isfile(os.path.join(project_dir, 'clickables.py')):
+        return
+    subprocess.Popen([sys.executable, '-m', 'clickable.click.daemon',
+                      os.path.abspath(project_dir)],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, cwd=project_dir,
+                     start_new_session=True)
+
+
+def _bind(path):
+    """Bind listening socket; a leftover socket file of a dead daemon is
+    removed. Returns None if another daemon is running."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # socket file is created with 0600 mode, not changed after bind
+    umask = os.umask(0o177)
+    try:
+        sock.bind(path)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE:
+            raise
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+            # a daemon is alive
+            sock.close()
+            return None
+        except OSError:
+            os.unlink(path)
+            sock.bind(path)
+        finally:
+            probe.close()
+    finally:
+        os.umask(umask)
+    sock.listen(16)
+    return sock
+
+
+def _daemon(project_dir):
+    """Daemon main loop."""
+    from clickable.click import _import
+    from clickable.click import _run
+    project_dir = os.path.abspath(project_dir)
+    os.chdir(project_dir)
+    for name in PRELOAD:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+    stamp = _stamp(project_dir)
+    module = _import(os.path.join(project_dir, 'clickables.py'))
+    idle = float(os.environ.get('CLICKABLE_DAEMON_IDLE', DEFAULT_IDLE))
+    _serve(_socket_path(project_dir),
+           lambda: _stamp(project_dir) != stamp,
+           lambda request: _run(module), idle)
+
+
+def _serve(path, is_stale, run, idle):
+    """
+    Serve requests on `path` Unix socket until `idle` seconds without
+    request, or until `is_stale()` is true when a request is received.
+    Each request is run by `run(request)` in a forked worker (see
+    `_worker`); returned int is used as exit code.
+    """
+    listener = _bind(path)
+    if listener is None:
+        return
+    # SIGCHLD wakes select up through wakeup pipe
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    workers = {}
+    running = True
+    try:
+        while running or workers:
+            readable = [wakeup_r] + ([listener] if running else [])
+            ready, _, _ = select.select(readable, [], [],
+                                        None if workers else idle)
+            if not ready and not workers:
+                # idle timeout
+                break
+            if wakeup_r in ready:
+                try:
+                    os.read(wakeup_r, 512)
+                except BlockingIOError:
+                    pass
+            _reap(workers)
+            if running and listener in ready:
+                conn, _ = listener.accept()
+                if not _trusted(conn):
+                    conn.close()
+                    continue
+                received = _receive(conn)
+                if received is None:
+                    conn.close()
+                    continue
+                request, fds = received
+                if is_stale():
+                    for fd in fds:
+                        os.close(fd)
+                    _send_message(conn, {'stale': True})
+                    conn.close()
+                    # let a new server bind while workers end
+                    _unbind(listener, path)
+                    running = False
+                    continue
+                pid = _fork_worker(conn, listener, run, request, fds)
+                workers[pid] = conn
+    finally:
+        if running:
+            _unbind(listener, path)
+
+
+def _unbind(listener, path):
+    listener.close()
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _reap(workers):
+    while workers:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        conn = workers.pop(pid, None)
+        if conn is None:
+            continue
+        if os.WIFEXITED(status):
+            code = os.WEXITSTATUS(status)
+        else:
+            code = 128 + os.WTERMSIG(status)
+        try:
+            _send_message(conn, {'exit': code})
+        except OSError:
+            pass
+        conn.close()
+
+
+def _receive(conn):
+    """Read request and stdio file descriptors; None if invalid."""
+    try:
+        data, fds = _recv_fds(conn, MAX_REQUEST, 3)
+        while True:
+            chunk = conn.recv(MAX_REQUEST)
+            if not chunk:
+                break
+            data += chunk
+        request = json.loads(data.decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    if len(fds) != 3:
+        for fd in fds:
+            os.close(fd)
+        return None
+    return request, fds
+
+
+def _fork_worker(conn, listener, run, request, fds):
+    pid = os.fork()
+    if pid == 0:
+        listener.close()
+        _worker(request, fds, run)
+    for fd in fds:
+        os.close(fd)
+    try:
+        _send_message(conn, {'pid': pid})
+    except OSError:
+        pass
+    return pid
+
+
+def _worker(request, fds, run):
+    """Worker process: never returns."""
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+        # reopen stdio, so that buffering matches client's terminal
+        sys.stdin = open(0, 'r', closefd=False)
+        sys.stdout = open(1, 'w', buffering=1 if os.isatty(1) else -1,
+                          closefd=False)
+        sys.stderr = open(2, 'w', buffering=1, closefd=False)
+        os.chdir(request['cwd'])
+        os.environ.clear()
+        os.environ.update(request['env'])
+        sys.argv = request['argv']
+        try:
+            result = run(request)
+            code = result if isinstance(result, int) else 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except KeyboardInterrupt:
+            code = 130
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        os._exit(code)
+
+
+if __name__ == '__main__':
+    _daemon(sys.argv[1] if len(sys.argv) > 1 else os.getcwd())
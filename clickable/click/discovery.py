@@ -0,0 +1,95 @@
+# -*- encoding: utf-8 -*-
+
+"""`clickables.py` discovery from a project sub-folder.
+
+Ancestors of current folder are searched for `clickables.py`. Search
+stops at a VCS root (a folder containing `.git`, `.hg` or `.svn`), at a
+filesystem boundary (device change) or at filesystem root.
+
+Folder to project root associations are memoized in-process and in
+user cache folder (`discovery.json`). A cached association is used
+while `clickables.py` still exists in project root and current folder
+does not contain its own `clickables.py`; a `clickables.py` added in an
+intermediate folder is not seen until the cached root disappears
+(CLICKABLE_DISCOVERY_CACHE=0 disables the cache)."""
+
+import json
+import os
+import os.path
+
+from clickable.cache import _atomic_write
+from clickable.cache import cache_dir
+
+FILENAME = 'clickables.py'
+VCS_MARKERS = ['.git', '.hg', '.svn']
+# maximum number of folders kept in cache
+CACHE_SIZE = 1000
+
+_memo = {}
+
+
+def _project_root(start_dir):
+    """Folder containing `clickables.py`, searched from `start_dir` up
+    to VCS root or filesystem boundary. None if not found."""
+    start_dir = os.path.abspath(start_dir)
+    if os.path.isfile(os.path.join(start_dir, FILENAME)):
+        return start_dir
+    if start_dir in _memo:
+        return _memo[start_dir]
+    use_cache = _cache_enabled()
+    cache = (_read_cache() if use_cache else None) or {}
+    root = cache.get(start_dir, None)
+    if root is not None and os.path.isfile(os.path.join(root, FILENAME)):
+        _memo[start_dir] = root
+        return root
+    root = _walk(start_dir)
+    _memo[start_dir] = root
+    if use_cache and root is not None:
+        cache.pop(start_dir, None)
+        cache[start_dir] = root
+        while len(cache) > CACHE_SIZE:
+            del cache[next(iter(cache))]
+        _write_cache(cache)
+    return root
+
+
+def _walk(start_dir):
+    current = start_dir
+    device = os.stat(current).st_dev
+    while True:
+        if os.path.isfile(os.path.join(current, FILENAME)):
+            return current
+        if any(os.path.exists(os.path.join(current, marker))
+               for marker in VCS_MARKERS):
+            return None
+        parent = os.path.dirname(current)
+        if parent == current:
+            return None
+        try:
+            if os.stat(parent).st_dev != device:
+                return None
+        except OSError:
+            return None
+        current = parent
+
+
+def _cache_enabled():
+    return os.environ.get('CLICKABLE_DISCOVERY_CACHE', 'true').lower() \
+        in ('true', '1', 'yes')
+
+
+def _read_cache():
+    try:
+        with open(cache_dir('discovery.json')) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return cache if isinstance(cache, dict) else None
+
+
+def _write_cache(cache):
+    try:
+        _atomic_write(cache_dir('discovery.json'),
+                      lambda f: json.dump(cache, f))
+    except OSError:
+        pass
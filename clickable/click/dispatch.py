@@ -0,0 +1,67 @@
+# -*- encoding: utf-8 -*-
+
+"""On-disk cache of statically resolved dispatch results.
+
+Results are stored in `__pycache__/<module>.clickable-dispatch.json`,
+next to `clickables.py` bytecode, and map raw `sys.argv[0]` values to
+the resolved callable name and mapping type. Cache is keyed by
+`clickables.py` stat (mtime, ctime, size, inode, device); a file whose
+mtime is too recent to be distinguished from a later modification is
+not cached (racy mtime).
+
+Only static resolutions are cached: they depend on `clickables.py`
+content only."""
+
+import json
+import os.path
+
+from clickable.cache import _atomic_write
+from clickable.cache import _is_racy
+from clickable.cache import _stat_key
+
+VERSION = 1
+
+
+def _dispatch_cache_path(filename):
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    module = os.path.splitext(basename)[0]
+    return os.path.join(dirname, '__pycache__',
+                        '{}.clickable-dispatch.json'.format(module))
+
+
+def _read_dispatch(filename, stat, argv0):
+    """Cached entry ({'callable_name', 'mapping_type'}) for argv0; None
+    on miss."""
+    try:
+        with open(_dispatch_cache_path(filename)) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get('version') != VERSION \
+            or cache.get('stat') != _stat_key(stat):
+        return None
+    return cache.get('entries', {}).get(argv0, None)
+
+
+def _write_dispatch(filename, stat, argv0, callable_name, mapping):
+    """Store resolution for argv0; entries of other argv0 are kept if
+    file is unchanged. Write errors are ignored."""
+    if _is_racy(stat):
+        return
+    path = _dispatch_cache_path(filename)
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if not isinstance(cache, dict) or cache.get('version') != VERSION \
+                or cache.get('stat') != _stat_key(stat):
+            cache = None
+    except (OSError, ValueError):
+        cache = None
+    if cache is None:
+        cache = {'version': VERSION, 'stat': _stat_key(stat), 'entries': {}}
+    cache['entries'][argv0] = {'callable_name': callable_name,
+                               'mapping_type': type(mapping).__name__}
+    try:
+        _atomic_write(path, lambda f: json.dump(cache, f))
+    except OSError:
+        pass
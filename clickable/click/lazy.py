@@ -0,0 +1,64 @@
+# -*- encoding: utf-8 -*-
+
+"""click group with lazily registered subcommands.
+
+Command sets (for example `clickable.sphinx.sphinx_click_group`) are
+declared with the names of the commands they provide and a loader. A
+loader is only imported and called when one of its commands is invoked,
+or when help is displayed; plain `list_commands` (completion) does not
+load anything.
+
+Loader is a callable, or a `module:attribute` string, called with the
+group then additional arguments given at registration."""
+
+import importlib
+
+import click
+
+
+class LazyGroup(click.Group):
+    """click group whose command sets are loaded on first use
+    (`@click.group(cls=LazyGroup)`)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # [names, loader, args, kwargs] not yet loaded
+        self.lazy_commands = []
+
+    def add_lazy_commands(self, names, loader, *args, **kwargs):
+        """Declare `names` commands, registered on the group by
+        `loader(group, *args, **kwargs)` when first needed."""
+        self.lazy_commands.append((list(names), loader, args, kwargs))
+
+    def add_lazy_command(self, name, loader, *args, **kwargs):
+        """Declare a single command; `loader(*args, **kwargs)` returns
+        the command."""
+        def register(group):
+            group.add_command(_resolve(loader)(*args, **kwargs), name)
+        self.add_lazy_commands([name], register)
+
+    def list_commands(self, ctx):
+        names = set(self.commands)
+        for lazy_names, loader, args, kwargs in self.lazy_commands:
+            names.update(lazy_names)
+        return sorted(names)
+
+    def get_command(self, ctx, cmd_name):
+        if cmd_name not in self.commands:
+            self._load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load(self, cmd_name):
+        for item in list(self.lazy_commands):
+            names, loader, args, kwargs = item
+            if cmd_name in names:
+                self.lazy_commands.remove(item)
+                _resolve(loader)(self, *args, **kwargs)
+
+
+def _resolve(loader):
+    """Import `module:attribute` loaders."""
+    if isinstance(loader, str):
+        module_name, attribute = loader.split(':', 1)
+        return getattr(importlib.import_module(module_name), attribute)
+    return loader
@@ -0,0 +1,205 @@
+# -*- encoding: utf-8 -*-
+
+"""Static (AST-based) analysis of `clickables.py`.
+
+Mapping constants and module-level names are extracted without
+executing the module, so that dispatch errors (missing mapping key,
+callable name bound to a constant) are reported before anything runs,
+and entry points can be listed instantly.
+
+Analysis is conservative: when a name may be bound or modified in a way
+that cannot be known statically (conditional or repeated bindings,
+star-imports, `globals()` usage, mapping modified after assignment),
+result is `unknown` and dynamic lookup is used."""
+
+import ast
+import collections
+
+MAPPING_NAMES = ['CLICKABLE_MAPPING', 'CLICK_MAPPING']
+
+# name binding kinds
+FUNCTION = 'function'
+IMPORT = 'import'
+VALUE = 'value'
+EXPRESSION = 'expression'
+UNKNOWN = 'unknown'
+
+# resolution status
+OK = 'ok'
+ERROR = 'error'
+
+StaticModule = collections.namedtuple(
+    'StaticModule', ['names', 'values', 'dynamic'])
+StaticResolution = collections.namedtuple(
+    'StaticResolution', ['status', 'mapping', 'callable_name', 'message'])
+
+_NOT_LITERAL = object()
+
+
+def _parse(filename):
+    """Parse `filename` and collect module-level bindings."""
+    with open(filename, 'rb') as f:
+        tree = ast.parse(f.read(), filename)
+    return _analyze(tree)
+
+
+def _analyze(tree):
+    bindings = collections.defaultdict(list)
+    dynamic = [False]
+
+    def bind(name, kind, value=_NOT_LITERAL):
+        bindings[name].append((kind, value))
+
+    def visit(statements, conditional):
+        for node in statements:
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                                 ast.ClassDef)):
+                bind(node.name, UNKNOWN if conditional else FUNCTION)
+                if node.name == '__getattr__':
+                    dynamic[0] = True
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    if alias.name == '*':
+                        dynamic[0] = True
+                        continue
+                    name = alias.asname or alias.name.split('.')[0]
+                    bind(name, UNKNOWN if conditional else IMPORT)
+            elif isinstance(node, (ast.Assign, ast.AnnAssign)) \
+                    and not conditional:
+                targets = node.targets if isinstance(node, ast.Assign) \
+                    else [node.target]
+                for target in targets:
+                    if isinstance(target, ast.Name) and node.value is not None:
+                        bind(target.id, *_value_kind(node.value))
+                    else:
+                        for name in _stored_names(target):
+                            bind(name, UNKNOWN)
+            else:
+                for name in _stored_names(node):
+                    bind(name, UNKNOWN)
+                for field in ('body', 'orelse', 'finalbody', 'handlers'):
+                    visit(getattr(node, field, None) or [], True)
+
+    visit(tree.body, False)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) \
+                and node.id in ('globals', 'exec', 'setattr', 'vars'):
+            dynamic[0] = True
+
+    names = {}
+    values = {}
+    for name, kinds in bindings.items():
+        if len(kinds) == 1:
+            names[name], values[name] = kinds[0]
+        else:
+            names[name], values[name] = UNKNOWN, _NOT_LITERAL
+    # mappings used anywhere else may be modified at import time
+    loads = collections.Counter(
+        node.id for node in ast.walk(tree)
+        if isinstance(node, ast.Name) and node.id in MAPPING_NAMES
+        and not isinstance(node.ctx, ast.Store))
+    for name in MAPPING_NAMES:
+        if loads[name]:
+            names[name], values[name] = UNKNOWN, _NOT_LITERAL
+    return StaticModule(names, values, dynamic[0])
+
+
+def _value_kind(value):
+    try:
+        return VALUE, ast.literal_eval(value)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        if isinstance(value, ast.Lambda):
+            return FUNCTION, _NOT_LITERAL
+        return EXPRESSION, _NOT_LITERAL
+
+
+def _stored_names(node):
+    """Names stored by a statement outside nested functions/classes
+    (for loop targets, with ... as, except ... as, walrus, ...)."""
+    names = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current is not node and isinstance(
+                current, (ast.FunctionDef, ast.AsyncFunctionDef,
+                          ast.ClassDef, ast.Lambda)):
+            continue
+        if isinstance(current, ast.Name) \
+                and isinstance(current.ctx, (ast.Store, ast.Del)):
+            names.append(current.id)
+        elif isinstance(current, ast.ExceptHandler) and current.name:
+            names.append(current.name)
+        stack.extend(ast.iter_child_nodes(current))
+    return names
+
+
+def _static_mapping(static_module):
+    """Return (known, mapping), following dynamic lookup rules: first
+    truthy of CLICKABLE_MAPPING, CLICK_MAPPING."""
+    for name in MAPPING_NAMES:
+        kind = static_module.names.get(name, None)
+        if kind is None:
+            if static_module.dynamic:
+                return False, None
+            continue
+        if kind != VALUE:
+            return False, None
+        value = static_module.values[name]
+        if value:
+            return True, value
+    return True, None
+
+
+def _static_resolve(static_module, callable_key):
+    """Resolve callable name for `callable_key` from a parsed module."""
+    from clickable.click import _find_callable_name
+    known, mapping = _static_mapping(static_module)
+    if not known:
+        return StaticResolution(UNKNOWN, None, None, None)
+    try:
+        callable_name = _find_callable_name(mapping, callable_key)
+    except Exception as e:
+        return StaticResolution(ERROR, mapping, None, str(e))
+    if not isinstance(callable_name, str):
+        return StaticResolution(
+            ERROR, mapping, callable_name,
+            "Callable name {} invalid for {}".format(callable_name,
+                                                     callable_key))
+    kind = static_module.names.get(callable_name, None)
+    if mapping is None and not static_module.dynamic \
+            and (kind is None
+                 or (kind == VALUE
+                     and not static_module.values[callable_name])):
+        # main fallback; error messages keep requested name
+        reported_name, callable_name = callable_name, 'main'
+        kind = static_module.names.get(callable_name, None)
+    else:
+        reported_name = callable_name
+    if kind in (FUNCTION, IMPORT, EXPRESSION):
+        return StaticResolution(OK, mapping, callable_name, None)
+    if kind == VALUE:
+        return StaticResolution(
+            ERROR, mapping, callable_name,
+            "Attribute {} is not a callable: {}]".format(
+                reported_name, static_module.values[callable_name]))
+    if kind is None and not static_module.dynamic:
+        return StaticResolution(
+            ERROR, mapping, callable_name,
+            "Attribute {} is not a callable: None]".format(reported_name))
+    return StaticResolution(UNKNOWN, mapping, callable_name, None)
+
+
+def _entry_points(static_module):
+    """List (key, callable name) entry points; key is None for a static
+    string mapping or `main` fallback. None if unknown."""
+    known, mapping = _static_mapping(static_module)
+    if not known:
+        return None
+    if isinstance(mapping, str):
+        return [(None, mapping)]
+    if isinstance(mapping, dict):
+        return sorted(mapping.items(), key=lambda item: str(item[0]))
+    if mapping is not None:
+        return None
+    return [(name, name) for name, kind in sorted(static_module.names.items())
+            if kind == FUNCTION and not name.startswith('_')]
@@ -1,10 +1,9 @@
 import logging
 import sys
 
-import coloredlogs
-
 
 def bootstrap():
+    import coloredlogs
     logger_name = sys.modules[__name__].__package__.split('.')[0]
     logger = logging.getLogger(logger_name)
     stdout = logging.getLogger('.'.join(['stdout', logger_name]))
@@ -1,16 +1,28 @@
 import logging
 import os
 import os.path
+import shutil
 import subprocess
+import sys
 
 import click
 
-from clickable.virtualenv import virtualenv
-
 logger = logging.getLogger(__name__)
 stdout = logging.getLogger('stdout.{}'.format(__name__))
 
 
+SPHINX_COMMANDS = ['clean', 'build', 'live', 'quickstart']
+
+
+def sphinx_lazy_click_group(click_group, sphinx_provider,
+                            virtualenv_provider=None, path_provider=None):
+    """Declare sphinx commands on a `clickable.click.lazy.LazyGroup`;
+    commands are defined only when one of them (or help) is requested."""
+    click_group.add_lazy_commands(SPHINX_COMMANDS, sphinx_click_group,
+                                  sphinx_provider, virtualenv_provider,
+                                  path_provider)
+
+
 def sphinx_click_group(click_group, sphinx_provider,
                        virtualenv_provider=None, path_provider=None):
     if not path_provider:
@@ -18,27 +30,47 @@ def sphinx_click_group(click_group, sphinx_provider,
     if not virtualenv_provider:
         virtualenv_provider = lambda ctx: sphinx_provider(ctx)['virtualenv']
 
+    def provision(ctx):
+        # virtualenv machinery is only imported when a command runs
+        from clickable.virtualenv import virtualenv
+        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
+
     @click_group.command()
     @click.pass_context
     def clean(ctx):
-        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
+        provision(ctx)
         sphinx_clean(path_provider(ctx),
                      sphinx_provider(ctx)['documentation_path'])
 
     @click_group.command()
-    @click.argument('target')
+    @click.argument('targets', nargs=-1, required=True)
+    @click.option('--force', is_flag=True, default=False,
+                  help='build even if sources are unchanged '
+                       '(see skip_unchanged setting)')
+    @click.option('--jobs', '-j', type=click.IntRange(min=1), default=None,
+                  help='CPU budget shared by targets (default: CPU count)')
     @click.pass_context
-    def build(ctx, target):
-        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
-        sphinx_build(path_provider(ctx), sphinx_provider(ctx),
-                     virtualenv_provider(ctx), target)
+    def build(ctx, targets, force, jobs):
+        """Build TARGETS sphinx deliveries (html, epub, latex, ...)"""
+        provision(ctx)
+        if len(targets) == 1:
+            sphinx_build(path_provider(ctx), sphinx_provider(ctx),
+                         virtualenv_provider(ctx), targets[0], force=force,
+                         jobs=jobs)
+        else:
+            sphinx_build_targets(path_provider(ctx), sphinx_provider(ctx),
+                                 virtualenv_provider(ctx), targets,
+                                 force=force, jobs=jobs)
 
     @click_group.command()
+    @click.option('--engine', type=click.Choice(LIVE_ENGINES), default=None,
+                  help='watch engine (default: live_engine setting, '
+                       'else autobuild)')
     @click.pass_context
-    def live(ctx):
-        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
+    def live(ctx, engine):
+        provision(ctx)
         sphinx_live(path_provider(ctx), sphinx_provider(ctx),
-                    virtualenv_provider(ctx))
+                    virtualenv_provider(ctx), engine=engine)
 
     @click_group.command()
     @click.option('--project', help='project name')
@@ -48,7 +80,7 @@ def sphinx_click_group(click_group, sphinx_provider,
     @click.option('--epub', is_flag=True, default=False, help='enable epub')
     @click.pass_context
     def quickstart(ctx, project, author, version, language, epub):
-        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
+        provision(ctx)
         sphinx_quickstart(path_provider(ctx), sphinx_provider(ctx),
                           virtualenv_provider(ctx),
                           project, author, version, language, epub)
@@ -66,62 +98,320 @@ def sphinx_script(path_resolver, virtualenv_config, script, args=None):
     process_args.append(script_path)
     if args:
         process_args.extend(args)
+    subprocess.check_call(process_args,
+                          env=_script_env(path_resolver, virtualenv_config))
+
+
+def _script_env(path_resolver, virtualenv_config):
     env = dict(os.environ)
     env['PATH'] = ':'.join([
         path_resolver.resolve_relative(
             os.path.join(virtualenv_config['path'], 'bin')),
         os.environ['PATH']
     ])
-    subprocess.check_call(process_args, env=env)
+    return env
+
+
+def sphinx_worker_script(path_resolver, virtualenv_config, conf_dir, args):
+    """
+    Run sphinx-build ``args`` through a persistent worker running in
+    sphinx virtualenv (see `clickable.sphinx.worker`). If worker is not
+    available or stale, a new worker is started in background and
+    sphinx-build is run as a subprocess.
+    """
+    from clickable.click.daemon import DONE
+    from clickable.click.daemon import _call
+    from .worker import _socket_path
+    python = path_resolver.resolve_relative(
+        os.path.join(virtualenv_config['path'], 'bin', 'python'))
+    try:
+        path = _socket_path(python, conf_dir)
+    except Exception as e:
+        logger.debug('sphinx: worker not available ({})'.format(e))
+        return sphinx_script(path_resolver, virtualenv_config,
+                             'sphinx-build', args)
+    env = _script_env(path_resolver, virtualenv_config)
+    argv = ['sphinx-build'] + list(args)
+    status, code = _call(path, {'argv': argv, 'env': env,
+                                'cwd': os.getcwd()})
+    if status == DONE:
+        logger.debug('sphinx: built by worker {}'.format(path))
+        if code != 0:
+            raise subprocess.CalledProcessError(code, argv)
+        return
+    logger.debug('sphinx: worker {} {}, starting it'.format(path, status))
+    _spawn_worker(python, path, conf_dir, env)
+    sphinx_script(path_resolver, virtualenv_config, 'sphinx-build', args)
+
+
+def _spawn_worker(python, path, conf_dir, env):
+    if not os.access(python, os.X_OK):
+        return
+    from . import worker
+    subprocess.Popen([python, worker.__file__, path, conf_dir],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, env=env,
+                     start_new_session=True)
+
+
+def _worker_enabled(sphinx_config):
+    if 'worker' in sphinx_config:
+        return bool(sphinx_config['worker'])
+    return os.environ.get('CLICKABLE_SPHINX_WORKER', '').lower() \
+        in ('true', '1', 'yes')
 
 
 def sphinx_clean(path_resolver, documentation_path):
+    """
+    Clean sphinx build folder (``.gitkeep`` is kept).
+
+    Outputs are renamed into ``build/.clickable-trash`` and deleted by a
+    detached background process, which also deletes trash left by
+    interrupted runs.
+    """
+    from .trash import TRASH_NAME
+    from .trash import _move_to_trash
     sphinx_build_path = path_resolver.resolve_relative(
         os.path.join(documentation_path, 'build'))
+    trash_path = os.path.join(sphinx_build_path, TRASH_NAME)
     items = [item for item in os.listdir(sphinx_build_path)
-             if item not in ['.', '..', '.gitkeep']]
+             if item not in ['.', '..', '.gitkeep', TRASH_NAME]]
     if not items:
         stdout.info('sphinx.clean: no files to clean')
-        return
-    stdout.info('sphinx.clean: cleaning {}'.format(' '.join(items)))
-    args = []
-    args.extend(['rm', '-rf'])
-    args.extend([os.path.normpath(os.path.join(sphinx_build_path, item))
-                 for item in items])
-    subprocess.check_call(args)
+    else:
+        stdout.info('sphinx.clean: cleaning {}'.format(' '.join(items)))
+        _move_to_trash([os.path.join(sphinx_build_path, item)
+                        for item in items], trash_path)
+    if os.path.isdir(trash_path):
+        _spawn_trash(trash_path)
+
 
+def _spawn_trash(trash_path):
+    from . import trash
+    try:
+        subprocess.Popen([sys.executable, trash.__file__, trash_path],
+                         stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.DEVNULL, start_new_session=True)
+    except OSError as e:
+        logger.debug('sphinx.clean: background deletion failed (%s)', e)
+        trash._empty_trash(trash_path)
 
-def sphinx_build(path_resolver, sphinx_config, virtualenv_config, target):
+
+def sphinx_build(path_resolver, sphinx_config, virtualenv_config, target,
+                 force=False, jobs=None):
     """
     Build TARGET sphinx delivery (html, singlepage, ...)
+
+    Output goes to ``build/<target>``; doctrees are shared in
+    ``build/doctrees`` so that sphinx only rereads changed documents.
+    ``jobs`` is passed to ``-j`` (default: auto).
+
+    With ``skip_unchanged: true`` (or CLICKABLE_SPHINX_SKIP_UNCHANGED=1),
+    sphinx is not launched if build parameters and content of ``source``
+    and ``dependencies`` (paths read by sphinx outside ``source``:
+    autodoc modules, templates, ...) are unchanged since last successful
+    build of this target, unless ``force`` is set.
+
+    Returns False if build is skipped.
+
+    With ``worker: true`` (or CLICKABLE_SPHINX_WORKER=1), builds are run
+    by a persistent worker keeping sphinx and extensions loaded.
+    """
+    build = _build_state(path_resolver, sphinx_config, virtualenv_config,
+                         target)
+    if not force and build['up_to_date']:
+        stdout.info('sphinx.build: {} up to date, skipping'.format(target))
+        return False
+    _run_build(path_resolver, virtualenv_config, build, jobs)
+    return True
+
+
+def sphinx_build_targets(path_resolver, sphinx_config, virtualenv_config,
+                         targets, force=False, jobs=None):
     """
+    Build several sphinx targets under a global CPU budget (``jobs``,
+    default: CPU count).
+
+    First outdated target is built alone with the whole budget: it reads
+    changed sources and updates shared doctrees. Remaining targets then
+    run concurrently, sharing the budget; each one works on a private
+    copy of doctrees (``build/doctrees.<target>``, removed afterwards),
+    as a builder may still reread documents and pickle its environment.
+    A timing summary is printed at the end.
+    """
+    import concurrent.futures
+    import time
+    jobs = jobs or os.cpu_count() or 1
+    builds = []
+    skipped = []
+    for target in _unique(targets):
+        build = _build_state(path_resolver, sphinx_config, virtualenv_config,
+                             target)
+        if not force and build['up_to_date']:
+            skipped.append(target)
+        else:
+            builds.append(build)
+    timings = []
+    failures = []
+
+    def run(build, build_jobs, quiet):
+        start = time.monotonic()
+        try:
+            _run_build(path_resolver, virtualenv_config, build, build_jobs,
+                       quiet=quiet)
+        except Exception as e:
+            failures.append((build['target'], e))
+        timings.append((build['target'], time.monotonic() - start))
+
+    def run_private(build, build_jobs):
+        doctrees_path = _private_doctrees(build)
+        try:
+            run(build, build_jobs, True)
+        finally:
+            shutil.rmtree(doctrees_path, ignore_errors=True)
+    if builds:
+        # environment is read once, by first build
+        run(builds[0], jobs, False)
+    others = builds[1:]
+    if others and not failures:
+        build_jobs = max(1, jobs // len(others))
+        stdout.info('sphinx.build: building {} concurrently ({} jobs each)'
+                    .format(' '.join(b['target'] for b in others),
+                            build_jobs))
+        workers = min(len(others), jobs)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for future in [executor.submit(run_private, build, build_jobs)
+                           for build in others]:
+                future.result()
+    for target, duration in timings:
+        stdout.info('sphinx.build: {} {:.1f}s'.format(target, duration))
+    for target in skipped:
+        stdout.info('sphinx.build: {} up to date, skipped'.format(target))
+    if failures:
+        raise Exception('sphinx.build: {} failed'.format(
+            ', '.join(target for target, error in failures))) \
+            from failures[0][1]
+
+
+def _private_doctrees(build):
+    """Copy shared doctrees for ``build`` and use the copy; returns copy
+    path."""
+    args = build['args']
+    index = args.index('-d') + 1
+    doctrees_path = '{}.{}'.format(args[index], build['target'])
+    shutil.rmtree(doctrees_path, ignore_errors=True)
+    if os.path.isdir(args[index]):
+        shutil.copytree(args[index], doctrees_path, symlinks=True)
+    build['args'] = args[0:index] + [doctrees_path] + args[index + 1:]
+    return doctrees_path
+
+
+def _unique(targets):
+    result = []
+    for target in targets:
+        if target not in result:
+            result.append(target)
+    return result
+
+
+def _build_state(path_resolver, sphinx_config, virtualenv_config, target):
+    """sphinx-build arguments and source manifest of a target."""
+    from .manifest import _manifest_matches
+    from .manifest import _read_manifest
+    from .manifest import _source_manifest
     documentation_path = sphinx_config['documentation_path']
     sphinx_source_path = path_resolver.resolve_relative(
         os.path.join(documentation_path, 'source'))
     sphinx_build_path = path_resolver.resolve_relative(
-        os.path.join(documentation_path, 'build', 'html'))
+        os.path.join(documentation_path, 'build', target))
+    sphinx_doctrees_path = path_resolver.resolve_relative(
+        os.path.join(documentation_path, 'build', 'doctrees'))
     args = []
     args.extend(['-b', target])
-    args.extend(['-j', 'auto'])
+    args.extend(['-d', sphinx_doctrees_path])
     args.append(sphinx_source_path)
     args.append(sphinx_build_path)
-    sphinx_script(path_resolver, virtualenv_config,
-                  'sphinx-build', args)
+    manifest = None
+    up_to_date = False
+    if _skip_enabled(sphinx_config):
+        previous = _read_manifest(sphinx_build_path)
+        dependencies = [path_resolver.resolve_relative(path)
+                        for path in sphinx_config.get('dependencies', [])]
+        manifest = _source_manifest(
+            sphinx_source_path,
+            _build_key(path_resolver, virtualenv_config, args), previous,
+            dependencies)
+        up_to_date = _manifest_matches(previous, manifest)
+    return {'target': target, 'args': args, 'build_path': sphinx_build_path,
+            'source_path': sphinx_source_path,
+            'worker': _worker_enabled(sphinx_config),
+            'manifest': manifest,
+            'up_to_date': up_to_date}
 
 
-def sphinx_live(path_resolver, sphinx_config, virtualenv_config):
+def _skip_enabled(sphinx_config):
+    if 'skip_unchanged' in sphinx_config:
+        return bool(sphinx_config['skip_unchanged'])
+    return os.environ.get('CLICKABLE_SPHINX_SKIP_UNCHANGED', '').lower() \
+        in ('true', '1', 'yes')
+
+
+def _run_build(path_resolver, virtualenv_config, build, jobs=None,
+               quiet=False):
+    from .manifest import _remove_manifest
+    from .manifest import _write_manifest
+    # a failed build must not leave a matching manifest behind
+    _remove_manifest(build['build_path'])
+    args = ['-j', str(jobs) if jobs else 'auto']
+    if quiet:
+        args.append('-q')
+    args.extend(build['args'])
+    if build['worker']:
+        sphinx_worker_script(path_resolver, virtualenv_config,
+                             build['source_path'], args)
+    else:
+        sphinx_script(path_resolver, virtualenv_config, 'sphinx-build', args)
+    if build['manifest'] is not None:
+        _write_manifest(build['build_path'], build['manifest'])
+
+
+def _build_key(path_resolver, virtualenv_config, args):
+    """Build parameters stored in manifest: sphinx arguments and
+    virtualenv fingerprint (sphinx and extensions versions)."""
+    from clickable.virtualenv.fingerprint import _read_fingerprint
+    fingerprint = _read_fingerprint(
+        path_resolver.resolve_relative(virtualenv_config['path']))
+    return {'args': args,
+            'virtualenv': fingerprint.get('digest') if fingerprint else None}
+
+
+LIVE_IGNORE = ['*.swp', '*.log', '*~']
+LIVE_ENGINES = ['autobuild', 'inotify']
+
+
+def sphinx_live(path_resolver, sphinx_config, virtualenv_config,
+                engine=None):
     """
     Live-build sphinx delivery (html, singlepage, ...)
+
+    ``engine`` (or ``live_engine`` setting) is ``autobuild`` (default,
+    sphinx-autobuild) or ``inotify`` (built-in watcher, incremental
+    builds, Linux only). Ignored globs are read from ``live_ignore``
+    setting.
     """
+    engine = engine or sphinx_config.get('live_engine', 'autobuild')
+    if engine == 'inotify':
+        return sphinx_watch(path_resolver, sphinx_config, virtualenv_config)
+    if engine != 'autobuild':
+        raise Exception('sphinx.live: unknown engine {}'.format(engine))
     documentation_path = sphinx_config['documentation_path']
     sphinx_source_path = path_resolver.resolve_relative(
         os.path.join(documentation_path, 'source'))
     sphinx_build_path = path_resolver.resolve_relative(
         os.path.join(documentation_path, 'build', 'html'))
     args = []
-    args.extend(['--ignore', '*.swp'])
-    args.extend(['--ignore', '*.log'])
-    args.extend(['--ignore', '*~'])
+    for pattern in sphinx_config.get('live_ignore', LIVE_IGNORE):
+        args.extend(['--ignore', pattern])
     args.extend(['-b', 'html'])
     args.extend(['-j', 'auto'])
     args.append(sphinx_source_path)
@@ -129,6 +419,47 @@ def sphinx_live(path_resolver, sphinx_config, virtualenv_config):
     sphinx_script(path_resolver, virtualenv_config, 'sphinx-autobuild', args)
 
 
+def sphinx_watch(path_resolver, sphinx_config, virtualenv_config,
+                 target='html'):
+    """
+    Watch ``source`` folder with inotify and rebuild ``target`` after
+    each burst of changes. Latency (first change to end of build) is
+    reported for each cycle. Stops on Ctrl-C.
+    """
+    import time
+    from .watch import _changes
+    sphinx_source_path = path_resolver.resolve_relative(
+        os.path.join(sphinx_config['documentation_path'], 'source'))
+    ignore = sphinx_config.get('live_ignore', LIVE_IGNORE)
+    debounce = float(sphinx_config.get('live_debounce', 0.2))
+    _watch_build(path_resolver, sphinx_config, virtualenv_config, target)
+    stdout.info('sphinx.live: watching {}'.format(sphinx_source_path))
+    try:
+        for first, paths in _changes(sphinx_source_path, ignore, debounce):
+            stdout.info('sphinx.live: {} change(s): {}'.format(
+                len(paths), ' '.join(os.path.relpath(p, sphinx_source_path)
+                                     for p in paths[0:5])))
+            start = time.monotonic()
+            built = _watch_build(path_resolver, sphinx_config,
+                                 virtualenv_config, target)
+            end = time.monotonic()
+            stdout.info('sphinx.live: {} in {:.2f}s, {:.2f}s after first '
+                        'change'.format('rebuilt' if built else 'unchanged',
+                                        end - start, end - first))
+    except KeyboardInterrupt:
+        stdout.info('sphinx.live: stopped')
+
+
+def _watch_build(path_resolver, sphinx_config, virtualenv_config, target):
+    """Build target; failures are reported and watch goes on."""
+    try:
+        return sphinx_build(path_resolver, sphinx_config, virtualenv_config,
+                            target)
+    except Exception as e:
+        stdout.error('sphinx.live: build failed: {}'.format(e))
+        return False
+
+
 def sphinx_quickstart(path_resolver, sphinx_config, virtualenv_config,
                       project, author, version, language, epub):
     args = []
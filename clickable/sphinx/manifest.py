@@ -0,0 +1,112 @@
+"""
+Content manifest of sphinx source folder, used to skip sphinx when
+nothing changed since last successful build of a target.
+
+Manifest is stored in target output folder
+(``build/<target>/.clickable-manifest.json``). Files whose stat is
+unchanged reuse previous hash.
+
+Only ``source`` folder and declared dependencies are tracked: inputs
+sphinx reads elsewhere (autodoc modules, templates, themes, ...) must
+be declared, which is why skipping is opt-in.
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import os.path
+
+from clickable.cache import _atomic_write
+
+MANIFEST_NAME = '.clickable-manifest.json'
+MANIFEST_VERSION = 1
+# editor temporary files do not change documentation
+IGNORED = ['__pycache__', '.*.swp', '*~', '.#*']
+
+
+def _manifest_path(build_path):
+    return os.path.join(build_path, MANIFEST_NAME)
+
+
+def _ignored(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in IGNORED)
+
+
+def _source_manifest(source_path, key, previous=None, dependencies=()):
+    """
+    Build manifest of ``source_path`` and ``dependencies`` (files or
+    folders outside sources): ``key`` (build parameters) and
+    ``{relative path: [mtime_ns, size, sha256]}`` files.
+    """
+    previous_files = (previous or {}).get('files', {})
+    files = {}
+    for path in _files([source_path] + list(dependencies)):
+        relative_path = os.path.relpath(path, source_path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entry = previous_files.get(relative_path, None)
+        if entry is not None \
+                and entry[0:2] == [stat.st_mtime_ns, stat.st_size]:
+            files[relative_path] = entry
+        else:
+            files[relative_path] = [stat.st_mtime_ns, stat.st_size,
+                                    _sha256(path)]
+    return {'version': MANIFEST_VERSION, 'key': key, 'files': files}
+
+
+def _files(paths):
+    """Files of ``paths`` (files or folders), ignored ones excluded."""
+    for root in paths:
+        if os.path.isfile(root):
+            yield root
+            continue
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not _ignored(d))
+            for filename in sorted(filenames):
+                if not _ignored(filename):
+                    yield os.path.join(dirpath, filename)
+
+
+def _manifest_matches(previous, current):
+    """Same build parameters and same source contents."""
+    if previous is None or previous.get('version') != MANIFEST_VERSION \
+            or previous.get('key') != current['key']:
+        return False
+    return _digests(previous) == _digests(current)
+
+
+def _digests(manifest):
+    return dict((path, entry[2])
+                for path, entry in manifest.get('files', {}).items())
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_manifest(build_path):
+    try:
+        with open(_manifest_path(build_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if isinstance(manifest, dict) else None
+
+
+def _write_manifest(build_path, manifest):
+    _atomic_write(_manifest_path(build_path),
+                  lambda f: json.dump(manifest, f))
+
+
+def _remove_manifest(build_path):
+    try:
+        os.unlink(_manifest_path(build_path))
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,128 @@
+"""
+Background deletion of sphinx build outputs::
+
+    python .../clickable/sphinx/trash.py <trash>
+
+``clean`` renames build outputs into a ``pending-<pid>-*`` folder of
+``build/.clickable-trash``, created with `tempfile.mkdtemp`, then seals
+it by renaming it to ``batch-*``; this script, run detached, deletes
+every sealed batch found in trash folder, and pending folders whose
+process is gone (interrupted runs). Pending folders of running
+processes are left alone. Files are unlinked by a thread pool, folders
+are removed bottom-up.
+"""
+
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+
+TRASH_NAME = '.clickable-trash'
+PENDING_PREFIX = 'pending-'
+BATCH_PREFIX = 'batch-'
+# files unlinked per pool task
+CHUNK_SIZE = 256
+
+
+def _move_to_trash(paths, trash_path):
+    """Rename ``paths`` into a new sealed batch of ``trash_path``."""
+    while True:
+        os.makedirs(trash_path, exist_ok=True)
+        try:
+            pending_path = tempfile.mkdtemp(
+                prefix='{}{}-'.format(PENDING_PREFIX, os.getpid()),
+                dir=trash_path)
+            break
+        except FileNotFoundError:
+            # empty trash folder removed meanwhile by background deletion
+            continue
+    for path in paths:
+        os.rename(path, os.path.join(pending_path, os.path.basename(path)))
+    name = os.path.basename(pending_path)
+    os.rename(pending_path, os.path.join(
+        trash_path, BATCH_PREFIX + name[len(PENDING_PREFIX):]))
+
+
+def _deletable(name):
+    """Sealed batches, and pending ones of dead processes."""
+    if name.startswith(BATCH_PREFIX):
+        return True
+    if not name.startswith(PENDING_PREFIX):
+        return False
+    try:
+        pid = int(name[len(PENDING_PREFIX):].split('-')[0])
+        os.kill(pid, 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _unlink_all(paths):
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def _chunks(trash_path):
+    """Chunks of files below ``trash_path``, folders in bottom-up order."""
+    chunk = []
+    directories = []
+    for dirpath, dirnames, filenames in os.walk(trash_path):
+        directories.append(dirpath)
+        # symlinks to folders are listed in dirnames, never followed
+        for name in filenames + [d for d in dirnames
+                                 if os.path.islink(os.path.join(dirpath, d))]:
+            chunk.append(os.path.join(dirpath, name))
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk, None
+                chunk = []
+    yield chunk, reversed(directories)
+
+
+def _empty_trash(trash_path, jobs=None):
+    """Delete batches found in ``trash_path`` with ``jobs`` threads, then
+    ``trash_path`` itself if nothing was added meanwhile."""
+    import concurrent.futures
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    try:
+        batches = [os.path.join(trash_path, name)
+                   for name in os.listdir(trash_path) if _deletable(name)]
+    except FileNotFoundError:
+        return
+    directories = []
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = []
+        for batch in batches:
+            for chunk, dirs in _chunks(batch):
+                futures.append(executor.submit(_unlink_all, chunk))
+                if dirs is not None:
+                    directories.extend(dirs)
+        for future in futures:
+            future.result()
+    for directory in directories:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+    for batch in batches:
+        # whatever was left (permissions, concurrent deletion, ...)
+        shutil.rmtree(batch, ignore_errors=True)
+    try:
+        os.rmdir(trash_path)
+    except OSError:
+        pass
+
+
+def main(trash_path):
+    _empty_trash(trash_path)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
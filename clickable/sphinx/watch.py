@@ -0,0 +1,153 @@
+"""
+Linux inotify watch engine for ``live`` mode (ctypes, no dependency).
+
+Source folder is watched recursively; bursts of events (editor writes,
+renames, swap files) are coalesced within a debounce window, then a
+single change set is reported.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import os
+import os.path
+import select
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM \
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+# default debounce window, in seconds
+DEBOUNCE = 0.2
+# a continuous stream of events is reported after this delay
+MAX_DELAY = 2.0
+
+
+class _Inotify(object):
+    """Recursive inotify watch on a folder."""
+
+    def __init__(self, path, ignore=()):
+        libc_name = ctypes.util.find_library('c')
+        try:
+            self.libc = ctypes.CDLL(libc_name, use_errno=True)
+            self.libc.inotify_init1
+        except (OSError, AttributeError):
+            raise Exception('sphinx.live: inotify is not available')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.path = os.path.abspath(path)
+        self.ignore = list(ignore)
+        self.watches = {}
+        self._add_tree(self.path)
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ignored(self, path):
+        relative_path = os.path.relpath(path, self.path)
+        return any(fnmatch.fnmatch(os.path.basename(path), pattern)
+                   or fnmatch.fnmatch(relative_path, pattern)
+                   for pattern in self.ignore)
+
+    def _add_tree(self, path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = [d for d in dirnames
+                           if not self.ignored(os.path.join(dirpath, d))]
+            self._add(dirpath)
+
+    def _add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path),
+                                         WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in (errno.ENOENT, errno.ENOTDIR):
+                # removed meanwhile
+                return
+            raise OSError(error, 'inotify_add_watch failed: {}'.format(path))
+        self.watches[wd] = path
+
+    def read(self, timeout):
+        """Changed paths (ignored ones excluded) read within ``timeout``
+        seconds, None if no event is received. A queue overflow is
+        reported as a change of the whole watched folder."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return None
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return None
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:offset + _EVENT.size + length] \
+                .rstrip(b'\0')
+            offset += _EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                changes.append(self.path)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd, None)
+            if directory is None:
+                continue
+            path = os.path.join(directory, os.fsdecode(name)) \
+                if name else directory
+            if self.ignored(path):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_tree(path)
+            changes.append(path)
+        return changes
+
+
+def _changes(path, ignore=(), debounce=DEBOUNCE, max_delay=MAX_DELAY):
+    """
+    Yield (first event time, changed paths) for each burst of changes in
+    ``path``. A burst ends after ``debounce`` seconds without event, or
+    ``max_delay`` seconds after its first event.
+    """
+    with _Inotify(path, ignore) as inotify:
+        while True:
+            changes = inotify.read(None)
+            if not changes:
+                continue
+            first = time.monotonic()
+            paths = set(changes)
+            while True:
+                remaining = first + max_delay - time.monotonic()
+                if remaining <= 0:
+                    break
+                changes = inotify.read(min(debounce, remaining))
+                if changes is None:
+                    # quiet for debounce window
+                    break
+                paths.update(changes)
+            yield first, sorted(paths)
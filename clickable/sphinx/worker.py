@@ -0,0 +1,145 @@
+"""
+Persistent sphinx worker, run by sphinx virtualenv's interpreter::
+
+    <virtualenv>/bin/python .../clickable/sphinx/worker.py <socket> <confdir>
+
+Worker preloads sphinx and installed extensions listed in ``conf.py``,
+then serves build requests on a Unix socket with
+`clickable.click.daemon` protocol: each request is run in a forked
+process calling ``sphinx.cmd.build.build_main`` with client's
+arguments, environment, current folder and stdio.
+
+``conf.py`` is read, never executed, by worker: project modules it
+imports are loaded by each build, so that their changes are seen. Each
+build also loads its environment from doctrees folder (forked builds do
+not share in-memory state, so a failed or interrupted build can not
+corrupt the next ones).
+
+Worker is stale once ``conf.py`` is modified, and stops after
+CLICKABLE_SPHINX_WORKER_IDLE seconds (default 900) without request.
+
+Only `clickable.click.daemon` module is loaded from clickable, from its
+file: clickable installation folder is never added to ``sys.path``, so
+that sphinx and extensions are imported from sphinx virtualenv only.
+"""
+
+import hashlib
+import os
+import os.path
+import sys
+
+DEFAULT_IDLE = 900
+
+
+def _socket_path(python, conf_dir):
+    """Per-user socket path for a virtualenv interpreter and a sphinx
+    configuration folder."""
+    from clickable.click.daemon import _runtime_dir
+    key = hashlib.sha256('\0'.join([os.path.abspath(python),
+                                    os.path.abspath(conf_dir)])
+                         .encode('utf-8')).hexdigest()[0:16]
+    return os.path.join(_runtime_dir(), 'sphinx-{}.sock'.format(key))
+
+
+def _stamp(conf_dir):
+    try:
+        stat = os.stat(os.path.join(conf_dir, 'conf.py'))
+        return [stat.st_mtime_ns, stat.st_size]
+    except OSError:
+        return None
+
+
+def _preload(conf_dir):
+    """Import sphinx and configured extensions installed in interpreter
+    prefix; errors are left to builds.
+
+    ``conf.py`` is not executed: project modules it imports must be
+    loaded by each build, so that their changes are seen."""
+    import sphinx.cmd.build  # noqa: F401
+    for extension in _extensions(os.path.join(conf_dir, 'conf.py')):
+        if not _installed(extension):
+            continue
+        try:
+            __import__(extension)
+        except BaseException:
+            pass
+
+
+def _extensions(conf_path):
+    """Names of a literal ``extensions = [...]`` in ``conf.py``, read
+    without executing it."""
+    import ast
+    try:
+        with open(conf_path, 'rb') as f:
+            tree = ast.parse(f.read(), conf_path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+    extensions = []
+    for node in tree.body:
+        if isinstance(node, ast.Assign) \
+                and any(isinstance(target, ast.Name)
+                        and target.id == 'extensions'
+                        for target in node.targets) \
+                and isinstance(node.value, (ast.List, ast.Tuple)):
+            extensions = [e.value for e in node.value.elts
+                          if isinstance(e, ast.Constant)
+                          and isinstance(e.value, str)]
+    return extensions
+
+
+def _installed(name):
+    """True if top-level package of module ``name`` is provided by
+    interpreter (standard library or site-packages), and not by a
+    project folder or an editable install."""
+    import importlib.util
+    try:
+        spec = importlib.util.find_spec(name.split('.')[0])
+    except (ImportError, ValueError):
+        return False
+    if spec is None:
+        return False
+    if spec.origin in ('built-in', 'frozen'):
+        return True
+    paths = [spec.origin] if spec.origin and spec.has_location \
+        else list(spec.submodule_search_locations or [])
+    prefixes = set(os.path.join(os.path.realpath(prefix), '')
+                   for prefix in (sys.prefix, sys.base_prefix))
+    return bool(paths) and all(
+        any(os.path.realpath(path).startswith(prefix)
+            for prefix in prefixes)
+        for path in paths)
+
+
+def _build(request):
+    from sphinx.cmd.build import build_main
+    return build_main(request['argv'][1:])
+
+
+def _load_daemon(package_dir):
+    """Load `clickable.click.daemon` (standard library imports only)
+    without importing clickable package."""
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        '_clickable_daemon',
+        os.path.join(os.path.dirname(package_dir), 'click', 'daemon.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main(path, conf_dir):
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    # script folder must not shadow sphinx or extensions modules
+    if sys.path and os.path.abspath(sys.path[0] or '.') == package_dir:
+        del sys.path[0]
+    _serve = _load_daemon(package_dir)._serve
+    conf_dir = os.path.abspath(conf_dir)
+    stamp = _stamp(conf_dir)
+    _preload(conf_dir)
+    idle = float(os.environ.get('CLICKABLE_SPHINX_WORKER_IDLE',
+                                DEFAULT_IDLE))
+    _serve(path, lambda: _stamp(conf_dir) != stamp, _build, idle)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2])
@@ -1,16 +1,16 @@
 import logging
 import os
 import os.path
-import pprint
-import select
+import hashlib
+import pickle
 import subprocess
 import sys
 import time
 from types import ModuleType
 
-from blessings import Terminal
-
-import yaml
+from clickable.cache import _atomic_write
+from clickable.cache import _is_racy
+from clickable.cache import _stat_key
 
 logger = logging.getLogger(__name__)
 stdout = logging.getLogger('.'.join(['stdout', __name__]))
@@ -37,9 +37,71 @@ def load_config(click_ctx, module_name, clickables_py, conf_filename = 'clickabl
     click_ctx.obj['project_root'] = os.path.dirname(clickables_py)
     conf_path = os.path.join(click_ctx.obj['project_root'], 'clickables.yml')
     if os.path.isfile(conf_path):
-        with open(conf_path) as f:
-            configuration = yaml.safe_load(f)
-            click_ctx.obj.update(configuration)
-    logger.debug('loaded configuration: \n{}'.format(pprint.pformat(click_ctx.obj)))
+        configuration = _load_yaml(conf_path)
+        click_ctx.obj.update(configuration)
+    if logger.isEnabledFor(logging.DEBUG):
+        import pprint
+        logger.debug('loaded configuration: \n{}'
+                     .format(pprint.pformat(click_ctx.obj)))
     click_ctx.obj['virtualenv_path'] = click_ctx.obj['ansible']['virtualenv']['path']
     return
+
+
+YAML_CACHE_VERSION = 1
+
+
+def _load_yaml(path):
+    """
+    Parse a YAML file with the C loader when available. Parsed content
+    is cached in a pickle sidecar (`__pycache__/<name>.clickable.pickle`)
+    reused while file stat, or else file sha256, is unchanged.
+    """
+    stat = os.stat(path)
+    cache_path = _yaml_cache_path(path)
+    cache = _read_yaml_cache(cache_path)
+    if cache is not None and cache['stat'] == _stat_key(stat):
+        return cache['data']
+    with open(path, 'rb') as f:
+        content = f.read()
+    digest = hashlib.sha256(content).hexdigest()
+    if cache is not None and cache['sha256'] == digest:
+        data = cache['data']
+    else:
+        import yaml
+        loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        data = yaml.load(content, Loader=loader)
+    # a racy mtime cannot tell later modifications; only hash is trusted
+    stat_key = None if _is_racy(stat) else _stat_key(stat)
+    if cache is None or cache['sha256'] != digest \
+            or cache['stat'] != stat_key:
+        _write_yaml_cache(cache_path, {
+            'version': YAML_CACHE_VERSION, 'stat': stat_key,
+            'sha256': digest, 'data': data})
+    return data
+
+
+def _yaml_cache_path(path):
+    dirname, basename = os.path.split(os.path.abspath(path))
+    return os.path.join(dirname, '__pycache__',
+                        '{}.clickable.pickle'.format(basename))
+
+
+def _read_yaml_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+    except Exception:
+        # missing, truncated or incompatible cache
+        return None
+    if not isinstance(cache, dict) \
+            or cache.get('version') != YAML_CACHE_VERSION:
+        return None
+    return cache
+
+
+def _write_yaml_cache(cache_path, cache):
+    try:
+        _atomic_write(cache_path, lambda f: pickle.dump(
+            cache, f, pickle.HIGHEST_PROTOCOL), mode='wb')
+    except (OSError, pickle.PicklingError):
+        logger.debug('configuration cache not written: {}'.format(cache_path))
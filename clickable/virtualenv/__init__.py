@@ -1,7 +1,135 @@
+import logging
+import os
+
+from .virtualenv import _check_virtualenv
 from .virtualenv import _virtualenv
+from .virtualenv import _pip_lock
 from .virtualenv import _pip_packages
+from .fingerprint import _fingerprint
+from .fingerprint import _fingerprint_matches
+from .fingerprint import _force_from_env
+from .fingerprint import _remove_fingerprint
+from .fingerprint import _write_fingerprint
+from .lock import _virtualenv_lock
+from .lockfile import _lockfile_path
+from .parallel import _replay
+from .parallel import _ThreadLogCapture
+from .template import _clone_virtualenv
+from .template import _template_enabled
+from .template import _template_path
+
+stdout = logging.getLogger('.'.join(['stdout', __name__]))
+
+
+def virtualenv(path_resolver, virtualenv, force=False):
+    """
+    Create virtualenv and install its requirements. pip is skipped if
+    the fingerprint stored in the virtualenv matches the configuration,
+    unless ``force`` (or CLICKABLE_VIRTUALENV_FORCE) is set.
 
+    If templates are enabled (``template: true``), a missing virtualenv
+    is cloned from a template virtualenv, provisioned once in user cache
+    folder.
 
-def virtualenv(path_resolver, virtualenv):
+    Provisioning holds a ``<path>.lock`` file lock; concurrent processes
+    wait for it, then reuse the provisioned virtualenv (fingerprint
+    matches).
+    """
+    virtualenv_path = path_resolver.resolve_relative(virtualenv['path'])
+    with _virtualenv_lock(virtualenv_path):
+        _provision(path_resolver, virtualenv, virtualenv_path, force)
+
+
+def _provision(path_resolver, virtualenv, virtualenv_path, force):
+    if _template_enabled(virtualenv) \
+            and not _check_virtualenv(virtualenv_path):
+        _virtualenv_from_template(path_resolver, virtualenv, force)
     _virtualenv(path_resolver, virtualenv)
-    _pip_packages(path_resolver, virtualenv)
+    fingerprint = _fingerprint(virtualenv_path, virtualenv,
+                               _lockfile_path(path_resolver, virtualenv))
+    force = force or _force_from_env()
+    if not force and _fingerprint_matches(virtualenv_path, fingerprint):
+        stdout.info('virtualenv: {} up to date, skipping pip'
+                    .format(virtualenv['path']))
+        return
+    # a failed install must not leave a matching fingerprint behind
+    _remove_fingerprint(virtualenv_path)
+    _pip_packages(path_resolver, virtualenv, force)
+    _write_fingerprint(virtualenv_path, fingerprint)
+
+
+def _virtualenv_from_template(path_resolver, virtualenv_config, force):
+    template_path = _template_path(
+        virtualenv_config, _lockfile_path(path_resolver, virtualenv_config))
+    stdout.info('virtualenv: using template {}'.format(template_path))
+    template_config = dict(virtualenv_config, path=template_path,
+                           template=False)
+    virtualenv(path_resolver, template_config, force=force)
+    _clone_virtualenv(
+        template_path,
+        path_resolver.resolve_relative(virtualenv_config['path']))
+
+
+def virtualenv_lock(path_resolver, virtualenv, lockfile=None):
+    """
+    Generate or refresh virtualenv lock file (``lockfile`` setting, or
+    ``lockfile`` argument) from installed packages.
+    """
+    virtualenv_path = path_resolver.resolve_relative(virtualenv['path'])
+    with _virtualenv_lock(virtualenv_path):
+        _pip_lock(path_resolver, virtualenv, lockfile)
+
+
+def virtualenvs(path_resolver, virtualenvs, force=False, max_workers=None):
+    """
+    Provision several virtualenvs concurrently on a bounded thread pool.
+
+    Logs of each virtualenv are buffered and printed as a block when its
+    provisioning ends. Failures are reported together once all
+    virtualenvs are processed.
+    """
+    virtualenvs = list(virtualenvs)
+    paths = [path_resolver.resolve_relative(v['path']) for v in virtualenvs]
+    if len(set(paths)) != len(paths):
+        raise Exception('virtualenv: duplicated paths in {}'
+                        .format(', '.join(v['path'] for v in virtualenvs)))
+    if not virtualenvs:
+        return
+    if max_workers is None:
+        max_workers = min(len(virtualenvs), os.cpu_count() or 1)
+
+    capture = _ThreadLogCapture()
+
+    def provision(configuration):
+        capture.start()
+        error = None
+        try:
+            virtualenv(path_resolver, configuration, force=force)
+        except Exception as e:
+            error = e
+        return capture.stop(), error
+
+    import concurrent.futures
+    stdout.info('virtualenv: provisioning {} virtualenvs ({} workers)'
+                .format(len(virtualenvs), max_workers))
+    failures = []
+    capture.install()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            futures = dict((executor.submit(provision, configuration),
+                            configuration)
+                           for configuration in virtualenvs)
+            for future in concurrent.futures.as_completed(futures):
+                records, error = future.result()
+                _replay(records)
+                if error is not None:
+                    failures.append((futures[future]['path'], error))
+    finally:
+        capture.uninstall()
+    if failures:
+        for path, error in failures:
+            stdout.error('virtualenv: {} failed: {}'.format(path, error))
+        raise Exception('virtualenv: {} provisioning failure(s): {}'
+                        .format(len(failures),
+                                ', '.join(path for path, error in failures))) \
+            from failures[0][1]
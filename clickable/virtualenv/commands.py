@@ -2,17 +2,66 @@ import click
 from click.globals import get_current_context
 
 from . import virtualenv
+from . import virtualenv_lock
+from . import virtualenvs
 
 
 class VirtualenvCommand(click.Command):
+    """
+    Command whose callback receives the click context and a
+    ``virtualenv_call(path_resolver, configuration)`` helper.
+    ``configuration`` may be a list of virtualenv definitions; they are
+    then provisioned concurrently.
+
+    A ``--force-virtualenv`` option is added to force requirements
+    reinstallation, and a ``--virtualenv-workers`` option bounds
+    concurrent provisioning.
+    """
 
     def __init__(self, *args, **kwargs):
         original_callback = kwargs['callback']
 
         def callback(*args, **kwargs):
+            force = kwargs.pop('force_virtualenv', False)
+            max_workers = kwargs.pop('virtualenv_workers', None)
+
             def virtualenv_call(path_resolver, configuration):
-                virtualenv(path_resolver, configuration)
+                if isinstance(configuration, (list, tuple)):
+                    virtualenvs(path_resolver, configuration, force=force,
+                                max_workers=max_workers)
+                else:
+                    virtualenv(path_resolver, configuration, force=force)
             original_callback(get_current_context(), virtualenv_call,
                               *args, **kwargs)
         kwargs['callback'] = callback
+        params = list(kwargs.get('params', None) or [])
+        params.append(click.Option(
+            ['--force-virtualenv'], is_flag=True, default=False,
+            help='reinstall virtualenv requirements even if up to date'))
+        params.append(click.Option(
+            ['--virtualenv-workers'], type=click.IntRange(min=1), default=None,
+            help='maximum number of virtualenvs provisioned concurrently'))
+        kwargs['params'] = params
         super(VirtualenvCommand, self).__init__(*args, **kwargs)
+
+
+def virtualenv_click_group(click_group, virtualenv_provider,
+                           path_provider=None):
+    """
+    Add virtualenv management commands to ``click_group``:
+
+    * ``lock``: provision virtualenv, then generate or refresh its lock
+      file from installed packages
+    """
+    if not path_provider:
+        def path_provider(ctx):
+            return ctx.obj['path_resolver']
+
+    @click_group.command()
+    @click.option('--output', default=None,
+                  help='lock file path (default: virtualenv lockfile setting)')
+    @click.pass_context
+    def lock(ctx, output):
+        virtualenv(path_provider(ctx), virtualenv_provider(ctx))
+        virtualenv_lock(path_provider(ctx), virtualenv_provider(ctx),
+                        lockfile=output)
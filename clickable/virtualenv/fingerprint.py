@@ -0,0 +1,77 @@
+import hashlib
+import json
+import logging
+import os
+import os.path
+
+from clickable.cache import _atomic_write
+
+from .lockfile import _lockfile_digest
+from .virtualenv import _pip_env
+
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_FILENAME = '.clickable-fingerprint'
+
+
+def _fingerprint(virtualenv_path, virtualenv, lockfile_path=None):
+    """
+    Compute a fingerprint of everything that drives a virtualenv
+    provisioning: requirements list, lock file content, interpreter,
+    selinux flag and conda PKG_CONFIG_PATH.
+
+    Returns a dict with the fingerprinted ``data`` and its ``digest``.
+    """
+    python_bin = os.path.join(virtualenv_path, 'bin', 'python')
+    data = {
+        'requirements': list(virtualenv.get('requirements', [])),
+        'lockfile': _lockfile_digest(lockfile_path),
+        'python': virtualenv.get('python', 'python'),
+        'interpreter': os.path.realpath(python_bin),
+        'selinux': bool(virtualenv.get('selinux', False)),
+        'pkg_config_path': _pip_env(os.environ).get('PKG_CONFIG_PATH', None),
+    }
+    serialized = json.dumps(data, sort_keys=True)
+    digest = hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+    return {'digest': digest, 'data': data}
+
+
+def _fingerprint_path(virtualenv_path):
+    return os.path.join(virtualenv_path, FINGERPRINT_FILENAME)
+
+
+def _read_fingerprint(virtualenv_path):
+    """Read stored fingerprint; None if missing or unreadable."""
+    try:
+        with open(_fingerprint_path(virtualenv_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        logger.debug('virtualenv: no usable fingerprint in {}'
+                     .format(virtualenv_path), exc_info=True)
+        return None
+
+
+def _fingerprint_matches(virtualenv_path, fingerprint):
+    stored = _read_fingerprint(virtualenv_path)
+    return stored is not None and stored.get('digest') == fingerprint['digest']
+
+
+def _write_fingerprint(virtualenv_path, fingerprint):
+    """Store fingerprint. File is replaced atomically, so that a
+    hardlinked copy is never modified in place."""
+    _atomic_write(_fingerprint_path(virtualenv_path),
+                  lambda f: json.dump(fingerprint, f, sort_keys=True,
+                                      indent=2))
+
+
+def _remove_fingerprint(virtualenv_path):
+    try:
+        os.unlink(_fingerprint_path(virtualenv_path))
+    except FileNotFoundError:
+        pass
+
+
+def _force_from_env(environ=os.environ):
+    """CLICKABLE_VIRTUALENV_FORCE=true/1/yes forces a full reinstall."""
+    return environ.get('CLICKABLE_VIRTUALENV_FORCE', '').lower() \
+        in ('true', '1', 'yes')
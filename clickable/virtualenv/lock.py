@@ -0,0 +1,170 @@
+"""
+Cross-process lock used to serialize virtualenv provisioning.
+
+Lock is a file created with O_EXCL, holding owner host, pid and a
+unique token. Owner refreshes lock mtime while it holds it; lock is
+considered stale if its owner process is dead (same host) or if it was
+not refreshed for ``stale_timeout`` seconds.
+"""
+
+import json
+import logging
+import os
+import os.path
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+stdout = logging.getLogger('.'.join(['stdout', __name__]))
+
+DEFAULT_TIMEOUT = 600
+DEFAULT_STALE_TIMEOUT = 60
+
+
+def _timeout_from_env(environ=os.environ):
+    """CLICKABLE_VIRTUALENV_LOCK_TIMEOUT overrides lock wait time."""
+    value = environ.get('CLICKABLE_VIRTUALENV_LOCK_TIMEOUT', None)
+    return float(value) if value else DEFAULT_TIMEOUT
+
+
+class _FileLock(object):
+
+    def __init__(self, path, timeout=None, stale_timeout=DEFAULT_STALE_TIMEOUT,
+                 poll_interval=0.1):
+        self.path = path
+        self.timeout = timeout if timeout is not None else _timeout_from_env()
+        self.stale_timeout = stale_timeout
+        self.poll_interval = poll_interval
+        self.token = uuid.uuid4().hex
+        self._stop = None
+        self._heartbeat = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def acquire(self):
+        start = time.monotonic()
+        waiting = False
+        while True:
+            if self._try_create():
+                break
+            owner = self._read(self.path)
+            if self._is_stale(owner):
+                self._break(owner)
+                continue
+            if not waiting:
+                stdout.info('virtualenv: waiting for lock {} (held by {})'
+                            .format(self.path, _describe(owner)))
+                waiting = True
+            if time.monotonic() - start > self.timeout:
+                raise Exception('virtualenv: timeout waiting for lock {} '
+                                '(held by {})'
+                                .format(self.path, _describe(owner)))
+            time.sleep(self.poll_interval)
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._refresh, daemon=True)
+        self._heartbeat.start()
+
+    def release(self):
+        self._stop.set()
+        self._heartbeat.join()
+        owner = self._read(self.path)
+        if owner is not None and owner.get('token') == self.token:
+            os.unlink(self.path)
+        else:
+            logger.warning('virtualenv: lock {} was broken by another process'
+                           .format(self.path))
+
+    def _try_create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(),
+                       'token': self.token}, f)
+        return True
+
+    def _refresh(self):
+        while not self._stop.wait(self.stale_timeout / 4):
+            try:
+                os.utime(self.path)
+            except OSError:
+                logger.debug('virtualenv: cannot refresh lock {}'
+                             .format(self.path), exc_info=True)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # missing, or being written
+            return None
+
+    def _is_stale(self, owner):
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if owner is None:
+            # content is written right after creation
+            return age > self.stale_timeout
+        if owner.get('host') == socket.gethostname() \
+                and not _pid_alive(owner.get('pid')):
+            return True
+        return age > self.stale_timeout
+
+    def _break(self, owner):
+        """Remove a stale lock. Lock is renamed first, so that a lock
+        created by another process meanwhile is restored."""
+        stale_path = '{}.{}.stale'.format(self.path, self.token)
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            return
+        removed = self._read(stale_path)
+        if owner is not None and removed is not None \
+                and removed.get('token') != owner.get('token'):
+            # not the lock we checked; put it back
+            try:
+                os.link(stale_path, self.path)
+            except FileExistsError:
+                pass
+        else:
+            stdout.warning('virtualenv: removed stale lock {} (held by {})'
+                           .format(self.path, _describe(owner)))
+        os.unlink(stale_path)
+
+
+def _pid_alive(pid):
+    if not isinstance(pid, int):
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _describe(owner):
+    if owner is None:
+        return 'unknown owner'
+    return 'pid {} on {}'.format(owner.get('pid'), owner.get('host'))
+
+
+def _virtualenv_lock(virtualenv_path, **kwargs):
+    """Lock for virtualenv provisioning: <virtualenv_path>.lock"""
+    parent = os.path.dirname(virtualenv_path)
+    if parent and not os.path.exists(parent):
+        os.makedirs(parent, exist_ok=True)
+    return _FileLock('{}.lock'.format(virtualenv_path.rstrip(os.sep)),
+                     **kwargs)
@@ -0,0 +1,74 @@
+"""
+Lock files: fully pinned, hashed requirements files, as accepted by
+``pip install --require-hashes``::
+
+    name==1.0 \
+        --hash=sha256:...
+"""
+
+import collections
+import hashlib
+import os
+import os.path
+import re
+
+from clickable.cache import _atomic_write
+
+LockEntry = collections.namedtuple('LockEntry', ['requirement', 'line'])
+
+_HASH_OPTION = re.compile(r'\s--hash[=\s]')
+
+
+def _lockfile_path(path_resolver, virtualenv):
+    """``lockfile`` virtualenv setting, resolved; None if not set."""
+    lockfile = virtualenv.get('lockfile', None)
+    if not lockfile:
+        return None
+    return path_resolver.resolve_relative(lockfile)
+
+
+def _lockfile_digest(lockfile_path):
+    """sha256 of lock file content; None if lock file is missing."""
+    if not lockfile_path or not os.path.isfile(lockfile_path):
+        return None
+    with open(lockfile_path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _read_lockfile(lockfile_path):
+    """
+    Parse lock file entries. Continuation lines are joined, comments and
+    blank lines are dropped. ``requirement`` is the specifier without
+    pip options.
+    """
+    entries = []
+    with open(lockfile_path) as f:
+        content = re.sub(r'\\\n', ' ', f.read())
+    for line in content.splitlines():
+        line = ' '.join(re.sub(r'(^|\s)#.*$', '', line).split())
+        if not line:
+            continue
+        requirement = _HASH_OPTION.split(' ' + line, 1)[0].strip()
+        entries.append(LockEntry(requirement, line))
+    return entries
+
+
+def _write_lockfile(lockfile_path, pins):
+    """
+    Write lock file from ``pins``, a dict mapping ``name==version``
+    requirements to a list of sha256 hashes.
+    """
+    lines = []
+    lines.append('# generated by clickable; do not edit')
+    for requirement in sorted(pins, key=str.lower):
+        hashes = ['    --hash=sha256:{}'.format(h) for h in pins[requirement]]
+        lines.append(' \\\n'.join([requirement] + hashes))
+    _atomic_write(lockfile_path, lambda f: f.write('\n'.join(lines) + '\n'))
+
+
+def _artifact_name(filename):
+    """Project name from a wheel or sdist filename."""
+    if filename.endswith('.whl'):
+        return filename.split('-')[0]
+    base = re.sub(r'\.(tar\.gz|tar\.bz2|tar\.xz|zip|tgz)$', '', filename)
+    return base.rsplit('-', 1)[0]
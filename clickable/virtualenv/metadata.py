@@ -0,0 +1,148 @@
+"""
+Read installed packages from virtualenv's site-packages metadata
+(``*.dist-info``, ``*.egg-info``) without spawning pip.
+"""
+
+import glob
+import logging
+import os
+import os.path
+import re
+
+logger = logging.getLogger(__name__)
+
+# packages hidden by `pip freeze`
+FREEZE_EXCLUDES = ('pip', 'setuptools', 'wheel', 'distribute')
+
+_SIMPLE_REQUIREMENT = re.compile(
+    r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:(===?)\s*([^\s,;]+))?\s*$')
+
+
+def _canonical_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+def _site_packages(virtualenv_path):
+    """List site-packages folders of a virtualenv (lib64 symlinks are
+    only listed once)."""
+    paths = []
+    for pattern in ('lib', 'lib64'):
+        for path in sorted(glob.glob(os.path.join(
+                virtualenv_path, pattern, 'python*', 'site-packages'))):
+            if os.path.realpath(path) not in \
+                    [os.path.realpath(p) for p in paths]:
+                paths.append(path)
+    return paths
+
+
+def _read_metadata(path):
+    """Parse name and version from a METADATA / PKG-INFO file."""
+    with open(path, encoding='utf-8', errors='replace') as f:
+        import email.parser
+        headers = email.parser.HeaderParser().parse(f, headersonly=True)
+    return headers.get('Name', None), headers.get('Version', None)
+
+
+def _metadata_file(path):
+    if path.endswith('.dist-info'):
+        return os.path.join(path, 'METADATA')
+    elif os.path.isdir(path):
+        return os.path.join(path, 'PKG-INFO')
+    else:
+        # distutils installs a single egg-info file
+        return path
+
+
+def _installed_distributions(virtualenv_path):
+    """
+    Return a dict mapping canonical project names to ``(name, version)``
+    tuples, or None if virtualenv has no site-packages folder.
+    """
+    site_packages = _site_packages(virtualenv_path)
+    if not site_packages:
+        return None
+    distributions = {}
+    for site_package in site_packages:
+        for path in sorted(
+                glob.glob(os.path.join(site_package, '*.dist-info'))
+                + glob.glob(os.path.join(site_package, '*.egg-info'))):
+            try:
+                name, version = _read_metadata(_metadata_file(path))
+            except OSError:
+                logger.debug('virtualenv: unreadable metadata {}'.format(path),
+                             exc_info=True)
+                continue
+            if not name or not version:
+                logger.debug('virtualenv: incomplete metadata {}'.format(path))
+                continue
+            distributions.setdefault(_canonical_name(name), (name, version))
+    return distributions
+
+
+def _freeze_set(distributions):
+    """Build a `pip freeze`-like name==version set."""
+    return set('{}=={}'.format(name, version)
+               for key, (name, version) in distributions.items()
+               if key not in FREEZE_EXCLUDES)
+
+
+def _installed_packages(virtualenv_path):
+    """`pip freeze`-like name==version set; None if site-packages is
+    missing."""
+    distributions = _installed_distributions(virtualenv_path)
+    if distributions is None:
+        return None
+    return _freeze_set(distributions)
+
+
+def _packaging():
+    """`packaging` module if available, imported on first use."""
+    try:
+        import packaging.requirements
+        import packaging.version
+    except ImportError:
+        return None
+    return packaging
+
+
+def _requirement_satisfied(distributions, requirement):
+    """
+    Check if a requirement specifier is satisfied by installed
+    distributions.
+
+    Answer is conservative: pip options, urls, markers and extras are
+    reported as unsatisfied. Without `packaging`, only bare names and
+    `==`/`===` pins are evaluated.
+    """
+    packaging = _packaging()
+    if packaging is not None:
+        try:
+            parsed = packaging.requirements.Requirement(requirement)
+        except packaging.requirements.InvalidRequirement:
+            return False
+        if parsed.url or parsed.marker or parsed.extras:
+            return False
+        installed = distributions.get(_canonical_name(parsed.name), None)
+        if installed is None:
+            return False
+        try:
+            version = packaging.version.Version(installed[1])
+        except packaging.version.InvalidVersion:
+            return False
+        return parsed.specifier.contains(version, prereleases=True)
+    match = _SIMPLE_REQUIREMENT.match(requirement)
+    if not match:
+        return False
+    name, operator, version = match.groups()
+    installed = distributions.get(_canonical_name(name), None)
+    if installed is None:
+        return False
+    if operator is None:
+        return True
+    return installed[1] == version
+
+
+def _unsatisfied_requirements(distributions, requirements):
+    """Return requirements not satisfied by installed distributions."""
+    return [requirement for requirement in requirements
+            if not _requirement_satisfied(distributions, requirement)]
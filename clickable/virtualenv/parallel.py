@@ -0,0 +1,55 @@
+import logging
+import threading
+
+# loggers whose records are captured during parallel provisioning
+CAPTURED_LOGGERS = ('clickable.virtualenv', 'stdout.clickable.virtualenv')
+
+
+class _ThreadLogCapture(logging.Filter):
+    """
+    Logger filter capturing records emitted by threads that called
+    :meth:`start`. Records from other threads pass through.
+
+    Captured records are returned by :meth:`stop` and can be replayed
+    with :func:`_replay` so that logs of concurrent tasks do not
+    interleave.
+    """
+
+    def __init__(self):
+        super(_ThreadLogCapture, self).__init__()
+        self._local = threading.local()
+        self._loggers = []
+
+    def install(self):
+        manager = logging.Logger.manager
+        for name, logger in list(manager.loggerDict.items()):
+            if isinstance(logger, logging.Logger) \
+                    and any(name == prefix or name.startswith(prefix + '.')
+                            for prefix in CAPTURED_LOGGERS):
+                logger.addFilter(self)
+                self._loggers.append(logger)
+
+    def uninstall(self):
+        for logger in self._loggers:
+            logger.removeFilter(self)
+        self._loggers = []
+
+    def start(self):
+        self._local.records = []
+
+    def stop(self):
+        records = getattr(self._local, 'records', [])
+        self._local.records = None
+        return records
+
+    def filter(self, record):
+        records = getattr(self._local, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
+def _replay(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
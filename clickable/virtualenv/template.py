@@ -0,0 +1,183 @@
+"""
+Template virtualenvs: pristine, fully-installed virtualenvs kept in user
+cache folder and cloned into project virtualenvs.
+"""
+
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import os.path
+import shutil
+import tempfile
+
+from clickable.cache import cache_dir
+
+from .lockfile import _lockfile_digest
+from .virtualenv import _pip_env
+
+logger = logging.getLogger(__name__)
+stdout = logging.getLogger('.'.join(['stdout', __name__]))
+
+# linux ioctl to clone a file extent (reflink) on btrfs, xfs, ...
+FICLONE = 0x40049409
+
+# files whose content may contain virtualenv absolute path
+REWRITE_FOLDERS = ('bin',)
+REWRITE_SUFFIXES = ('pyvenv.cfg', '.pth', '.egg-link')
+
+
+def _template_enabled(virtualenv, environ=os.environ):
+    """``template: true`` in virtualenv definition or
+    CLICKABLE_VIRTUALENV_TEMPLATE=true/1/yes enables templates; an
+    explicit ``template`` setting overrides environment."""
+    if 'template' in virtualenv:
+        return bool(virtualenv['template'])
+    return environ.get('CLICKABLE_VIRTUALENV_TEMPLATE', '').lower() \
+        in ('true', '1', 'yes')
+
+
+def _template_path(virtualenv, lockfile_path=None):
+    """Template location, keyed by interpreter, requirements and lock
+    file."""
+    python = virtualenv.get('python', 'python')
+    python_path = shutil.which(python) if python else None
+    data = {
+        'python': python,
+        'interpreter': os.path.realpath(python_path) if python_path else None,
+        'requirements': list(virtualenv.get('requirements', [])),
+        'lockfile': _lockfile_digest(lockfile_path),
+        'selinux': bool(virtualenv.get('selinux', False)),
+        'pkg_config_path': _pip_env(os.environ).get('PKG_CONFIG_PATH', None),
+    }
+    serialized = json.dumps(data, sort_keys=True)
+    key = hashlib.sha256(serialized.encode('utf-8')).hexdigest()[0:16]
+    return cache_dir('virtualenv-templates', key)
+
+
+def _clone_virtualenv(source_path, target_path):
+    """
+    Clone ``source_path`` virtualenv in ``target_path``.
+
+    Files are reflinked if filesystem allows it, else hardlinked, else
+    copied. Scripts, pyvenv.cfg and .pth files referencing
+    ``source_path`` are rewritten. Files must never be modified in place
+    in a cloned virtualenv (pip replaces files, so it is safe).
+
+    Clone is built in a sibling temporary folder, then renamed to
+    ``target_path``; an existing (broken) ``target_path`` is replaced.
+    """
+    source_path = os.path.abspath(source_path)
+    target_path = os.path.abspath(target_path)
+    parent_path, name = os.path.split(target_path)
+    os.makedirs(parent_path, exist_ok=True)
+    clone_path = tempfile.mkdtemp(prefix='.{}.clone-'.format(name),
+                                  dir=parent_path)
+    try:
+        shutil.copymode(source_path, clone_path)
+        mode = _clone_tree(source_path, clone_path, target_path)
+        if os.path.lexists(target_path):
+            old_path = tempfile.mkdtemp(prefix='.{}.old-'.format(name),
+                                        dir=parent_path)
+            os.rename(target_path, os.path.join(old_path, name))
+            os.rename(clone_path, target_path)
+            shutil.rmtree(old_path, ignore_errors=True)
+        else:
+            os.rename(clone_path, target_path)
+    except BaseException:
+        shutil.rmtree(clone_path, ignore_errors=True)
+        raise
+    stdout.info('virtualenv: cloned {} from template ({})'
+                .format(target_path, mode))
+
+
+def _clone_tree(source_path, clone_path, target_path):
+    """Clone ``source_path`` in ``clone_path``, rewriting references to
+    ``source_path`` as ``target_path``; returns link mode."""
+    source_bytes = source_path.encode('utf-8')
+    target_bytes = target_path.encode('utf-8')
+    linker = _Linker()
+    for dirpath, dirnames, filenames in os.walk(source_path):
+        relative_dir = os.path.relpath(dirpath, source_path)
+        target_dir = os.path.normpath(os.path.join(clone_path, relative_dir))
+        os.makedirs(target_dir, exist_ok=True)
+        for name in list(dirnames) + filenames:
+            source = os.path.join(dirpath, name)
+            target = os.path.join(target_dir, name)
+            if os.path.islink(source):
+                link = os.readlink(source)
+                if link.startswith(source_path):
+                    link = target_path + link[len(source_path):]
+                os.symlink(link, target)
+                if name in dirnames:
+                    # do not walk symlinked folders
+                    dirnames.remove(name)
+            elif name in dirnames:
+                continue
+            elif relative_dir in REWRITE_FOLDERS \
+                    or name.endswith(REWRITE_SUFFIXES):
+                _rewrite(source, target, source_bytes, target_bytes, linker)
+            else:
+                linker.link(source, target)
+    return linker.mode
+
+
+def _rewrite(source, target, source_bytes, target_bytes, linker):
+    with open(source, 'rb') as f:
+        content = f.read()
+    if source_bytes not in content:
+        linker.link(source, target)
+        return
+    with open(target, 'wb') as f:
+        f.write(content.replace(source_bytes, target_bytes))
+    shutil.copymode(source, target)
+
+
+class _Linker(object):
+    """Reflink, else hardlink, else copy files; first failure disables
+    a method for the remaining files."""
+
+    def __init__(self):
+        self.reflink = True
+        self.hardlink = True
+
+    @property
+    def mode(self):
+        return 'reflink' if self.reflink \
+            else 'hardlink' if self.hardlink else 'copy'
+
+    def link(self, source, target):
+        if self.reflink:
+            try:
+                _reflink(source, target)
+                return
+            except OSError:
+                logger.debug('reflink not available for {}'.format(target),
+                             exc_info=True)
+                self.reflink = False
+        if self.hardlink:
+            try:
+                os.link(source, target)
+                return
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    raise
+                logger.debug('hardlink not available for {}'.format(target),
+                             exc_info=True)
+                self.hardlink = False
+        shutil.copy2(source, target)
+
+
+def _reflink(source, target):
+    with open(source, 'rb') as source_file:
+        with open(target, 'wb') as target_file:
+            try:
+                fcntl.ioctl(target_file.fileno(), FICLONE,
+                            source_file.fileno())
+            except OSError:
+                target_file.close()
+                os.unlink(target)
+                raise
+    shutil.copystat(source, target)
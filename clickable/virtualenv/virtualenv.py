@@ -1,10 +1,27 @@
+import collections
 import glob
+import hashlib
 import json
 import locale
 import logging
 import os.path
+import re
 import shlex
 import subprocess
+import tempfile
+import time
+
+from clickable.cache import _atomic_write
+from clickable.cache import cache_dir
+
+from .lockfile import _artifact_name
+from .lockfile import _lockfile_path
+from .lockfile import _read_lockfile
+from .lockfile import _write_lockfile
+from .metadata import _canonical_name
+from .metadata import _freeze_set
+from .metadata import _installed_distributions
+from .metadata import _unsatisfied_requirements
 
 logger = logging.getLogger(__name__)
 stdout = logging.getLogger('.'.join(['stdout', __name__]))
@@ -25,6 +42,10 @@ def _virtualenv(path_resolver, virtualenv):
         virtualenv root folder; either absolute, or relative from tasks.py file
     requirements: iterable
         list of package specs
+    deep_check: bool
+        check existing virtualenv by running its interpreter instead of
+        a stat-based check (CLICKABLE_VIRTUALENV_DEEP_CHECK=1 also
+        enables it)
 
     """
     # only create if missing
@@ -32,7 +53,9 @@ def _virtualenv(path_resolver, virtualenv):
     virtualenv_path_short = virtualenv['path']
     selinux = virtualenv.get('selinux', False)
     python = virtualenv.get('python', 'python')
-    if not _check_virtualenv(virtualenv_path):
+    deep = bool(virtualenv['deep_check']) if 'deep_check' in virtualenv \
+        else _deep_check_from_env()
+    if not _check_virtualenv(virtualenv_path, deep=deep):
         stdout.info('virtualenv: {} missing, creating...'
                     .format(os.path.basename(virtualenv_path_short)))
         # create parent folder if missing
@@ -47,7 +70,7 @@ def _virtualenv(path_resolver, virtualenv):
         command.append(virtualenv_path)
         subprocess.check_call(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         # check consistency; virtualenv must be valid now
-        if not _check_virtualenv(virtualenv_path):
+        if not _check_virtualenv(virtualenv_path, deep=True):
             raise Exception('virtualenv {} creation fails'.format(virtualenv_path))
         # symlink selinux system-packages in virtualenv if needed and selinux found
         if selinux:
@@ -56,16 +79,23 @@ def _virtualenv(path_resolver, virtualenv):
         stdout.info('virtualenv: {} existing, skipping'
                     .format(os.path.basename(virtualenv_path_short)))
 
+
+# selinux probe command; prints selinux module and extension locations
+SELINUX_PROBE = 'import json; ' \
+    + 'import selinux; ' \
+    + 'print(json.dumps([selinux.__file__, selinux._selinux.__file__]))'
+
+
 def _selinux(virtualenv_path):
-    # detect virtualenv version
+    """
+    Symlink selinux module from the first selinux-enabled interpreter
+    (virtualenv python, then system python).
+
+    Interpreters are probed concurrently; probe results are cached in
+    user cache folder, keyed by interpreter path and mtime.
+    """
     python = os.path.join(virtualenv_path, 'bin', 'python')
-    python_command = [
-            python,
-            '-c',
-            'import sys, json; print(json.dumps(sys.version_info[0]))'
-    ]
-    output = subprocess.check_output(python_command, stderr=subprocess.STDOUT, text=True)
-    version = json.loads(output)
+    version = _python_major_version(virtualenv_path)
 
     # search selinux from an interpreters list
     interpreters = []
@@ -80,73 +110,223 @@ def _selinux(virtualenv_path):
         interpreters.append('/usr/bin/python3')
     logger.debug('Searching selinux in: {}'.format(', '.join(interpreters)))
 
-    # Iterate over interpreters list
     # Install from the first selinux-enabled interpreter
-    selected_selinux = None
-    for selinux_python in interpreters:
-        # check if selinux is available
-        selinux_command = [
-                selinux_python,
-                '-c',
-                'import json; '
-                + 'import selinux; '
-                + 'print(json.dumps([selinux.__file__, selinux._selinux.__file__]))'
-        ]
-        try:
-            output = subprocess.check_output(selinux_command, stderr=subprocess.STDOUT, text=True)
-        except subprocess.CalledProcessError as processError:
-            # selinux not available, ignore it
-            logger.debug('selinux not available, ignore it ({})'.format(selinux_command))
-            logger.debug(processError.output)
-            continue
-        except Exception:
-            logger.debug('interpreter not found, skipping: {}'.format(selinux_command))
-            continue
-        if not output:
-            logger.warn('selinux detected but not found for {}'.format(selinux_python))
-        else:
-            info = json.loads(output)
-            location = info[0]
-            so_location = info[1]
-            module_location = os.path.dirname(location)
-            python_site_packages = glob.glob(os.path.join(virtualenv_path, 'lib', 'python*', 'site-packages'))[0]
-            target_module_location = os.path.join(python_site_packages, 'selinux')
-            target_so_location = os.path.join(python_site_packages, '_selinux.so')
-            if not os.path.exists(target_module_location):
-                os.symlink(module_location, target_module_location)
-            if not os.path.exists(target_so_location):
-                os.symlink(so_location, target_so_location)
-            selected_selinux = selinux_python
+    selected = _probe_selinux(interpreters, virtualenv_path)
+    if selected:
+        selected_selinux, (location, so_location) = selected
+        module_location = os.path.dirname(location)
+        python_site_packages = glob.glob(os.path.join(
+            virtualenv_path, 'lib', 'python*', 'site-packages'))[0]
+        target_module_location = os.path.join(python_site_packages, 'selinux')
+        target_so_location = os.path.join(python_site_packages, '_selinux.so')
+        if not os.path.exists(target_module_location):
+            os.symlink(module_location, target_module_location)
+        if not os.path.exists(target_so_location):
+            os.symlink(so_location, target_so_location)
 
     # info message if installation is done, else warn message
-    if selected_selinux:
-        stdout.info('Selinux installed from {}'.format(selected_selinux))
+    if selected:
+        stdout.info('Selinux installed from {}'.format(selected[0]))
     else:
         stdout.warn('No selinux installation found. Selinux not installed.')
 
-def _check_virtualenv(virtualenv_path):
+
+def _python_major_version(virtualenv_path):
+    """Virtualenv python major version, from pyvenv.cfg or lib folder
+    name; virtualenv python is run as a fallback."""
+    try:
+        config = _read_pyvenv_cfg(virtualenv_path)
+        version = config.get('version_info', None) \
+            or config.get('version', None)
+        if version:
+            return int(version.split('.')[0])
+    except (OSError, ValueError):
+        logger.debug('no python version in pyvenv.cfg', exc_info=True)
+    for lib_path in glob.glob(os.path.join(virtualenv_path, 'lib', 'python*')):
+        match = re.match(r'^python(\d)', os.path.basename(lib_path))
+        if match:
+            return int(match.group(1))
+    python = os.path.join(virtualenv_path, 'bin', 'python')
+    python_command = [
+            python,
+            '-c',
+            'import sys, json; print(json.dumps(sys.version_info[0]))'
+    ]
+    output = subprocess.check_output(python_command,
+                                     stderr=subprocess.STDOUT, text=True)
+    return json.loads(output)
+
+
+def _selinux_cache_key(interpreter, virtualenv_path):
+    """
+    Probe cache key: interpreter path and resolved interpreter mtime.
+    Virtualenv interpreter is keyed by its base interpreter and
+    system-site-packages setting, so that it is shared between
+    virtualenvs. None if interpreter is missing.
+    """
+    try:
+        mtime = os.stat(interpreter).st_mtime_ns
+    except OSError:
+        return None
+    if os.path.dirname(os.path.dirname(interpreter)) == virtualenv_path:
+        try:
+            config = _read_pyvenv_cfg(virtualenv_path)
+        except OSError:
+            return None
+        return 'venv:{}:{}:{}'.format(
+            os.path.realpath(interpreter), mtime,
+            config.get('include-system-site-packages', 'false'))
+    return '{}:{}'.format(interpreter, mtime)
+
+
+def _probe_selinux(interpreters, virtualenv_path):
+    """
+    Return (interpreter, [module location, extension location]) for the
+    first interpreter (in list order) with a usable selinux module, or
+    None.
+
+    Only usable installations are cached (selinux may be installed
+    later for an interpreter), and they are probed again if their files
+    are gone.
+    """
+    cache_path = cache_dir('selinux-probes.json')
+    cache = dict((key, info)
+                 for key, info in (_read_json(cache_path) or {}).items()
+                 if info)
+    keys = dict((i, _selinux_cache_key(i, virtualenv_path))
+                for i in interpreters)
+    selected = None
+    updated = False
+    futures = {}
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(len(interpreters))
+    try:
+        # probe interpreters up to the first cached usable one
+        for interpreter in interpreters:
+            key = keys[interpreter]
+            if _cached_selinux(cache, key):
+                break
+            if key is not None:
+                futures[interpreter] = executor.submit(
+                    _probe_selinux_interpreter, interpreter)
+        for interpreter in interpreters:
+            key = keys[interpreter]
+            if key is None:
+                logger.debug('interpreter not found, skipping: {}'
+                             .format(interpreter))
+                continue
+            info = _cached_selinux(cache, key)
+            if info:
+                logger.debug('selinux probe cached for {}'.format(interpreter))
+            else:
+                info = futures[interpreter].result()
+                if info or key in cache:
+                    updated = True
+                _cache_selinux(cache, key, info)
+            if info:
+                selected = (interpreter, info)
+                break
+        # keep results of probes already done
+        for interpreter, future in futures.items():
+            if future.done() and not future.cancelled() and future.result():
+                _cache_selinux(cache, keys[interpreter], future.result())
+                updated = True
+    finally:
+        # remaining probes are not needed
+        for future in futures.values():
+            future.cancel()
+        executor.shutdown(wait=False)
+    if updated:
+        _write_json(cache_path, cache)
+    return selected
+
+
+def _cached_selinux(cache, key):
+    """Cached selinux locations of ``key``, if they still exist."""
+    info = cache.get(key, None) if key is not None else None
+    if info and all(os.path.exists(path) for path in info):
+        return info
+    return None
+
+
+def _cache_selinux(cache, key, info):
+    if info:
+        cache[key] = info
+    else:
+        cache.pop(key, None)
+
+
+def _probe_selinux_interpreter(interpreter):
+    """Run selinux probe with interpreter; None if selinux is not
+    available."""
+    selinux_command = [interpreter, '-c', SELINUX_PROBE]
+    try:
+        output = subprocess.check_output(selinux_command,
+                                         stderr=subprocess.STDOUT, text=True)
+    except subprocess.CalledProcessError as processError:
+        # selinux not available, ignore it
+        logger.debug('selinux not available, ignore it ({})'
+                     .format(selinux_command))
+        logger.debug(processError.output)
+        return None
+    except Exception:
+        logger.debug('interpreter not found, skipping: {}'
+                     .format(selinux_command))
+        return None
+    if not output:
+        logger.warn('selinux detected but not found for {}'
+                    .format(interpreter))
+        return None
+    return json.loads(output)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, content):
+    _atomic_write(path, lambda f: json.dump(content, f))
+
+
+def _deep_check_from_env(environ=os.environ):
+    return environ.get('CLICKABLE_VIRTUALENV_DEEP_CHECK', '').lower() \
+        in ('true', '1', 'yes')
+
+
+# per-process memoization of virtualenv checks
+_check_cache = {}
+
+
+def _check_virtualenv(virtualenv_path, deep=False):
     """
-    Check if virtualenv is initialized in virtualenv folder (based on
-    bin/python file).
+    Check if virtualenv is initialized in virtualenv folder.
+
+    Default check is stat-based: pyvenv.cfg must be valid and bin/python
+    must resolve to an executable file. Virtualenvs without pyvenv.cfg
+    (legacy virtualenv) and ``deep`` checks run bin/python. Results are
+    memoized with pyvenv.cfg and interpreter stats as key.
 
     Parameters
     ----------
     virtualenv_folder: str
         absolute path for the virtualenv root folder to check
+    deep: bool
+        run bin/python instead of checking files
     """
-    # check <virtualenv_path>/bin/python existence
     python_bin = os.path.join(virtualenv_path, 'bin/python')
-    logger.info(python_bin)
-    found = False
-    try:
-        subprocess.check_call(
-            [python_bin, '--version'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE)
-        found = True
-    except Exception:
-        logger.debug('bin/python not found in {}'.format(python_bin),
-                     exc_info=True)
+    key = (virtualenv_path, deep,
+           _path_stat_key(os.path.join(virtualenv_path, 'pyvenv.cfg')),
+           _path_stat_key(python_bin))
+    if key in _check_cache:
+        return _check_cache[key]
+    if deep or key[2] is None:
+        found = _check_virtualenv_exec(python_bin)
+    else:
+        found = _check_virtualenv_stat(virtualenv_path, python_bin)
     logger.info('virtualenv: {} {}'
                 .format(
                     python_bin,
@@ -155,43 +335,148 @@ def _check_virtualenv(virtualenv_path):
                     else 'not found'
                 )
                 )
+    _check_cache[key] = found
     return found
 
 
-def _pip_packages(path_resolver, virtualenv):
+def _path_stat_key(path):
+    """(mtime, size) of path (symlinks followed); None if missing."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _read_pyvenv_cfg(virtualenv_path):
+    """Parse pyvenv.cfg key = value lines."""
+    config = {}
+    with open(os.path.join(virtualenv_path, 'pyvenv.cfg')) as f:
+        for line in f:
+            key, sep, value = line.partition('=')
+            if sep:
+                config[key.strip().lower()] = value.strip()
+    return config
+
+
+def _check_virtualenv_stat(virtualenv_path, python_bin):
+    try:
+        config = _read_pyvenv_cfg(virtualenv_path)
+    except OSError:
+        logger.debug('pyvenv.cfg not readable in {}'.format(virtualenv_path),
+                     exc_info=True)
+        return False
+    home = config.get('home', None)
+    if not home or not os.path.isdir(home):
+        logger.debug('pyvenv.cfg home {} not found'.format(home))
+        return False
+    if not os.path.isfile(python_bin) or not os.access(python_bin, os.X_OK):
+        logger.debug('bin/python not found or broken link: {}'
+                     .format(python_bin))
+        return False
+    # pyvenv.cfg version must match virtualenv's lib folder
+    version = config.get('version_info', None) or config.get('version', None)
+    if version:
+        lib_path = os.path.join(virtualenv_path, 'lib', 'python{}'.format(
+            '.'.join(version.split('.')[0:2])))
+        if not os.path.isdir(lib_path):
+            logger.debug('{} not found'.format(lib_path))
+            return False
+    return True
+
+
+def _check_virtualenv_exec(python_bin):
+    try:
+        subprocess.check_call(
+            [python_bin, '--version'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        return True
+    except Exception:
+        logger.debug('bin/python not found in {}'.format(python_bin),
+                     exc_info=True)
+        return False
+
+
+def _pip_packages(path_resolver, virtualenv, force=False):
     """
     Install pypi packages (with pip) inside a virtualenv environment.
+
+    Installed packages are read from site-packages metadata; only
+    unsatisfied requirements are passed to pip, satisfied ones being
+    passed as constraints (so that their pins still apply to
+    dependencies), and pip is not launched if all requirements are
+    already satisfied. With ``force``, all requirements are reinstalled
+    (``--force-reinstall``).
+
+    If a wheelhouse is configured (``wheelhouse``), packages are
+    installed from it without index; ``offline`` forbids building missing
+    wheels.
+
+    If a lock file is configured (``lockfile``), its unsatisfied pins are
+    installed first with ``--no-deps --require-hashes``.
     """
-    pip_binary = os.path.join(
-        path_resolver.resolve_relative(virtualenv['path']), 'bin', 'pip')
+    virtualenv_path = path_resolver.resolve_relative(virtualenv['path'])
+    pip_binary = os.path.join(virtualenv_path, 'bin', 'pip')
     pip_binary = os.path.normpath(pip_binary)
 
     # store initial state
-    initial_pkglist_set = _pip_freeze(pip_binary)
+    distributions = _installed_distributions(virtualenv_path)
+    initial_pkglist_set = _pkglist_set(virtualenv_path, pip_binary,
+                                       distributions)
     if len(initial_pkglist_set) > 0:
         logger.debug('virtualenv: pip pre-install status\n\t{}'
                      .format('\n\t'.join(initial_pkglist_set)))
     else:
         logger.debug('virtualenv: pip pre-install - no packages')
 
-    # perform installation
-    pi_args = []
-    pi_args.append(pip_binary)
-    pi_args.append('install')
-    for package in virtualenv['requirements']:
-        pi_args.append(package)
+    wheelhouse = _wheelhouse(path_resolver, virtualenv)
+    offline = _offline(virtualenv)
+
+    # install lock file pins first, without dependency resolution
+    locked = False
+    lockfile = _lockfile_path(path_resolver, virtualenv)
+    if lockfile:
+        locked = _pip_install_lockfile(pip_binary, lockfile,
+                                       None if force else distributions,
+                                       wheelhouse, offline, force)
+        if locked:
+            distributions = _installed_distributions(virtualenv_path)
+
+    # only pass unsatisfied requirements to pip
+    requirements = list(virtualenv.get('requirements', []))
+    if distributions is not None and not force:
+        missing = _unsatisfied_requirements(distributions, requirements)
+    else:
+        missing = requirements
+    if not missing:
+        stdout.info('virtualenv: {} requirement(s) satisfied, skipping pip'
+                    .format(len(requirements)))
+        if not locked:
+            return
+    elif force:
+        stdout.info('virtualenv: reinstalling {} requirement(s)'
+                    .format(len(missing)))
+        _pip_install(pip_binary, ['--force-reinstall'] + missing,
+                     wheelhouse, offline)
+    else:
+        stdout.info('virtualenv: {} requirement(s) satisfied, {} to install'
+                    .format(len(requirements) - len(missing), len(missing)))
+        logger.debug('virtualenv: unsatisfied requirements\n\t{}'
+                     .format('\n\t'.join(missing)))
+        satisfied = [r for r in requirements if r not in missing]
+        with tempfile.NamedTemporaryFile('w', prefix='clickable-constraints-',
+                                         suffix='.txt') as f:
+            args = []
+            if satisfied:
+                f.write('\n'.join(_constraint(r) for r in satisfied) + '\n')
+                f.flush()
+                args.extend(['-c', f.name])
+            _pip_install(pip_binary, args + missing, wheelhouse, offline)
 
-    cmd = " ".join([shlex.quote(i) for i in pi_args])
-    try:
-        subprocess.check_output(pi_args,
-            stderr=subprocess.PIPE,
-            env=_pip_env(os.environ))
-    except subprocess.CalledProcessError as e1:
-        raise Exception("Command {} failed with output: {}".format(cmd, e1.output)) from e1
-    except Exception as e2:
-        raise Exception("Command {} failed".format(cmd)) from e2
     # print some feedback about installs
-    final_pkglist_set = _pip_freeze(pip_binary)
+    final_pkglist_set = _pkglist_set(
+        virtualenv_path, pip_binary, _installed_distributions(virtualenv_path))
     logger.debug('virtualenv: pip post-install status\n\t{}'
                  .format('\n\t'.join(final_pkglist_set)))
     installed = set(final_pkglist_set) - set(initial_pkglist_set)
@@ -202,6 +487,271 @@ def _pip_packages(path_resolver, virtualenv):
         stdout.info('virtualenv: no missing pip packages')
 
 
+def _constraint(requirement):
+    """Requirement as a constraint: pip does not accept extras in
+    constraints."""
+    return re.sub(r'\[[^\]]*\]', '', requirement, count=1)
+
+
+def _wheelhouse(path_resolver, virtualenv):
+    """
+    Wheelhouse folder from ``wheelhouse`` virtualenv setting (true for
+    user-level wheelhouse, else a folder relative to project), or
+    CLICKABLE_WHEELHOUSE (true/1/yes for user-level wheelhouse, false/0/no
+    to disable, else a folder); None if disabled. An explicit setting
+    overrides environment.
+    """
+    if 'wheelhouse' in virtualenv:
+        wheelhouse = virtualenv['wheelhouse']
+    else:
+        wheelhouse = os.environ.get('CLICKABLE_WHEELHOUSE', None)
+    if isinstance(wheelhouse, str):
+        if wheelhouse.lower() in ('true', '1', 'yes'):
+            wheelhouse = True
+        elif wheelhouse.lower() in ('false', '0', 'no'):
+            wheelhouse = None
+    if not wheelhouse:
+        return None
+    elif wheelhouse is True:
+        return cache_dir('wheelhouse')
+    else:
+        return path_resolver.resolve_relative(wheelhouse)
+
+
+def _offline(virtualenv):
+    """``offline`` virtualenv setting, or CLICKABLE_OFFLINE=true/1/yes;
+    an explicit setting overrides environment."""
+    if 'offline' in virtualenv:
+        return bool(virtualenv['offline'])
+    return os.environ.get('CLICKABLE_OFFLINE', '').lower() \
+        in ('true', '1', 'yes')
+
+
+def _pip_install(pip_binary, args, wheelhouse, offline):
+    """`pip install args`, from wheelhouse if configured."""
+    if wheelhouse:
+        _pip_install_wheelhouse(pip_binary, args, wheelhouse, offline)
+    elif offline:
+        raise Exception('virtualenv: offline mode requires a wheelhouse')
+    else:
+        _pip(pip_binary, ['install'] + args)
+
+
+def _pip_install_lockfile(pip_binary, lockfile, distributions, wheelhouse,
+                          offline, force=False):
+    """
+    Install lock file entries not satisfied by ``distributions`` (all
+    entries if None), with dependency resolution disabled; ``force``
+    reinstalls them. Returns True if pip was launched.
+    """
+    if not os.path.isfile(lockfile):
+        stdout.warning('virtualenv: lock file {} not found, ignored'
+                       .format(lockfile))
+        return False
+    entries = _read_lockfile(lockfile)
+    if distributions is not None:
+        missing = [entry for entry in entries
+                   if _unsatisfied_requirements(distributions,
+                                                [entry.requirement])]
+    else:
+        missing = entries
+    stdout.info('virtualenv: {} locked requirement(s) satisfied, {} to install'
+                .format(len(entries) - len(missing), len(missing)))
+    if not missing:
+        return False
+    with tempfile.NamedTemporaryFile('w', prefix='clickable-lock-',
+                                     suffix='.txt') as f:
+        f.write('\n'.join(entry.line for entry in missing) + '\n')
+        f.flush()
+        args = ['--no-deps', '--require-hashes', '-r', f.name]
+        if force:
+            args.insert(0, '--force-reinstall')
+        _pip_install(pip_binary, args, wheelhouse, offline)
+    return True
+
+
+def _pip_lock(path_resolver, virtualenv, lockfile=None):
+    """
+    Generate or refresh lock file from packages installed in
+    virtualenv. Artifacts are downloaded (from wheelhouse if configured)
+    to compute their hashes.
+    """
+    virtualenv_path = path_resolver.resolve_relative(virtualenv['path'])
+    pip_binary = os.path.normpath(os.path.join(virtualenv_path, 'bin', 'pip'))
+    lockfile = lockfile or _lockfile_path(path_resolver, virtualenv)
+    if not lockfile:
+        raise Exception('virtualenv: no lockfile configured for {}'
+                        .format(virtualenv['path']))
+    pkglist_set = _pkglist_set(virtualenv_path, pip_binary,
+                               _installed_distributions(virtualenv_path))
+    requirements = sorted(p for p in pkglist_set if '==' in p)
+    if not requirements:
+        raise Exception('virtualenv: no packages installed in {}'
+                        .format(virtualenv['path']))
+    wheelhouse = _wheelhouse(path_resolver, virtualenv)
+    with tempfile.TemporaryDirectory(prefix='clickable-lock-') as download:
+        download_args = ['download', '--no-deps', '--dest', download]
+        if wheelhouse:
+            download_args.extend(['--find-links', wheelhouse])
+            if _offline(virtualenv):
+                download_args.append('--no-index')
+        download_args.extend(requirements)
+        _pip(pip_binary, download_args)
+        hashes = {}
+        for filename in os.listdir(download):
+            with open(os.path.join(download, filename), 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            hashes.setdefault(_canonical_name(_artifact_name(filename)),
+                              []).append(digest)
+    pins = {}
+    for requirement in requirements:
+        name = _canonical_name(requirement.split('==')[0])
+        if name not in hashes:
+            raise Exception('virtualenv: no artifact downloaded for {}'
+                            .format(requirement))
+        pins[requirement] = sorted(hashes[name])
+    _write_lockfile(lockfile, pins)
+    stdout.info('virtualenv: {} written ({} pins)'
+                .format(lockfile, len(pins)))
+
+
+def _pip_install_wheelhouse(pip_binary, requirements, wheelhouse, offline):
+    """
+    Install requirements from wheelhouse only (no index). If some wheels
+    are missing, they are built in wheelhouse then install is retried,
+    unless ``offline`` is set: install fails without network access.
+    Other install failures are raised as is.
+    """
+    install_args = ['install', '--no-index', '--find-links', wheelhouse]
+    install_args.extend(requirements)
+    try:
+        _pip(pip_binary, install_args)
+        return
+    except PipError as e:
+        if not _missing_distribution(e):
+            raise
+        if offline:
+            raise Exception('virtualenv: offline mode, wheels missing in {} '
+                            'for {}'.format(wheelhouse,
+                                            ' '.join(requirements))) from e
+        logger.debug('virtualenv: wheels missing in wheelhouse, building '
+                     'wheels', exc_info=True)
+    os.makedirs(wheelhouse, exist_ok=True)
+    stdout.info('virtualenv: building wheels in {}'.format(wheelhouse))
+    wheel_args = ['wheel', '--wheel-dir', wheelhouse,
+                  '--find-links', wheelhouse]
+    # install only option
+    wheel_args.extend(r for r in requirements if r != '--force-reinstall')
+    _pip(pip_binary, wheel_args)
+    _pip(pip_binary, install_args)
+
+
+# pip output of an install failing because a distribution is not found
+PIP_MISSING_DISTRIBUTION = [
+    'No matching distribution found for',
+    'Could not find a version that satisfies the requirement',
+]
+
+
+def _missing_distribution(error):
+    """True if pip ``error`` is due to a distribution not found."""
+    return any(marker in line for line in error.output
+               for marker in PIP_MISSING_DISTRIBUTION)
+
+
+# number of pip output lines kept for error reporting
+PIP_OUTPUT_TAIL = 50
+
+# pip output line prefixes marking the start of a phase
+PIP_PHASES = [
+    ('Collecting', 'resolve'),
+    ('Looking in', 'resolve'),
+    ('Requirement already satisfied', 'resolve'),
+    ('Downloading', 'download'),
+    ('Using cached', 'download'),
+    ('Building wheel', 'build'),
+    ('Installing collected packages', 'install'),
+]
+
+
+class PipError(Exception):
+    """pip command failure; ``output`` holds the last lines of pip
+    output."""
+
+    def __init__(self, message, output):
+        super(PipError, self).__init__(message)
+        self.output = output
+
+
+def _pip(pip_binary, args, tail_size=PIP_OUTPUT_TAIL):
+    """
+    Run a pip command, with conda environment handling.
+
+    Output is streamed line by line to stdout logger; only the last
+    ``tail_size`` lines are kept, and attached to the raised
+    :class:`PipError` on failure. Phase timings are reported when
+    phases can be recognized in pip output.
+    """
+    pip_args = [pip_binary]
+    pip_args.extend(args)
+    cmd = " ".join([shlex.quote(i) for i in pip_args])
+    tail = collections.deque(maxlen=tail_size)
+    phases = []
+    start = time.monotonic()
+    try:
+        process = subprocess.Popen(pip_args,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT,
+                                   universal_newlines=True,
+                                   env=_pip_env(os.environ))
+    except Exception as e2:
+        raise Exception("Command {} failed".format(cmd)) from e2
+    with process:
+        for line in process.stdout:
+            line = line.rstrip()
+            tail.append(line)
+            _pip_phase(phases, line, time.monotonic() - start)
+            stdout.info('pip: {}'.format(line))
+        returncode = process.wait()
+    _pip_phases_report(phases, time.monotonic() - start)
+    if returncode != 0:
+        raise PipError("Command {} failed ({}) with output:\n{}"
+                       .format(cmd, returncode, '\n'.join(tail)), list(tail))
+
+
+def _pip_phase(phases, line, elapsed):
+    """Append (phase, start time) to phases if line starts a new
+    phase."""
+    for prefix, phase in PIP_PHASES:
+        if line.lstrip().startswith(prefix):
+            if not phases or phases[-1][0] != phase:
+                phases.append((phase, elapsed))
+            return
+
+
+def _pip_phases_report(phases, elapsed):
+    if not phases:
+        return
+    durations = collections.OrderedDict()
+    for index, (phase, phase_start) in enumerate(phases):
+        phase_end = phases[index + 1][1] if index + 1 < len(phases) \
+            else elapsed
+        durations[phase] = durations.get(phase, 0) + phase_end - phase_start
+    stdout.info('pip: {:.1f}s ({})'.format(
+        elapsed, ', '.join('{} {:.1f}s'.format(phase, duration)
+                           for phase, duration in durations.items())))
+
+
+def _pkglist_set(virtualenv_path, pip_binary, distributions):
+    """name==version set, from metadata if available, else from
+    `pip freeze`."""
+    if distributions is not None:
+        return _freeze_set(distributions)
+    logger.debug('virtualenv: no site-packages in {}, using pip freeze'
+                 .format(virtualenv_path))
+    return _pip_freeze(pip_binary)
+
+
 def _pip_freeze(pip_binary):
     pf_args = []
     pf_args.append(pip_binary)
@@ -209,8 +759,8 @@ def _pip_freeze(pip_binary):
     cmd = " ".join([shlex.quote(i) for i in pf_args])
     try:
         out = subprocess.check_output(pf_args,
-                stderr=subprocess.STDOUT,
-                text=True)
+                                      stderr=subprocess.STDOUT,
+                                      text=True)
     except subprocess.CalledProcessError as e1:
         raise Exception("Command {} failed with output: {}".format(cmd, e1.output)) from e1
     except Exception as e2:
@@ -1,3 +1,15 @@
 # -*- coding: utf-8 -*-
 
 """Unit test package for clickable."""
+
+import os.path
+
+
+class _Resolver:
+    """Path resolver stub for a ``base_path`` folder."""
+
+    def __init__(self, base_path):
+        self.base_path = base_path
+
+    def resolve_relative(self, path):
+        return os.path.normpath(os.path.join(self.base_path, path))
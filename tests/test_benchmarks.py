@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+
+"""Startup and import-time benchmarks for `clickable` commands.
+
+Benchmarks are skipped unless CLICKABLE_BENCHMARK=1 (or `tox -e
+benchmark`). Each measure is checked against a budget in milliseconds,
+overridable with CLICKABLE_BENCHMARK_<NAME>_MS. Fixtures are generated
+locally; no network access is needed.
+
+Measures are printed; use `pytest -s -m benchmark` to display them."""
+
+
+import importlib
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import types
+import unittest.mock
+
+import pytest
+
+import clickable.click
+
+from tests import _Resolver
+
+pytestmark = [
+    pytest.mark.benchmark,
+    pytest.mark.skipif(
+        os.environ.get('CLICKABLE_BENCHMARK', '').lower()
+        not in ('true', '1', 'yes'),
+        reason='benchmarks are enabled with CLICKABLE_BENCHMARK=1')
+]
+
+REPEAT = 5
+# number of entries of generated mapping and configuration
+LARGE = 10000
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CLICKABLES = """
+import click
+
+import clickable.coloredlogs
+import clickable.sphinx
+import clickable.utils
+
+@click.group()
+def main():
+    pass
+
+clickable.sphinx.sphinx_click_group(main, lambda ctx: ctx.obj['sphinx'])
+"""
+
+_RUN = """
+import sys
+sys.argv = ['main', '--help']
+import clickable.click
+clickable.click.main()
+"""
+
+
+def _budget(name, default):
+    """Budget in seconds for measure `name`."""
+    value = os.environ.get('CLICKABLE_BENCHMARK_{}_MS'.format(name.upper()),
+                           None)
+    return (float(value) if value else default) / 1000
+
+
+def _check(name, duration, default):
+    budget = _budget(name, default)
+    print('benchmark {}: {:.1f} ms (budget {:.0f} ms)'
+          .format(name, duration * 1000, budget * 1000))
+    assert duration <= budget, \
+        '{} took {:.1f} ms, budget is {:.0f} ms'.format(
+            name, duration * 1000, budget * 1000)
+
+
+def _measure(func, repeat=REPEAT):
+    """Median duration of `func` calls, in seconds."""
+    durations = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def _env(tmp_path, **extra):
+    env = dict(os.environ, PYTHONPATH=_ROOT,
+               PYTHONPYCACHEPREFIX=str(tmp_path / 'pycache'),
+               CLICKABLE_CACHE_DIR=str(tmp_path / 'cache'))
+    env.pop('CLICKABLE_DAEMON', None)
+    env.update(extra)
+    return env
+
+
+def _project(tmp_path, source=_CLICKABLES):
+    project = tmp_path / 'project'
+    project.mkdir()
+    (project / '.git').mkdir()
+    (project / 'clickables.py').write_text(source)
+    return project
+
+
+def _importtime(stderr):
+    """Parse `-X importtime` output as (cumulative us, module) list,
+    sorted by descending duration."""
+    result = []
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+\s+\|\s+(\d+)\s+\|(\s*)(\S+)',
+                         line)
+        if match:
+            result.append((int(match.group(1)), match.group(3)))
+    return sorted(result, reverse=True)
+
+
+class TestStartup:
+    """Startup time of the `clickable` entry point."""
+
+    def test_startup(self, tmp_path):
+        """Cold (no bytecode) and warm startup of a minimal command."""
+        project = _project(tmp_path)
+        env = _env(tmp_path)
+
+        def run():
+            subprocess.run([sys.executable, '-c', _RUN], cwd=str(project),
+                           env=env, check=True)
+        cold = _measure(run, repeat=1)
+        warm = _measure(run)
+        _check('startup_cold', cold, 3000)
+        _check('startup_warm', warm, 1500)
+
+    def test_importtime(self, tmp_path):
+        """Import time breakdown of `clickable.click` and a typical
+        `clickables.py`."""
+        project = _project(tmp_path)
+        env = _env(tmp_path)
+        # warm bytecode cache
+        subprocess.run([sys.executable, '-c', _RUN], cwd=str(project),
+                       env=env, check=True)
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', _RUN],
+            cwd=str(project), env=env, check=True, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        imports = _importtime(result.stderr)
+        for duration, module in imports[0:15]:
+            print('importtime {:>8} us {}'.format(duration, module))
+        total = sum(duration for duration, module in imports
+                    if module in ('clickable.click', 'clickables'))
+        _check('importtime', total / 1000000, 1000)
+
+
+class TestDispatch:
+    """`_import` + callable lookup."""
+
+    def _dispatch(self, project, argv0):
+        def dispatch():
+            sys.modules.pop('clickables', None)
+            with unittest.mock.patch.object(sys, 'argv', [argv0]):
+                name = clickable.click._static_callable_name(
+                    str(project / 'clickables.py'))
+                module = clickable.click._import(
+                    str(project / 'clickables.py'))
+                if name is None:
+                    assert clickable.click._find_callable(module)
+        try:
+            return _measure(dispatch)
+        finally:
+            sys.modules.pop('clickables', None)
+            sys.path.remove(str(project))
+
+    def test_small_mapping(self, tmp_path):
+        project = _project(tmp_path, 'CLICKABLE_MAPPING = {"a": "main"}\n'
+                           'def main():\n    pass\n')
+        _check('dispatch_small', self._dispatch(project, 'a'), 50)
+
+    def test_large_mapping(self, tmp_path):
+        source = ['CLICKABLE_MAPPING = {']
+        source.extend('    "command_{0}": "function_{0}",'.format(i)
+                      for i in range(LARGE))
+        source.append('}')
+        source.extend('def function_{}():\n    pass'.format(i)
+                      for i in range(LARGE))
+        project = _project(tmp_path, '\n'.join(source) + '\n')
+        _check('dispatch_large',
+               self._dispatch(project, 'command_{}'.format(LARGE - 1)), 2000)
+
+
+class TestLoadConfig:
+    """`load_config` with a large configuration file."""
+
+    def test_load_config(self, tmp_path):
+        yaml = pytest.importorskip('yaml')
+        import clickable.utils
+        project = _project(tmp_path)
+        configuration = {
+            'ansible': {'virtualenv': {'path': '.venv'}},
+            'items': [{'name': 'item_{}'.format(i), 'value': i,
+                       'tags': ['a', 'b']} for i in range(LARGE)]
+        }
+        (project / 'clickables.yml').write_text(yaml.safe_dump(configuration))
+        module = types.ModuleType('clickables_benchmark')
+        module.__file__ = str(project / 'clickables.py')
+
+        def load():
+            ctx = types.SimpleNamespace(obj=None)
+            clickable.utils.load_config(ctx, 'clickables_benchmark',
+                                        module.__file__)
+            assert len(ctx.obj['items']) == LARGE
+        with unittest.mock.patch.dict(sys.modules,
+                                      {'clickables_benchmark': module}):
+            _check('load_config', _measure(load), 1000)
+
+
+class TestVirtualenv:
+    """No-op `virtualenv()` call (virtualenv up to date)."""
+
+    def test_virtualenv_noop(self, tmp_path):
+        import clickable.virtualenv
+        fingerprint = importlib.import_module(
+            'clickable.virtualenv.fingerprint')
+        venv = tmp_path / 'venv'
+        subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip',
+                               str(venv)])
+        config = {'path': 'venv', 'requirements': ['a==1']}
+        resolver = _Resolver(str(tmp_path))
+        fingerprint._write_fingerprint(
+            str(venv), fingerprint._fingerprint(str(venv), config))
+
+        def noop():
+            with unittest.mock.patch(
+                    'clickable.virtualenv._pip_packages') as pip:
+                clickable.virtualenv.virtualenv(resolver, config)
+                assert not pip.called
+        _check('virtualenv_noop', _measure(noop), 100)
@@ -3,14 +3,22 @@
 """Tests for `clickable.click` package."""
 
 
+import ast
 import os
+import socket
+import subprocess
 import sys
+import time
 import unittest
 import unittest.mock
 
 import pytest
 
 import clickable.click
+import clickable.click.daemon
+import clickable.click.discovery
+import clickable.click.dispatch
+import clickable.click.static
 
 
 class TestClickableClick:
@@ -159,6 +167,554 @@ class TestClickableClick:
             assert "clickables.py" in captured.err
 
 
+def _static(source):
+    return clickable.click.static._analyze(ast.parse(source))
+
+
+class TestClickableStatic:
+    """Tests for `clickable.click.static` module."""
+
+    def test_resolve_function(self):
+        module = _static("import click\ndef build():\n    pass\n")
+        resolution = clickable.click.static._static_resolve(module, "build")
+        assert resolution.status == clickable.click.static.OK
+        assert resolution.callable_name == "build"
+
+    def test_resolve_main_fallback(self):
+        module = _static("def main():\n    pass\n")
+        resolution = clickable.click.static._static_resolve(module, "other")
+        assert resolution.status == clickable.click.static.OK
+        assert resolution.callable_name == "main"
+
+    def test_resolve_mapping_missing_key(self):
+        module = _static("CLICKABLE_MAPPING = {'a': 'b'}\n"
+                         "def b():\n    pass\n")
+        resolution = clickable.click.static._static_resolve(module, "other")
+        assert resolution.status == clickable.click.static.ERROR
+        assert "invalid for other" in resolution.message
+        resolution = clickable.click.static._static_resolve(module, "a")
+        assert resolution.status == clickable.click.static.OK
+        assert resolution.callable_name == "b"
+
+    def test_resolve_not_callable(self):
+        module = _static("CLICK_MAPPING = 'value'\nvalue = 'string'\n")
+        resolution = clickable.click.static._static_resolve(module, "any")
+        assert resolution.status == clickable.click.static.ERROR
+        assert "is not a callable: string" in resolution.message
+
+    def test_resolve_unknown(self):
+        """Conditional bindings, modified mappings and star-imports are
+        resolved dynamically."""
+        for source in [
+                "import os\nif os.name:\n    def main():\n        pass\n",
+                "CLICKABLE_MAPPING = {}\nCLICKABLE_MAPPING['a'] = 'main'\n",
+                "from os.path import *\n",
+                "globals()['main'] = print\n"]:
+            resolution = clickable.click.static._static_resolve(
+                _static(source), "a")
+            assert resolution.status == clickable.click.static.UNKNOWN, \
+                source
+
+    def test_entry_points(self):
+        module = _static("def main():\n    pass\n"
+                         "def _private():\n    pass\n")
+        assert clickable.click.static._entry_points(module) \
+            == [("main", "main")]
+        module = _static("CLICKABLE_MAPPING = {'b': 'x', 'a': 'y'}\n")
+        assert clickable.click.static._entry_points(module) \
+            == [("a", "y"), ("b", "x")]
+
+    def test_main_static_error(self, tmp_path, capsys):
+        """Static errors abort before clickables.py is executed."""
+        (tmp_path / "clickables.py").write_text(
+            "CLICKABLE_MAPPING = {'a': 'main'}\n"
+            "print('executed')\n"
+            "def main():\n    pass\n")
+        previous = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            with unittest.mock.patch.object(sys, "argv", ["other"]):
+                with pytest.raises(SystemExit) as e:
+                    clickable.click.main()
+        finally:
+            os.chdir(previous)
+        assert e.value.code == 2
+        captured = capsys.readouterr()
+        assert "executed" not in captured.out
+        assert "invalid for other" in captured.err
+
+    def test_list(self, tmp_path, capsys):
+        (tmp_path / "clickables.py").write_text(
+            "CLICKABLE_MAPPING = {'a': 'b'}\nprint('executed')\n")
+        previous = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            with unittest.mock.patch.object(sys, "argv",
+                                            ["/usr/bin/clickable", "--list"]):
+                with pytest.raises(SystemExit) as e:
+                    clickable.click.main()
+        finally:
+            os.chdir(previous)
+        assert e.value.code == 0
+        assert capsys.readouterr().out == "a: b\n"
+
+    @unittest.mock.patch("clickable.click.daemon._daemon_client")
+    def test_list_daemon(self, c_client, tmp_path, capsys):
+        """--list and completion are not delegated to daemon."""
+        (tmp_path / "clickables.py").write_text(
+            "CLICKABLE_MAPPING = {'a': 'b'}\n")
+        previous = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            with unittest.mock.patch.object(sys, "argv",
+                                            ["/usr/bin/clickable", "--list"]), \
+                    unittest.mock.patch.dict(os.environ,
+                                             {"CLICKABLE_DAEMON": "1"}):
+                with pytest.raises(SystemExit) as e:
+                    clickable.click.main()
+                assert e.value.code == 0
+                sys.argv = ["/usr/bin/clickable"]
+                with unittest.mock.patch(
+                        "clickable.click.completion._completion_instruction",
+                        return_value=("bash", "complete")), \
+                        unittest.mock.patch(
+                            "clickable.click.completion._complete_from_cache",
+                            return_value=0):
+                    with pytest.raises(SystemExit) as e:
+                        clickable.click.main()
+                    assert e.value.code == 0
+        finally:
+            os.chdir(previous)
+        c_client.assert_not_called()
+        assert capsys.readouterr().out == "a: b\n"
+
+
+class TestClickableDispatchCache:
+    """Tests for `clickable.click.dispatch` module."""
+
+    def _main(self, tmp_path, argv):
+        previous = os.getcwd()
+        os.chdir(str(tmp_path))
+        try:
+            with unittest.mock.patch.object(sys, "argv", argv), \
+                    unittest.mock.patch.dict(os.environ,
+                                             {"CLICKABLE_DEBUG": "1"}):
+                clickable.click.main()
+        finally:
+            os.chdir(previous)
+            sys.path.remove(str(tmp_path))
+            sys.modules.pop("clickables", None)
+
+    def _write(self, tmp_path, source):
+        path = tmp_path / "clickables.py"
+        path.write_text(source)
+        # not racy
+        os.utime(str(path), (time.time() - 10, time.time() - 10))
+
+    def test_hit_and_miss(self, tmp_path, capsys):
+        self._write(tmp_path,
+                    "CLICKABLE_MAPPING = {'a': 'b'}\n"
+                    "def b():\n    print('b')\n")
+        self._main(tmp_path, ["a"])
+        captured = capsys.readouterr()
+        assert "Dispatch cache miss for a" in captured.err
+        assert captured.out == "b\n"
+        assert (tmp_path / "__pycache__"
+                / "clickables.clickable-dispatch.json").is_file()
+
+        with unittest.mock.patch.object(clickable.click.static, "_parse") \
+                as parse:
+            self._main(tmp_path, ["a"])
+            assert not parse.called
+        captured = capsys.readouterr()
+        assert "Dispatch cache hit for a: b" in captured.err
+        assert captured.out == "b\n"
+
+        # modification invalidates cache
+        self._write(tmp_path,
+                    "CLICKABLE_MAPPING = {'a': 'c'}\n"
+                    "def c():\n    print('c')\n")
+        self._main(tmp_path, ["a"])
+        captured = capsys.readouterr()
+        assert "Dispatch cache miss for a" in captured.err
+        assert captured.out == "c\n"
+
+    def test_racy(self, tmp_path):
+        """Recently modified file is not cached."""
+        path = tmp_path / "clickables.py"
+        path.write_text("def main():\n    pass\n")
+        stat = os.stat(str(path))
+        clickable.click.dispatch._write_dispatch(
+            str(path), stat, "a", "main", None)
+        assert not (tmp_path / "__pycache__").exists()
+        assert clickable.click.dispatch._read_dispatch(
+            str(path), stat, "a") is None
+
+
+class TestClickableDiscovery:
+    """Tests for `clickable.click.discovery` module."""
+
+    @pytest.fixture(autouse=True)
+    def _cache(self, tmp_path):
+        with unittest.mock.patch.dict(
+                os.environ,
+                {"CLICKABLE_CACHE_DIR": str(tmp_path / "cache")}), \
+                unittest.mock.patch.dict(clickable.click.discovery._memo,
+                                         clear=True):
+            yield
+
+    def test_parent(self, tmp_path):
+        (tmp_path / "project" / ".git").mkdir(parents=True)
+        (tmp_path / "project" / "clickables.py").write_text("")
+        (tmp_path / "project" / "a" / "b").mkdir(parents=True)
+        project = str(tmp_path / "project")
+        assert clickable.click.discovery._project_root(project) == project
+        assert clickable.click.discovery._project_root(
+            str(tmp_path / "project" / "a" / "b")) == project
+
+    def test_vcs_root(self, tmp_path):
+        """Search stops at VCS root."""
+        (tmp_path / "clickables.py").write_text("")
+        (tmp_path / "repository" / ".hg").mkdir(parents=True)
+        (tmp_path / "repository" / "a").mkdir()
+        assert clickable.click.discovery._project_root(
+            str(tmp_path / "repository" / "a")) is None
+
+    def test_cache(self, tmp_path):
+        (tmp_path / "project" / ".git").mkdir(parents=True)
+        (tmp_path / "project" / "clickables.py").write_text("")
+        (tmp_path / "project" / "a" / "b").mkdir(parents=True)
+        start = str(tmp_path / "project" / "a" / "b")
+        project = str(tmp_path / "project")
+        assert clickable.click.discovery._project_root(start) == project
+        assert (tmp_path / "cache" / "discovery.json").is_file()
+        clickable.click.discovery._memo.clear()
+        with unittest.mock.patch.object(clickable.click.discovery, "_walk") \
+                as walk:
+            assert clickable.click.discovery._project_root(start) == project
+            assert not walk.called
+        # cached root is checked
+        clickable.click.discovery._memo.clear()
+        (tmp_path / "project" / "clickables.py").unlink()
+        assert clickable.click.discovery._project_root(start) is None
+
+    def test_main_from_subfolder(self, tmp_path, capsys):
+        (tmp_path / ".git").mkdir()
+        (tmp_path / "clickables.py").write_text(
+            "def main():\n    print('main')\n")
+        (tmp_path / "sub").mkdir()
+        previous = os.getcwd()
+        os.chdir(str(tmp_path / "sub"))
+        try:
+            with unittest.mock.patch.object(sys, "argv", ["cmd"]):
+                clickable.click.main()
+        finally:
+            os.chdir(previous)
+            sys.path.remove(str(tmp_path))
+            sys.modules.pop("clickables", None)
+        assert capsys.readouterr().out == "main\n"
+
+
+class TestLazyImports:
+    """Heavy dependencies are imported only by code paths using them."""
+
+    def test_lazy_imports(self):
+        script = ("import sys\n"
+                  "import clickable.click, clickable.coloredlogs, "
+                  "clickable.sphinx, clickable.utils\n"
+                  "print(' '.join(sorted(sys.modules)))\n")
+        env = dict(os.environ,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+        modules = subprocess.check_output(
+            [sys.executable, "-c", script], env=env,
+            universal_newlines=True).split()
+        for module in ["blessings", "coloredlogs", "yaml", "pprint",
+                       "clickable.virtualenv", "concurrent.futures",
+                       "packaging", "email.parser"]:
+            assert module not in modules, module
+
+    def test_import_time(self):
+        """Generous bound on `clickable.click` cumulative import time
+        (about 10 ms measured), catching eager heavy imports."""
+        env = dict(os.environ,
+                   PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+        # warm bytecode cache
+        subprocess.check_call([sys.executable, "-c", "import clickable.click"],
+                              env=env)
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import clickable.click"],
+            env=env, check=True, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        cumulative = [int(line.split("|")[1])
+                      for line in result.stderr.splitlines()
+                      if line.split("|")[-1].strip() == "clickable.click"]
+        assert cumulative[0] < 500000, cumulative[0]
+
+
+class TestLazyGroup:
+    """Tests for `clickable.click.lazy` module."""
+
+    def _group(self, loads):
+        import click
+        import clickable.click.lazy
+
+        @click.group(cls=clickable.click.lazy.LazyGroup)
+        def main():
+            pass
+
+        def commands(group, prefix):
+            loads.append(prefix)
+            for name in ["a", "b"]:
+                @group.command(name="{}{}".format(prefix, name))
+                def command(name=name):
+                    click.echo("{}{}".format(prefix, name))
+        main.add_lazy_commands(["xa", "xb"], commands, "x")
+        main.add_lazy_commands(["ya", "yb"], commands, "y")
+        main.add_lazy_command("z", click.Command, "z",
+                              callback=lambda: click.echo("z"))
+        return main
+
+    def test_invoke(self):
+        import click.testing
+        loads = []
+        main = self._group(loads)
+        runner = click.testing.CliRunner()
+        result = runner.invoke(main, ["xb"])
+        assert result.exit_code == 0
+        assert result.output == "xb\n"
+        assert loads == ["x"]
+        result = runner.invoke(main, ["xa"])
+        assert result.output == "xa\n"
+        assert loads == ["x"]
+        assert runner.invoke(main, ["z"]).output == "z\n"
+        assert runner.invoke(main, ["unknown"]).exit_code == 2
+        assert loads == ["x"]
+
+    def test_list_help(self):
+        import click.testing
+        loads = []
+        main = self._group(loads)
+        assert main.list_commands(None) == ["xa", "xb", "ya", "yb", "z"]
+        assert loads == []
+        result = click.testing.CliRunner().invoke(main, ["--help"])
+        assert result.exit_code == 0
+        assert "ya" in result.output
+        assert sorted(loads) == ["x", "y"]
+
+    def test_sphinx(self):
+        import click
+        import clickable.click.lazy
+        import clickable.sphinx
+
+        @click.group(cls=clickable.click.lazy.LazyGroup)
+        def main():
+            pass
+        clickable.sphinx.sphinx_lazy_click_group(main, lambda ctx: {})
+        assert main.commands == {}
+        assert main.get_command(None, "build") is not None
+        assert sorted(main.commands) == sorted(clickable.sphinx.SPHINX_COMMANDS)
+
+
+_COMPLETION_CLICKABLES = """
+import sys
+import click
+
+print("loaded", file=sys.stderr)
+
+@click.group()
+@click.option("--verbose/--quiet", help="verbosity")
+def main(verbose):
+    pass
+
+@main.command(help="Build documentation")
+@click.argument("target", type=click.Choice(["html", "epub", "latex"]))
+@click.option("--output", type=click.Path(file_okay=False))
+def build(target, output):
+    pass
+
+@main.command(help="Clean")
+def clean():
+    pass
+"""
+
+_COMPLETION_CLIENT = """
+import sys
+sys.argv = ['main']
+import clickable.click
+clickable.click.main()
+"""
+
+
+class TestCompletion:
+    """Tests for `clickable.click.completion` module."""
+
+    def _complete(self, project, instruction, words, cword):
+        env = dict(os.environ, _MAIN_COMPLETE=instruction,
+                   COMP_WORDS=words, COMP_CWORD=str(cword),
+                   PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+        env.pop("CLICKABLE_DAEMON", None)
+        result = subprocess.run(
+            [sys.executable, "-c", _COMPLETION_CLIENT],
+            cwd=str(project), env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        assert result.returncode == 0, result.stderr
+        return result.stdout, "loaded" in result.stderr
+
+    def test_completion(self, tmp_path):
+        (tmp_path / ".git").mkdir()
+        (tmp_path / "clickables.py").write_text(_COMPLETION_CLICKABLES)
+        os.utime(str(tmp_path / "clickables.py"),
+                 (time.time() - 10, time.time() - 10))
+        requests = [
+            ("bash_complete", "main ", 1),
+            ("bash_complete", "main build ", 2),
+            ("bash_complete", "main build e", 2),
+            ("bash_complete", "main build html --output ", 4),
+            ("zsh_complete", "main --", 1),
+            ("fish_complete", "main c", "c"),
+        ]
+        cache = tmp_path / "__pycache__" / "clickables.clickable-completion.json"
+        expected = []
+        for instruction, words, cword in requests:
+            if cache.exists():
+                cache.unlink()
+            output, loaded = self._complete(tmp_path, instruction, words,
+                                            cword)
+            assert loaded
+            assert cache.is_file()
+            cached, loaded = self._complete(tmp_path, instruction, words,
+                                            cword)
+            assert not loaded
+            assert cached == output
+            expected.append(output)
+        assert expected[0] == "plain,build\nplain,clean\n"
+        assert expected[1] == "plain,html\nplain,epub\nplain,latex\n"
+        assert expected[3] == "dir,\n"
+        assert "--verbose\nverbosity" in expected[4]
+        assert expected[5] == "plain,clean\tClean\n"
+
+        # modification invalidates cache
+        (tmp_path / "clickables.py").write_text(
+            _COMPLETION_CLICKABLES.replace("clean", "purge"))
+        os.utime(str(tmp_path / "clickables.py"),
+                 (time.time() - 5, time.time() - 5))
+        output, loaded = self._complete(tmp_path, "bash_complete", "main ", 1)
+        assert loaded
+        assert output == "plain,build\nplain,purge\n"
+
+    def test_dynamic(self, tmp_path):
+        """Custom completion callbacks are not cached."""
+        import click
+        import clickable.click.completion
+        (tmp_path / "clickables.py").write_text("")
+        os.utime(str(tmp_path / "clickables.py"),
+                 (time.time() - 10, time.time() - 10))
+        command = click.Command(
+            "main", params=[click.Argument(
+                ["name"], shell_complete=lambda ctx, param, incomplete: [])])
+        clickable.click.completion._cache_completion(
+            str(tmp_path / "clickables.py"), command, "main")
+        assert not (tmp_path / "__pycache__").exists()
+
+
+_DAEMON_CLICKABLES = """
+import os, sys
+def main():
+    print(os.getppid(), ' '.join(sys.argv[1:]))
+    sys.exit(int(sys.argv[1]))
+"""
+
+_DAEMON_CLIENT = """
+import sys
+sys.argv = ['clickable'] + sys.argv[1:]
+import clickable.click
+clickable.click.main()
+"""
+
+
+class TestClickableDaemon:
+    """Tests for `clickable.click.daemon` module."""
+
+    def test_daemon(self, tmp_path):
+        """Command is run by a daemon worker; exit code is forwarded;
+        daemon is invalidated by clickables.py modification."""
+        (tmp_path / "clickables.py").write_text(_DAEMON_CLICKABLES)
+        env = dict(os.environ, XDG_RUNTIME_DIR=str(tmp_path),
+                   CLICKABLE_DAEMON="1", CLICKABLE_DAEMON_IDLE="10",
+                   PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+        daemon = subprocess.Popen(
+            [sys.executable, "-m", "clickable.click.daemon", str(tmp_path)],
+            cwd=str(tmp_path), env=env)
+        try:
+            with unittest.mock.patch.dict(os.environ,
+                                          {"XDG_RUNTIME_DIR": str(tmp_path)}):
+                socket_path = clickable.click.daemon._socket_path(
+                    str(tmp_path))
+            for i in range(100):
+                if os.path.exists(socket_path):
+                    break
+                time.sleep(0.05)
+            assert os.path.exists(socket_path)
+            result = subprocess.run(
+                [sys.executable, "-c", _DAEMON_CLIENT, "3", "arg"],
+                cwd=str(tmp_path), env=env, stdout=subprocess.PIPE,
+                universal_newlines=True)
+            assert result.returncode == 3
+            assert result.stdout == "{} 3 arg\n".format(daemon.pid)
+
+            os.utime(str(tmp_path / "clickables.py"),
+                     ns=(0, time.time_ns() + 10 ** 9))
+            result = subprocess.run(
+                [sys.executable, "-c", _DAEMON_CLIENT, "4"],
+                cwd=str(tmp_path), env=env, stdout=subprocess.PIPE,
+                universal_newlines=True)
+            assert result.returncode == 4
+            assert not result.stdout.startswith(str(daemon.pid))
+            daemon.wait(timeout=5)
+        finally:
+            daemon.kill()
+            daemon.wait()
+            # daemon respawned by stale call
+            subprocess.run(["pkill", "-f", str(tmp_path)])
+
+    def test_runtime_dir(self, tmp_path):
+        """Sockets are created in a private folder, with 0600 mode."""
+        with unittest.mock.patch.dict(os.environ,
+                                      {"XDG_RUNTIME_DIR": str(tmp_path)}):
+            path = clickable.click.daemon._socket_path(str(tmp_path))
+            runtime_dir = os.path.dirname(path)
+            assert os.stat(runtime_dir).st_mode & 0o777 == 0o700
+            listener = clickable.click.daemon._bind(path)
+            listener.close()
+            assert os.stat(path).st_mode & 0o777 == 0o600
+            os.chmod(runtime_dir, 0o755)
+            with pytest.raises(Exception, match="unsafe runtime folder"):
+                clickable.click.daemon._socket_path(str(tmp_path))
+            assert clickable.click.daemon._daemon_client(
+                str(tmp_path)) is None
+
+    def test_peer_check(self, tmp_path):
+        """Peers of another user are rejected."""
+        left, right = socket.socketpair()
+        with left, right:
+            assert clickable.click.daemon._trusted(left)
+            with unittest.mock.patch.object(
+                    clickable.click.daemon, "_peer_uid",
+                    return_value=os.getuid() + 1):
+                assert not clickable.click.daemon._trusted(left)
+        path = str(tmp_path / "test.sock")
+        listener = clickable.click.daemon._bind(path)
+        with listener, unittest.mock.patch.object(
+                clickable.click.daemon, "_peer_uid",
+                return_value=os.getuid() + 1), \
+                unittest.mock.patch.object(
+                    clickable.click.daemon, "_send_fds") as c_send:
+            assert clickable.click.daemon._call(path, {}) \
+                == (clickable.click.daemon.UNAVAILABLE, None)
+            c_send.assert_not_called()
+
+
 def _write_messages(stream):
     # concat written messages from a stream mock
     return " ".join([_call_args_args(m)[0] for m in stream.write.call_args_list])
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `clickable.sphinx` package."""
+
+
+import logging
+import os
+import subprocess
+import sys
+import time
+import unittest.mock
+
+import pytest
+
+import clickable.sphinx
+
+from tests import _Resolver
+
+
+def _documentation(tmp_path):
+    source = tmp_path / 'docs' / 'source'
+    source.mkdir(parents=True)
+    (source / 'conf.py').write_text('project = "test"\n')
+    (source / 'index.rst').write_text('Title\n=====\n')
+    (tmp_path / 'docs' / 'build').mkdir()
+    return _Resolver(str(tmp_path)), {'documentation_path': 'docs'}, \
+        {'path': 'venv'}
+
+
+class TestBuild:
+    """Tests for `sphinx_build`."""
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_args(self, c_script, tmp_path):
+        """Output and doctrees folders are per-target and shared."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        clickable.sphinx.sphinx_build(resolver, sphinx_config, venv_config,
+                                      'epub')
+        args = c_script.call_args[0][3]
+        assert args[-1] == str(tmp_path / 'docs' / 'build' / 'epub')
+        assert args[args.index('-d') + 1] \
+            == str(tmp_path / 'docs' / 'build' / 'doctrees')
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_always(self, c_script, tmp_path):
+        """sphinx is run each time unless skip_unchanged is set."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        for i in range(2):
+            clickable.sphinx.sphinx_build(resolver, sphinx_config,
+                                          venv_config, 'html')
+        assert c_script.call_count == 2
+        assert not (tmp_path / 'docs' / 'build' / 'html'
+                    / '.clickable-manifest.json').exists()
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_skipped(self, c_script, tmp_path):
+        """sphinx is skipped while sources are unchanged."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        sphinx_config['skip_unchanged'] = True
+        build = lambda **kwargs: clickable.sphinx.sphinx_build(
+            resolver, sphinx_config, venv_config, 'html', **kwargs)
+        build()
+        build()
+        assert c_script.call_count == 1
+        # touch only: content hash is unchanged
+        os.utime(str(tmp_path / 'docs' / 'source' / 'index.rst'))
+        build()
+        assert c_script.call_count == 1
+        (tmp_path / 'docs' / 'source' / 'index.rst').write_text('Other\n')
+        build()
+        assert c_script.call_count == 2
+        (tmp_path / 'docs' / 'source' / '.index.rst.swp').write_text('')
+        build()
+        assert c_script.call_count == 2
+        build(force=True)
+        assert c_script.call_count == 3
+        # other target is built independently
+        clickable.sphinx.sphinx_build(resolver, sphinx_config, venv_config,
+                                      'latex')
+        assert c_script.call_count == 4
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_dependencies(self, c_script, tmp_path):
+        """Declared dependencies outside sources are tracked."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        (tmp_path / 'package').mkdir()
+        (tmp_path / 'package' / 'module.py').write_text('a = 1\n')
+        (tmp_path / 'layout.html').write_text('')
+        sphinx_config['dependencies'] = ['package', 'layout.html']
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_SPHINX_SKIP_UNCHANGED': '1'}):
+            build = lambda: clickable.sphinx.sphinx_build(
+                resolver, sphinx_config, venv_config, 'html')
+            build()
+            build()
+            assert c_script.call_count == 1
+            (tmp_path / 'package' / 'module.py').write_text('a = 2\n')
+            build()
+            assert c_script.call_count == 2
+            (tmp_path / 'layout.html').write_text('<html/>')
+            build()
+            assert c_script.call_count == 3
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_failed(self, c_script, tmp_path):
+        """A failed build is retried."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        c_script.side_effect = Exception('failed')
+        with pytest.raises(Exception):
+            clickable.sphinx.sphinx_build(resolver, sphinx_config,
+                                          venv_config, 'html')
+        c_script.side_effect = None
+        clickable.sphinx.sphinx_build(resolver, sphinx_config, venv_config,
+                                      'html')
+        assert c_script.call_count == 2
+
+    def test_settings_override_env(self):
+        """Explicit settings override environment."""
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_SPHINX_WORKER': '1',
+                             'CLICKABLE_SPHINX_SKIP_UNCHANGED': '1'}):
+            assert clickable.sphinx._worker_enabled({})
+            assert not clickable.sphinx._worker_enabled({'worker': False})
+            assert clickable.sphinx._skip_enabled({})
+            assert not clickable.sphinx._skip_enabled(
+                {'skip_unchanged': False})
+
+
+class TestBuildTargets:
+    """Tests for `sphinx_build_targets`."""
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_targets(self, c_script, tmp_path, caplog):
+        """First target primes doctrees with whole budget; others share
+        it."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        sphinx_config['skip_unchanged'] = True
+        caplog.set_level(logging.INFO)
+        clickable.sphinx.sphinx_build_targets(
+            resolver, sphinx_config, venv_config,
+            ['html', 'epub', 'latex', 'html'], jobs=4)
+        calls = [c[0][3] for c in c_script.call_args_list]
+        assert len(calls) == 3
+        assert calls[0][0:2] == ['-j', '4']
+        assert calls[0][calls[0].index('-b') + 1] == 'html'
+        for args in calls[1:]:
+            assert args[0:3] == ['-j', '2', '-q']
+        assert sorted(args[args.index('-b') + 1] for args in calls[1:]) \
+            == ['epub', 'latex']
+        assert 'sphinx.build: latex' in caplog.text
+
+        c_script.reset_mock()
+        clickable.sphinx.sphinx_build_targets(
+            resolver, sphinx_config, venv_config, ['html', 'epub'], jobs=4)
+        assert not c_script.called
+        assert 'epub up to date, skipped' in caplog.text
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_targets_doctrees(self, c_script, tmp_path):
+        """Concurrent builders work on private doctrees copies."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        doctrees = tmp_path / 'docs' / 'build' / 'doctrees'
+        seen = {}
+
+        def script(path_resolver, virtualenv_config, script, args):
+            target = args[args.index('-b') + 1]
+            path = args[args.index('-d') + 1]
+            if target == 'html':
+                os.makedirs(path)
+                with open(os.path.join(path, 'environment.pickle'),
+                          'w') as f:
+                    f.write('html')
+                return
+            with open(os.path.join(path, 'environment.pickle')) as f:
+                seen[target] = (path, f.read())
+            # builder rewrites its environment
+            with open(os.path.join(path, 'environment.pickle'), 'w') as f:
+                f.write(target)
+        c_script.side_effect = script
+        clickable.sphinx.sphinx_build_targets(
+            resolver, sphinx_config, venv_config,
+            ['html', 'epub', 'latex'], jobs=2)
+        assert seen == {
+            'epub': (str(doctrees) + '.epub', 'html'),
+            'latex': (str(doctrees) + '.latex', 'html')}
+        assert (doctrees / 'environment.pickle').read_text() == 'html'
+        assert os.listdir(str(tmp_path / 'docs' / 'build')) == ['doctrees']
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_build_targets_failure(self, c_script, tmp_path):
+        """Failures are reported once all targets are processed."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+
+        def script(path_resolver, virtualenv_config, script, args):
+            if 'epub' in args:
+                raise Exception('failed')
+        c_script.side_effect = script
+        with pytest.raises(Exception, match='epub failed'):
+            clickable.sphinx.sphinx_build_targets(
+                resolver, sphinx_config, venv_config,
+                ['html', 'epub', 'latex'], jobs=2)
+        assert c_script.call_count == 3
+
+    def test_jobs_option(self):
+        """``--jobs`` must be a positive integer."""
+        import click
+        import click.testing
+
+        @click.group()
+        def main():
+            pass
+        clickable.sphinx.sphinx_click_group(main, lambda ctx: {})
+        result = click.testing.CliRunner().invoke(
+            main, ['build', '-j', '0', 'html'])
+        assert result.exit_code == 2
+        assert '--jobs' in result.output
+
+
+_FAKE_SPHINX_BUILD = """
+import os
+import subprocess
+import sys
+import time
+
+
+def build_main(argv):
+    # worker must not expose clickable environment to sphinx
+    import importlib.util
+    assert importlib.util.find_spec('clickable') is None
+    print('built', os.getppid(), ' '.join(argv), flush=True)
+    return int(argv[0])
+"""
+
+
+class TestWorker:
+    """Tests for `clickable.sphinx.worker`."""
+
+    def test_preload(self, tmp_path):
+        """conf.py is not executed; only installed extensions are
+        imported."""
+        import types
+        import clickable.sphinx.worker
+        (tmp_path / 'mypkg.py').write_text('')
+        (tmp_path / 'conf.py').write_text(
+            'import sys\n'
+            'sys.path.insert(0, {!r})\n'
+            'import mypkg\n'
+            'raise Exception("executed")\n'
+            'extensions = ["mypkg", "colorsys", "missing.ext"]\n'
+            .format(str(tmp_path)))
+        assert clickable.sphinx.worker._extensions(
+            str(tmp_path / 'conf.py')) == ['mypkg', 'colorsys', 'missing.ext']
+        fake = dict((name, types.ModuleType(name))
+                    for name in ['sphinx', 'sphinx.cmd', 'sphinx.cmd.build'])
+        with unittest.mock.patch.dict(sys.modules, fake), \
+                unittest.mock.patch.object(sys, 'path',
+                                           [str(tmp_path)] + sys.path):
+            sys.modules.pop('colorsys', None)
+            clickable.sphinx.worker._preload(str(tmp_path))
+            assert 'colorsys' in sys.modules
+            assert 'mypkg' not in sys.modules
+
+    def test_worker(self, tmp_path, capfd):
+        """Builds are run by worker; modified conf.py falls back to
+        subprocess."""
+        import clickable.sphinx.worker
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        fake = tmp_path / 'fake' / 'sphinx' / 'cmd'
+        fake.mkdir(parents=True)
+        (fake.parent / '__init__.py').write_text('')
+        (fake / '__init__.py').write_text('')
+        (fake / 'build.py').write_text(_FAKE_SPHINX_BUILD)
+        (tmp_path / 'venv' / 'bin').mkdir(parents=True)
+        python = tmp_path / 'venv' / 'bin' / 'python'
+        python.symlink_to(sys.executable)
+        conf_dir = str(tmp_path / 'docs' / 'source')
+        env = dict(os.environ, PYTHONPATH=str(tmp_path / 'fake'),
+                   XDG_RUNTIME_DIR=str(tmp_path),
+                   CLICKABLE_SPHINX_WORKER_IDLE='10')
+        with unittest.mock.patch.dict(os.environ,
+                                      {'XDG_RUNTIME_DIR': str(tmp_path)}):
+            path = clickable.sphinx.worker._socket_path(str(python), conf_dir)
+            worker = subprocess.Popen(
+                [str(python), clickable.sphinx.worker.__file__, path,
+                 conf_dir], env=env)
+            try:
+                for i in range(100):
+                    if os.path.exists(path):
+                        break
+                    time.sleep(0.05)
+                assert os.path.exists(path)
+                clickable.sphinx.sphinx_worker_script(
+                    resolver, venv_config, conf_dir, ['0', 'html'])
+                assert capfd.readouterr().out \
+                    == 'built {} 0 html\n'.format(worker.pid)
+                with pytest.raises(subprocess.CalledProcessError):
+                    clickable.sphinx.sphinx_worker_script(
+                        resolver, venv_config, conf_dir, ['3'])
+
+                (tmp_path / 'docs' / 'source' / 'conf.py').write_text('')
+                with unittest.mock.patch(
+                        'clickable.sphinx.sphinx_script') as c_script, \
+                        unittest.mock.patch(
+                            'clickable.sphinx._spawn_worker') as c_spawn:
+                    clickable.sphinx.sphinx_worker_script(
+                        resolver, venv_config, conf_dir, ['0'])
+                    assert c_script.called
+                    assert c_spawn.called
+                worker.wait(timeout=5)
+            finally:
+                worker.kill()
+                worker.wait()
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'),
+                    reason='inotify is Linux only')
+class TestWatch:
+    """Tests for `clickable.sphinx.watch` and inotify `live` engine."""
+
+    def test_changes(self, tmp_path):
+        """Bursts are coalesced; ignored files and new folders are
+        handled."""
+        from clickable.sphinx.watch import _Inotify
+        with _Inotify(str(tmp_path), ['*.swp', '*~']) as inotify:
+            (tmp_path / '.index.rst.swp').write_text('')
+            (tmp_path / 'index.rst~').write_text('')
+            assert inotify.read(0.2) == []
+            assert inotify.read(0.1) is None
+            (tmp_path / 'sub').mkdir()
+            assert inotify.read(0.2) == [str(tmp_path / 'sub')]
+            (tmp_path / 'sub' / 'page.rst').write_text('Page\n')
+            assert str(tmp_path / 'sub' / 'page.rst') \
+                in inotify.read(0.2)
+
+    def test_debounce(self, tmp_path):
+        """Events within debounce window are reported once."""
+        import threading
+        from clickable.sphinx.watch import _changes
+
+        def write():
+            time.sleep(0.2)
+            for i in range(5):
+                (tmp_path / '{}.rst'.format(i)).write_text('x')
+                time.sleep(0.02)
+        changes = _changes(str(tmp_path), debounce=0.2)
+        thread = threading.Thread(target=write)
+        thread.start()
+        first, paths = next(changes)
+        thread.join()
+        changes.close()
+        assert paths == [str(tmp_path / '{}.rst'.format(i))
+                         for i in range(5)]
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_build')
+    def test_live(self, c_build, tmp_path, caplog):
+        """Each burst is rebuilt; failures do not stop watching."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        source = str(tmp_path / 'docs' / 'source')
+        bursts = [(time.monotonic(), [os.path.join(source, 'index.rst')]),
+                  (time.monotonic(), [os.path.join(source, 'conf.py')])]
+
+        def changes(path, ignore, debounce):
+            assert path == source
+            assert ignore == ['*.tmp']
+            yield from bursts
+            raise KeyboardInterrupt()
+        c_build.side_effect = [True, Exception('failed'), True]
+        caplog.set_level(logging.INFO)
+        sphinx_config['live_ignore'] = ['*.tmp']
+        with unittest.mock.patch('clickable.sphinx.watch._changes', changes):
+            clickable.sphinx.sphinx_live(resolver, sphinx_config,
+                                         venv_config, engine='inotify')
+        assert c_build.call_count == 3
+        assert 'build failed: failed' in caplog.text
+        assert 'rebuilt in' in caplog.text
+        assert 'stopped' in caplog.text
+
+    @unittest.mock.patch('clickable.sphinx.sphinx_script')
+    def test_live_autobuild(self, c_script, tmp_path):
+        """sphinx-autobuild ignores configured globs."""
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        sphinx_config['live_ignore'] = ['*.tmp']
+        clickable.sphinx.sphinx_live(resolver, sphinx_config, venv_config)
+        assert c_script.call_args[0][2] == 'sphinx-autobuild'
+        args = c_script.call_args[0][3]
+        assert args[0:2] == ['--ignore', '*.tmp']
+        assert '*.swp' not in args
+
+
+class TestClean:
+    """Tests for `sphinx_clean` and `clickable.sphinx.trash`."""
+
+    def _build(self, tmp_path):
+        resolver, sphinx_config, venv_config = _documentation(tmp_path)
+        build = tmp_path / 'docs' / 'build'
+        (build / '.gitkeep').write_text('')
+        for target in ['html', 'latex']:
+            (build / target / '_static').mkdir(parents=True)
+            for i in range(300):
+                (build / target / '{}.html'.format(i)).write_text('x')
+            (build / target / '_static' / 'style.css').write_text('x')
+        (build / 'html' / 'link').symlink_to(tmp_path / 'docs' / 'source')
+        return resolver, build
+
+    @unittest.mock.patch('clickable.sphinx._spawn_trash')
+    def test_clean(self, c_spawn, tmp_path):
+        """Outputs are moved to trash; .gitkeep is kept."""
+        resolver, build = self._build(tmp_path)
+        clickable.sphinx.sphinx_clean(resolver, 'docs')
+        trash = build / '.clickable-trash'
+        assert sorted(os.listdir(str(build))) \
+            == ['.clickable-trash', '.gitkeep']
+        batch, = os.listdir(str(trash))
+        assert batch.startswith('batch-{}-'.format(os.getpid()))
+        assert sorted(os.listdir(str(trash / batch))) == ['html', 'latex']
+        c_spawn.assert_called_once_with(str(trash))
+        # leftover trash is still handled
+        c_spawn.reset_mock()
+        clickable.sphinx.sphinx_clean(resolver, 'docs')
+        c_spawn.assert_called_once_with(str(trash))
+
+    def test_empty_trash(self, tmp_path):
+        """Sealed batches and pending batches of dead processes are
+        deleted; symlinks are not followed."""
+        import clickable.sphinx.trash
+        resolver, build = self._build(tmp_path)
+        trash = build / '.clickable-trash'
+        trash.mkdir()
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        os.rename(str(build / 'html'),
+                  str(trash / 'pending-{}-interrupted'.format(dead.pid)))
+        # a concurrent clean is filling this one
+        (trash / 'pending-{}-running'.format(os.getpid()) / 'x').mkdir(
+            parents=True)
+        with unittest.mock.patch('clickable.sphinx._spawn_trash'):
+            clickable.sphinx.sphinx_clean(resolver, 'docs')
+        clickable.sphinx.trash._empty_trash(str(trash), jobs=4)
+        assert os.listdir(str(trash)) \
+            == ['pending-{}-running'.format(os.getpid())]
+        assert sorted(os.listdir(str(build))) \
+            == ['.clickable-trash', '.gitkeep']
+        assert (tmp_path / 'docs' / 'source' / 'index.rst').is_file()
+
+    def test_clean_background(self, tmp_path):
+        """Detached process empties trash."""
+        resolver, build = self._build(tmp_path)
+        clickable.sphinx.sphinx_clean(resolver, 'docs')
+        for i in range(200):
+            if not (build / '.clickable-trash').exists():
+                break
+            time.sleep(0.05)
+        assert os.listdir(str(build)) == ['.gitkeep']
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `clickable.utils` package."""
+
+
+import os
+import sys
+import time
+import types
+import unittest.mock
+
+import pytest
+import yaml
+
+import clickable.cache
+import clickable.utils
+
+
+def _write(path, content, age=10):
+    path.write_text(content)
+    os.utime(str(path), (time.time() - age, time.time() - age))
+
+
+class TestLoadYaml:
+    """Tests for cached YAML loading."""
+
+    def test_cache(self, tmp_path):
+        """Parsed content is reused while file is unchanged."""
+        conf = tmp_path / 'clickables.yml'
+        _write(conf, 'a:\n  b: [1, 2]\n')
+        assert clickable.utils._load_yaml(str(conf)) == {'a': {'b': [1, 2]}}
+        assert (tmp_path / '__pycache__' / 'clickables.yml.clickable.pickle') \
+            .is_file()
+        with unittest.mock.patch.object(yaml, 'load') as load:
+            assert clickable.utils._load_yaml(str(conf)) \
+                == {'a': {'b': [1, 2]}}
+            assert not load.called
+        # same content, new stat: hash is used
+        os.utime(str(conf), (time.time() - 5, time.time() - 5))
+        with unittest.mock.patch.object(yaml, 'load') as load:
+            assert clickable.utils._load_yaml(str(conf)) \
+                == {'a': {'b': [1, 2]}}
+            assert not load.called
+        _write(conf, 'a: 1\n')
+        assert clickable.utils._load_yaml(str(conf)) == {'a': 1}
+
+    def test_racy(self, tmp_path):
+        """Recently modified file is checked by hash."""
+        conf = tmp_path / 'clickables.yml'
+        _write(conf, 'a: 1\n', age=0)
+        assert clickable.utils._load_yaml(str(conf)) == {'a': 1}
+        # same size and mtime, other content
+        stat = os.stat(str(conf))
+        conf.write_text('a: 2\n')
+        os.utime(str(conf), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert clickable.utils._load_yaml(str(conf)) == {'a': 2}
+
+    def test_load_config(self, tmp_path):
+        """Configuration is merged in context; debug dump is lazy."""
+        _write(tmp_path / 'clickables.yml',
+               'ansible:\n  virtualenv:\n    path: .venv\n')
+        module = types.ModuleType('clickables_test')
+        module.__file__ = str(tmp_path / 'clickables.py')
+        ctx = types.SimpleNamespace(obj=None)
+        with unittest.mock.patch.dict(sys.modules,
+                                      {'clickables_test': module}), \
+                unittest.mock.patch('pprint.pformat') as pformat:
+            clickable.utils.load_config(ctx, 'clickables_test',
+                                        module.__file__)
+            assert not pformat.called
+        assert ctx.obj['virtualenv_path'] == '.venv'
+        assert ctx.obj['project_root'] == str(tmp_path)
+
+
+class TestAtomicWrite:
+    """Tests for `clickable.cache._atomic_write`."""
+
+    def test_atomic_write(self, tmp_path):
+        """Parent folder is created, content is replaced."""
+        path = tmp_path / 'a' / 'b.json'
+        clickable.cache._atomic_write(str(path), lambda f: f.write('1'))
+        clickable.cache._atomic_write(str(path), lambda f: f.write('2'))
+        assert path.read_text() == '2'
+        assert os.listdir(str(tmp_path / 'a')) == ['b.json']
+
+    def test_atomic_write_error(self, tmp_path):
+        """Previous content is kept and temporary file removed."""
+        path = tmp_path / 'b.json'
+        path.write_text('1')
+
+        def write(f):
+            f.write('partial')
+            raise ValueError('failed')
+        with pytest.raises(ValueError):
+            clickable.cache._atomic_write(str(path), write)
+        assert path.read_text() == '1'
+        assert os.listdir(str(tmp_path)) == ['b.json']
@@ -0,0 +1,572 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for `clickable.virtualenv` package."""
+
+
+import importlib
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import threading
+import unittest
+import unittest.mock
+
+import pytest
+
+import clickable.virtualenv
+from clickable.virtualenv import fingerprint
+from clickable.virtualenv import lock as lock_module
+from clickable.virtualenv import lockfile as lockfile_module
+from clickable.virtualenv import metadata
+from clickable.virtualenv import template as template_module
+
+from tests import _Resolver
+
+# module is shadowed by `virtualenv` function in package namespace
+virtualenv_module = importlib.import_module('clickable.virtualenv.virtualenv')
+
+
+class TestFingerprint:
+    """Tests for `clickable.virtualenv.fingerprint` module."""
+
+    def test_fingerprint_stable(self, tmp_path):
+        """Same configuration gives same digest."""
+        config = {'path': 'venv', 'requirements': ['a==1', 'b']}
+        f1 = fingerprint._fingerprint(str(tmp_path), config)
+        f2 = fingerprint._fingerprint(str(tmp_path), dict(config))
+        assert f1['digest'] == f2['digest']
+
+    def test_fingerprint_changes(self, tmp_path):
+        """Requirements, selinux and conda environment are fingerprinted."""
+        config = {'path': 'venv', 'requirements': ['a==1']}
+        base = fingerprint._fingerprint(str(tmp_path), config)['digest']
+        other = dict(config, requirements=['a==2'])
+        assert fingerprint._fingerprint(str(tmp_path), other)['digest'] != base
+        other = dict(config, selinux=True)
+        assert fingerprint._fingerprint(str(tmp_path), other)['digest'] != base
+        with unittest.mock.patch.dict(os.environ, {'CONDA_PREFIX': '/conda'}):
+            assert fingerprint._fingerprint(str(tmp_path), config)['digest'] \
+                != base
+
+    def test_write_read(self, tmp_path):
+        """Written fingerprint matches; removed fingerprint does not."""
+        config = {'path': 'venv', 'requirements': ['a==1']}
+        f = fingerprint._fingerprint(str(tmp_path), config)
+        assert not fingerprint._fingerprint_matches(str(tmp_path), f)
+        fingerprint._write_fingerprint(str(tmp_path), f)
+        assert fingerprint._fingerprint_matches(str(tmp_path), f)
+        fingerprint._remove_fingerprint(str(tmp_path))
+        assert not fingerprint._fingerprint_matches(str(tmp_path), f)
+
+    @unittest.mock.patch("clickable.virtualenv._pip_packages")
+    @unittest.mock.patch("clickable.virtualenv._virtualenv")
+    def test_virtualenv_skip_pip(self, c_virtualenv, c_pip, tmp_path):
+        """pip runs once, then is skipped until forced."""
+        resolver = _Resolver(str(tmp_path))
+        config = {'path': 'venv', 'requirements': ['a==1']}
+        (tmp_path / 'venv').mkdir()
+        clickable.virtualenv.virtualenv(resolver, config)
+        clickable.virtualenv.virtualenv(resolver, config)
+        assert c_pip.call_count == 1
+        clickable.virtualenv.virtualenv(resolver, config, force=True)
+        assert c_pip.call_count == 2
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_VIRTUALENV_FORCE': 'yes'}):
+            clickable.virtualenv.virtualenv(resolver, config)
+        assert c_pip.call_count == 3
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    @unittest.mock.patch("clickable.virtualenv._virtualenv")
+    def test_virtualenv_force_reinstall(self, c_virtualenv, c_pip, tmp_path):
+        """Forced provisioning reinstalls satisfied requirements."""
+        resolver = _Resolver(str(tmp_path))
+        _site_packages(tmp_path / 'venv')
+        config = {'path': 'venv', 'requirements': ['my-package==1.0']}
+        clickable.virtualenv.virtualenv(resolver, config)
+        c_pip.assert_not_called()
+        clickable.virtualenv.virtualenv(resolver, config, force=True)
+        assert c_pip.call_args[0][1] == ['install', '--force-reinstall',
+                                         'my-package==1.0']
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_VIRTUALENV_FORCE': 'yes'}):
+            clickable.virtualenv.virtualenv(resolver, config)
+        assert c_pip.call_count == 2
+
+
+def _site_packages(tmp_path):
+    site_packages = tmp_path / 'lib' / 'python3.9' / 'site-packages'
+    site_packages.mkdir(parents=True)
+    dist_info = site_packages / 'My_Package-1.0.dist-info'
+    dist_info.mkdir()
+    (dist_info / 'METADATA').write_text(
+        'Metadata-Version: 2.1\nName: My_Package\nVersion: 1.0\n\nBody\n')
+    egg_info = site_packages / 'other-2.0-py3.9.egg-info'
+    egg_info.mkdir()
+    (egg_info / 'PKG-INFO').write_text('Name: other\nVersion: 2.0\n')
+    (site_packages / 'legacy-0.1-py3.9.egg-info').write_text(
+        'Name: legacy\nVersion: 0.1\n')
+    pip_info = site_packages / 'pip-21.0.dist-info'
+    pip_info.mkdir()
+    (pip_info / 'METADATA').write_text('Name: pip\nVersion: 21.0\n')
+    return site_packages
+
+
+class TestMetadata:
+    """Tests for `clickable.virtualenv.metadata` module."""
+
+    def test_installed_packages(self, tmp_path):
+        """dist-info, egg-info folders and files are read; pip is hidden
+        as with `pip freeze`."""
+        _site_packages(tmp_path)
+        assert metadata._installed_packages(str(tmp_path)) == \
+            set(['My_Package==1.0', 'other==2.0', 'legacy==0.1'])
+
+    def test_installed_packages_missing(self, tmp_path):
+        """No site-packages, no result."""
+        assert metadata._installed_packages(str(tmp_path)) is None
+
+    def test_unsatisfied_requirements(self, tmp_path):
+        """Names are canonicalized; pins, options and urls are checked
+        conservatively."""
+        _site_packages(tmp_path)
+        distributions = metadata._installed_distributions(str(tmp_path))
+        requirements = ['my-package==1.0', 'Other', 'pip', 'legacy==0.2',
+                        'missing', '-e .', 'x @ https://example.com/x.zip']
+        assert metadata._unsatisfied_requirements(
+            distributions, requirements) == \
+            ['legacy==0.2', 'missing', '-e .', 'x @ https://example.com/x.zip']
+
+    @unittest.mock.patch.object(metadata, '_packaging', lambda: None)
+    def test_unsatisfied_requirements_simple(self, tmp_path):
+        """Without packaging, only names and exact pins are satisfied."""
+        _site_packages(tmp_path)
+        distributions = metadata._installed_distributions(str(tmp_path))
+        requirements = ['my-package==1.0', 'other', 'other>=1', 'legacy==0.2']
+        assert metadata._unsatisfied_requirements(
+            distributions, requirements) == ['other>=1', 'legacy==0.2']
+
+
+class TestCheckVirtualenv:
+    """Tests for `_check_virtualenv`."""
+
+    def test_check_stat(self, tmp_path):
+        """A real venv is validated without running its interpreter;
+        result is memoized."""
+        venv = str(tmp_path / 'venv')
+        subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip',
+                               venv])
+        with unittest.mock.patch.object(
+                virtualenv_module, '_check_virtualenv_exec') as c_exec:
+            assert virtualenv_module._check_virtualenv(venv)
+            c_exec.assert_not_called()
+        with unittest.mock.patch.object(
+                virtualenv_module, '_check_virtualenv_stat') as c_stat:
+            assert virtualenv_module._check_virtualenv(venv)
+            c_stat.assert_not_called()
+        assert virtualenv_module._check_virtualenv(venv, deep=True)
+
+    def test_check_broken(self, tmp_path):
+        """Missing folder, broken home or interpreter are detected."""
+        venv = tmp_path / 'venv'
+        assert not virtualenv_module._check_virtualenv(str(venv))
+        (venv / 'bin').mkdir(parents=True)
+        (venv / 'pyvenv.cfg').write_text('home = {}\n'.format(tmp_path / 'x'))
+        assert not virtualenv_module._check_virtualenv(str(venv))
+        (venv / 'pyvenv.cfg').write_text('home = {}\n'.format(tmp_path))
+        (venv / 'bin' / 'python').symlink_to(tmp_path / 'missing')
+        assert not virtualenv_module._check_virtualenv(str(venv))
+
+
+class TestPipPackages:
+    """Tests for `_pip_packages`."""
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_pip_missing_only(self, c_pip, tmp_path):
+        """Only unsatisfied requirements are installed; satisfied ones are
+        constraints."""
+        _site_packages(tmp_path / 'venv')
+        config = {'path': 'venv',
+                  'requirements': ['my-package==1.0', 'other', 'missing']}
+        constraints = []
+
+        def pip(pip_binary, args):
+            with open(args[2]) as f:
+                constraints.extend(f.read().splitlines())
+        c_pip.side_effect = pip
+        virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        args = c_pip.call_args_list[0][0][1]
+        assert args[0:2] == ['install', '-c']
+        assert args[3:] == ['missing']
+        assert constraints == ['my-package==1.0', 'other']
+        assert virtualenv_module._constraint('a[x,y]>=1') == 'a>=1'
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_pip_skipped(self, c_pip, tmp_path):
+        """pip is not launched if everything is satisfied."""
+        _site_packages(tmp_path / 'venv')
+        config = {'path': 'venv', 'requirements': ['my-package==1.0']}
+        virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        c_pip.assert_not_called()
+
+
+class TestVirtualenvs:
+    """Tests for concurrent `virtualenvs` provisioning."""
+
+    def test_virtualenvs(self, tmp_path, caplog):
+        """Logs are not interleaved and failures are reported together."""
+        barrier = threading.Barrier(3, timeout=5)
+        logger = logging.getLogger('clickable.virtualenv.virtualenv')
+
+        def provision(path_resolver, configuration, force=False):
+            logger.warning('%s start', configuration['path'])
+            barrier.wait()
+            logger.warning('%s end', configuration['path'])
+            if configuration['path'] != 'ok':
+                raise Exception('boom')
+
+        configurations = [{'path': 'ok'}, {'path': 'ko1'}, {'path': 'ko2'}]
+        with unittest.mock.patch.object(clickable.virtualenv, 'virtualenv',
+                                        provision):
+            with pytest.raises(Exception) as e:
+                clickable.virtualenv.virtualenvs(
+                    _Resolver(str(tmp_path)), configurations, max_workers=3)
+        assert '2 provisioning failure(s)' in str(e.value)
+        messages = [r.getMessage() for r in caplog.records
+                    if r.name == logger.name]
+        assert len(messages) == 6
+        for i in range(0, 6, 2):
+            assert messages[i].split()[0] == messages[i + 1].split()[0]
+
+    def test_virtualenvs_duplicated(self, tmp_path):
+        """Same virtualenv path can not be provisioned twice."""
+        with pytest.raises(Exception):
+            clickable.virtualenv.virtualenvs(
+                _Resolver(str(tmp_path)), [{'path': 'a'}, {'path': './a'}])
+
+
+class TestTemplate:
+    """Tests for `clickable.virtualenv.template` module."""
+
+    def test_clone(self, tmp_path):
+        """Cloned virtualenv is valid; scripts are rewritten, other files
+        are shared with template."""
+        template = str(tmp_path / 'template')
+        clone = str(tmp_path / 'clone')
+        subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip',
+                               template])
+        script = os.path.join(template, 'bin', 'script')
+        with open(script, 'w') as f:
+            f.write('#!{}/bin/python\n'.format(template))
+        os.chmod(script, 0o755)
+        data = os.path.join(template, 'data.txt')
+        with open(data, 'w') as f:
+            f.write('data')
+        template_module._clone_virtualenv(template, clone)
+
+        assert virtualenv_module._check_virtualenv(clone)
+        with open(os.path.join(clone, 'bin', 'script')) as f:
+            assert f.read() == '#!{}/bin/python\n'.format(clone)
+        assert os.access(os.path.join(clone, 'bin', 'script'), os.X_OK)
+        assert os.path.samefile(os.path.join(clone, 'bin', 'python'),
+                                os.path.join(template, 'bin', 'python'))
+        with open(os.path.join(clone, 'data.txt')) as f:
+            assert f.read() == 'data'
+
+    def test_clone_broken(self, tmp_path):
+        """A broken existing virtualenv is replaced by the clone."""
+        template = str(tmp_path / 'template')
+        clone = tmp_path / 'clone'
+        subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip',
+                               template])
+        (clone / 'bin').mkdir(parents=True)
+        (clone / 'bin' / 'python').symlink_to(tmp_path / 'old' / 'python')
+        (clone / 'stale.txt').write_text('')
+        assert not virtualenv_module._check_virtualenv(str(clone))
+        template_module._clone_virtualenv(template, str(clone))
+        assert virtualenv_module._check_virtualenv(str(clone))
+        assert not (clone / 'stale.txt').exists()
+        assert sorted(os.listdir(str(tmp_path))) == ['clone', 'template']
+
+    def test_template_path(self):
+        """Template key depends on requirements."""
+        assert template_module._template_path({'requirements': ['a']}) \
+            != template_module._template_path({'requirements': ['b']})
+        assert template_module._template_path({'requirements': ['a']}) \
+            == template_module._template_path({'requirements': ['a']})
+
+    @unittest.mock.patch("clickable.virtualenv._clone_virtualenv")
+    @unittest.mock.patch("clickable.virtualenv._pip_packages")
+    @unittest.mock.patch("clickable.virtualenv._virtualenv")
+    def test_template_from_env(self, c_virtualenv, c_pip, c_clone,
+                               tmp_path):
+        """Template virtualenv itself is provisioned without template when
+        CLICKABLE_VIRTUALENV_TEMPLATE is set."""
+        template = str(tmp_path / 'template')
+        c_virtualenv.side_effect = lambda resolver, config: os.makedirs(
+            resolver.resolve_relative(config['path']), exist_ok=True)
+        assert not template_module._template_enabled(
+            {'template': False}, {'CLICKABLE_VIRTUALENV_TEMPLATE': '1'})
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_VIRTUALENV_TEMPLATE': '1',
+                             'CLICKABLE_VIRTUALENV_LOCK_TIMEOUT': '5'}), \
+                unittest.mock.patch("clickable.virtualenv._template_path",
+                                    return_value=template):
+            clickable.virtualenv.virtualenv(_Resolver(str(tmp_path)),
+                                            {'path': 'venv'})
+        c_clone.assert_called_once_with(template, str(tmp_path / 'venv'))
+        assert [c[0][1]['path'] for c in c_pip.call_args_list] \
+            == [template, 'venv']
+
+
+_LOCK_SCRIPT = """
+import sys, time
+from clickable.virtualenv.lock import _FileLock
+with _FileLock(sys.argv[1]):
+    with open(sys.argv[2], 'a') as f:
+        f.write('start\\n')
+        f.flush()
+        time.sleep(0.2)
+        f.write('end\\n')
+"""
+
+
+class TestLock:
+    """Tests for `clickable.virtualenv.lock` module."""
+
+    def test_lock_processes(self, tmp_path):
+        """Concurrent processes hold the lock one at a time."""
+        lock = str(tmp_path / 'venv.lock')
+        output = str(tmp_path / 'output')
+        processes = [subprocess.Popen([sys.executable, '-c', _LOCK_SCRIPT,
+                                       lock, output])
+                     for i in range(4)]
+        assert [p.wait() for p in processes] == [0] * 4
+        with open(output) as f:
+            assert f.read() == 'start\nend\n' * 4
+        assert not os.path.exists(lock)
+
+    def test_lock_stale(self, tmp_path):
+        """Lock of a dead process is removed."""
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        lock = tmp_path / 'venv.lock'
+        lock.write_text(json.dumps({'host': socket.gethostname(),
+                                    'pid': process.pid, 'token': 'dead'}))
+        with lock_module._FileLock(str(lock), timeout=1):
+            assert 'dead' not in lock.read_text()
+        assert not lock.exists()
+
+    def test_lock_timeout(self, tmp_path):
+        """Wait time is bounded."""
+        lock = str(tmp_path / 'venv.lock')
+        with lock_module._FileLock(lock):
+            with pytest.raises(Exception) as e:
+                with lock_module._FileLock(lock, timeout=0.3):
+                    pass
+            assert 'timeout' in str(e.value)
+
+
+_MISSING_DISTRIBUTION = virtualenv_module.PipError('pip', [
+    'ERROR: No matching distribution found for missing==1.0'])
+
+
+class TestWheelhouse:
+    """Tests for wheelhouse installs."""
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_wheelhouse_hit(self, c_pip, tmp_path):
+        """Install from wheelhouse, without index."""
+        _site_packages(tmp_path / 'venv')
+        config = {'path': 'venv', 'requirements': ['missing==1.0'],
+                  'wheelhouse': 'wheels'}
+        virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        assert c_pip.call_count == 1
+        args = c_pip.call_args[0][1]
+        assert args == ['install', '--no-index', '--find-links',
+                            str(tmp_path / 'wheels'), 'missing==1.0']
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_wheelhouse_miss(self, c_pip, tmp_path):
+        """Missing wheels are built, then installed."""
+        _site_packages(tmp_path / 'venv')
+        c_pip.side_effect = [_MISSING_DISTRIBUTION, None, None]
+        config = {'path': 'venv', 'requirements': ['missing==1.0'],
+                  'wheelhouse': 'wheels'}
+        virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        commands = [c[0][1][0] for c in c_pip.call_args_list]
+        assert commands == ['install', 'wheel', 'install']
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_wheelhouse_offline(self, c_pip, tmp_path):
+        """Offline mode fails fast if wheels are missing."""
+        _site_packages(tmp_path / 'venv')
+        c_pip.side_effect = _MISSING_DISTRIBUTION
+        config = {'path': 'venv', 'requirements': ['missing==1.0'],
+                  'wheelhouse': 'wheels', 'offline': True}
+        with pytest.raises(Exception) as e:
+            virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        assert 'offline' in str(e.value)
+        assert c_pip.call_count == 1
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_wheelhouse_failure(self, c_pip, tmp_path):
+        """Other install failures do not build wheels."""
+        _site_packages(tmp_path / 'venv')
+        c_pip.side_effect = virtualenv_module.PipError(
+            'pip', ['ERROR: Could not install packages due to an OSError'])
+        config = {'path': 'venv', 'requirements': ['missing==1.0'],
+                  'wheelhouse': 'wheels'}
+        with pytest.raises(virtualenv_module.PipError):
+            virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        assert c_pip.call_count == 1
+
+    def test_wheelhouse_env(self, tmp_path):
+        """Boolean CLICKABLE_WHEELHOUSE values select user wheelhouse."""
+        resolver = _Resolver(str(tmp_path))
+        for value, expected in [
+                ('1', str(tmp_path / 'cache' / 'wheelhouse')),
+                ('True', str(tmp_path / 'cache' / 'wheelhouse')),
+                ('no', None),
+                ('wheels', str(tmp_path / 'wheels'))]:
+            with unittest.mock.patch.dict(
+                    os.environ, {'CLICKABLE_WHEELHOUSE': value,
+                                 'CLICKABLE_CACHE_DIR': str(tmp_path / 'cache')}):
+                assert virtualenv_module._wheelhouse(resolver, {}) == expected
+
+    def test_settings_override_env(self, tmp_path):
+        """Explicit settings override environment."""
+        resolver = _Resolver(str(tmp_path))
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_WHEELHOUSE': 'wheels',
+                             'CLICKABLE_OFFLINE': '1'}):
+            assert virtualenv_module._wheelhouse(
+                resolver, {'wheelhouse': False}) is None
+            assert virtualenv_module._offline({})
+            assert not virtualenv_module._offline({'offline': False})
+
+
+class TestLockfile:
+    """Tests for lock file installs."""
+
+    def test_read_write(self, tmp_path):
+        """Written lock file is parsed back."""
+        lockfile = str(tmp_path / 'requirements.lock')
+        lockfile_module._write_lockfile(lockfile, {'b==2.0': ['bb'],
+                                                   'a==1.0': ['aa', 'ab']})
+        entries = lockfile_module._read_lockfile(lockfile)
+        assert [e.requirement for e in entries] == ['a==1.0', 'b==2.0']
+        assert entries[0].line == \
+            'a==1.0 --hash=sha256:aa --hash=sha256:ab'
+
+    @unittest.mock.patch.object(virtualenv_module, "_pip")
+    def test_lockfile_install(self, c_pip, tmp_path):
+        """Only unsatisfied pins are installed, without resolution."""
+        _site_packages(tmp_path / 'venv')
+        lockfile = str(tmp_path / 'requirements.lock')
+        lockfile_module._write_lockfile(lockfile, {'other==2.0': ['aa'],
+                                                   'missing==1.0': ['bb']})
+        installed = []
+
+        def pip(pip_binary, args):
+            with open(args[-1]) as f:
+                installed.append(f.read())
+        c_pip.side_effect = pip
+        config = {'path': 'venv', 'lockfile': 'requirements.lock'}
+        virtualenv_module._pip_packages(_Resolver(str(tmp_path)), config)
+        args = c_pip.call_args[0][1]
+        assert args[0:3] == ['install', '--no-deps', '--require-hashes']
+        assert installed == ['missing==1.0 --hash=sha256:bb\n']
+
+    def test_artifact_name(self):
+        """Project name is extracted from wheels and sdists."""
+        assert lockfile_module._artifact_name(
+            'My_Package-1.0-py3-none-any.whl') == 'My_Package'
+        assert lockfile_module._artifact_name(
+            'my-package-1.0.tar.gz') == 'my-package'
+
+
+class TestPip:
+    """Tests for `_pip` command runner."""
+
+    def test_pip_output_tail(self, tmp_path, caplog):
+        """Output is streamed; error keeps bounded output tail."""
+        script = tmp_path / 'pip'
+        script.write_text('#!/bin/sh\n'
+                          'echo "Collecting a"\n'
+                          'for i in 1 2 3 4 5; do echo "line $i"; done\n'
+                          'exit 3\n')
+        script.chmod(0o755)
+        caplog.set_level(logging.INFO)
+        with pytest.raises(virtualenv_module.PipError) as e:
+            virtualenv_module._pip(str(script), ['install'], tail_size=2)
+        assert e.value.output == ['line 4', 'line 5']
+        messages = [r.getMessage() for r in caplog.records]
+        assert 'pip: line 1' in messages
+        assert any('resolve' in m for m in messages)
+
+
+class TestSelinux:
+    """Tests for selinux interpreter probing."""
+
+    def _interpreters(self, tmp_path, outputs):
+        interpreters = []
+        for name, output in outputs:
+            script = tmp_path / name
+            if output:
+                script.write_text("#!/bin/sh\necho '{}'\n".format(
+                    json.dumps([str(tmp_path / o) for o in output])))
+            else:
+                script.write_text('#!/bin/sh\nexit 1\n')
+            script.chmod(0o755)
+            interpreters.append(str(script))
+        return interpreters
+
+    def test_probe_selinux(self, tmp_path):
+        """First usable interpreter in list order is selected; results
+        are cached."""
+        for name in ['a', 'b', 'c', 'd']:
+            (tmp_path / name).write_text('')
+        interpreters = self._interpreters(
+            tmp_path, [('none', None), ('first', ['a', 'b']),
+                       ('second', ['c', 'd'])])
+        interpreters.append(str(tmp_path / 'missing'))
+        expected = (interpreters[1], [str(tmp_path / 'a'),
+                                      str(tmp_path / 'b')])
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_CACHE_DIR': str(tmp_path / 'cache')}):
+            selected = virtualenv_module._probe_selinux(
+                interpreters, str(tmp_path / 'venv'))
+            assert selected == expected
+            with unittest.mock.patch.object(
+                    virtualenv_module, '_probe_selinux_interpreter',
+                    return_value=None) as c_probe:
+                selected = virtualenv_module._probe_selinux(
+                    interpreters, str(tmp_path / 'venv'))
+                # negative results are not cached
+                c_probe.assert_called_once_with(interpreters[0])
+            assert selected == expected
+
+    def test_probe_selinux_stale(self, tmp_path):
+        """Cached locations are probed again once removed."""
+        for name in ['a', 'b']:
+            (tmp_path / name).write_text('')
+        interpreters = self._interpreters(tmp_path, [('first', ['a', 'b'])])
+        with unittest.mock.patch.dict(
+                os.environ, {'CLICKABLE_CACHE_DIR': str(tmp_path / 'cache')}):
+            assert virtualenv_module._probe_selinux(
+                interpreters, str(tmp_path / 'venv'))
+            (tmp_path / 'a').unlink()
+            with unittest.mock.patch.object(
+                    virtualenv_module, '_probe_selinux_interpreter',
+                    return_value=None) as c_probe:
+                assert virtualenv_module._probe_selinux(
+                    interpreters, str(tmp_path / 'venv')) is None
+                assert c_probe.called
+
+    def test_python_major_version(self, tmp_path):
+        """Version is read from pyvenv.cfg."""
+        (tmp_path / 'pyvenv.cfg').write_text('version = 3.9.1\n')
+        assert virtualenv_module._python_major_version(str(tmp_path)) == 3